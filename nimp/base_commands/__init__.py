@@ -35,6 +35,7 @@ __all__ = [
     'package',
     'run',
     'run_legacy',
+    'serve',
     'symbol_server',
     'update_symbol_server',
     'upload',
@@ -22,16 +22,26 @@
 
 '''Dev & Testing related commands'''
 
+import concurrent.futures
+import heapq
 import logging
+import mmap
+import multiprocessing
+import os
+import sys
+import time
 
 import nimp.command
+import nimp.environment
+import nimp.summary
+import nimp.unreal
 
 
 class Dev(nimp.command.CommandGroup):
     '''Dev and test related commands.'''
 
     def __init__(self):
-        super(Dev, self).__init__([_TestLogPatterns()])
+        super(Dev, self).__init__([_TestLogPatterns(), _AnalyzeLog(), _ProfileLogPatterns()])
 
     def configure_arguments(self, env, parser):
         super(Dev, self).configure_arguments(env, parser)
@@ -65,3 +75,182 @@ class _TestLogPatterns(nimp.command.Command):
                 line = line[:-1]
                 logger.info(line)
         return True
+
+
+class _AnalyzeLog(nimp.command.Command):
+    '''Classifies a log file in parallel and merges results into the summary.'''
+
+    def __init__(self):
+        super(_AnalyzeLog, self).__init__()
+
+    def is_available(self, env):
+        return True, ''
+
+    def configure_arguments(self, env, parser):
+        super(_AnalyzeLog, self).configure_arguments(env, parser)
+
+        parser.add_argument('input_file', help='The log file to analyze')
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=os.cpu_count(), metavar='<count>', help='Number of worker processes'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=64, metavar='<MiB>', help='Size of the chunks given to workers'
+        )
+
+        return True
+
+    def run(self, env):
+        summary_handlers = [it for it in logging.root.handlers if isinstance(it, nimp.summary.SummaryHandler)]
+        summary_handler = summary_handlers[0] if summary_handlers else None
+        if summary_handler is None:
+            logging.error('Summary mode is disabled, use --summary to choose where to write results')
+            return False
+
+        # Workers only need summary related configuration, and keep every
+        # distinct message in memory, the summary handler limiting them
+        worker_env = {
+            key: value
+            for key, value in vars(env).items()
+            if key.startswith('summary_') or key.startswith('unreal_summary_')
+        }
+        worker_env.update(summary=None, verbose=False, summary_max_entries=sys.maxsize)
+
+        chunks = _AnalyzeLog._split(env.input_file, env.chunk_size * 1024 * 1024, type(summary_handler))
+        logging.info('Analyzing %s in %d chunk(s)…', env.input_file, len(chunks))
+        # Forking while logging threads run could leave workers deadlocked
+        mp_context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, env.jobs), mp_context=mp_context) as executor:
+            futures = [
+                executor.submit(_analyze_log_chunk, type(summary_handler), worker_env, env.input_file, *chunk)
+                for chunk in chunks
+            ]
+            for future in futures:
+                summary_handler.merge_chunk(future.result())
+        return True
+
+    @staticmethod
+    def _split(path, chunk_size, handler_type):
+        '''Returns (context start, start, end) offsets of line-aligned chunks'''
+        with open(path, 'rb') as log_file:
+            if os.fstat(log_file.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                chunks = []
+                start = 0
+                while start < len(data):
+                    end = data.find(b'\n', start + chunk_size)
+                    end = len(data) if end < 0 else end + 1
+                    context_start = start
+                    for _ in range(handler_type.CHUNK_CONTEXT_LINES):
+                        if context_start == 0:
+                            break
+                        context_start = data.rfind(b'\n', 0, context_start - 1) + 1
+                    chunks.append((context_start, start, end))
+                    start = end
+                return chunks
+
+
+def _analyze_log_chunk(handler_type, env, path, context_start, start, end):
+    '''Process pool worker classifying a chunk of log'''
+    with open(path, 'rb') as log_file:
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            context_lines = _split_lines(data[context_start:start])
+            lines = _split_lines(data[start:end])
+    handler_env = nimp.environment.Environment()
+    vars(handler_env).update(env)
+    handler = handler_type(handler_env)
+    return handler.analyze_chunk(context_lines, lines)
+
+
+def _split_lines(data):
+    if not data:
+        return []
+    lines = data.decode('utf-8', errors='replace').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return [it.rstrip('\r') for it in lines]
+
+
+class _ProfileLogPatterns(nimp.command.Command):
+    '''Measures how much each summary pattern costs on a sample log.'''
+
+    def __init__(self):
+        super(_ProfileLogPatterns, self).__init__()
+
+    def is_available(self, env):
+        return True, ''
+
+    def configure_arguments(self, env, parser):
+        super(_ProfileLogPatterns, self).configure_arguments(env, parser)
+
+        parser.add_argument('input_file', help='The sample log to match patterns against')
+        parser.add_argument(
+            '-n', '--top', type=int, default=None, metavar='<count>', help='Only show the costliest patterns'
+        )
+
+        return True
+
+    def run(self, env):
+        # The Unreal handler has every kind of pattern: built-in and configured
+        # summary patterns, as well as Unreal hints and asset patterns
+        handler = nimp.unreal.UnrealSummaryHandler(env)
+        patterns = handler.get_patterns()
+        pattern_sets = [(kind, f'<all {kind} patterns>', it) for kind, it in handler.get_pattern_sets()]
+
+        max_line_length = handler.max_line_length
+        with open(env.input_file, encoding='utf-8', errors='replace') as log_file:
+            lines = [line.rstrip('\r\n')[: max_line_length or None] for line in log_file]
+
+        results = []
+        for kind, pattern in patterns:
+            results.append((kind, pattern.pattern, *_ProfileLogPatterns._profile(pattern.match, lines)))
+        for kind, name, pattern_set in pattern_sets:
+            results.append((kind, name, *_ProfileLogPatterns._profile(pattern_set.match, lines)))
+        results.sort(key=lambda it: it[2], reverse=True)
+
+        total_time = sum(it[2] for it in results if not it[1].startswith('<')) or 1
+        print('%d lines, %d patterns' % (len(lines), len(patterns)))
+        header = ('time (ms)', '%', 'matches', 'worst (us)', 'line len', 'kind', 'pattern')
+        print('%10s %6s %8s %10s %10s  %-8s %s' % header)
+        for kind, pattern, elapsed, match_count, worst_time, worst_length in results[: env.top]:
+            percent = '' if pattern.startswith('<') else '%.1f' % (100.0 * elapsed / total_time)
+            print(
+                '%10.1f %6s %8d %10.1f %10d  %-8s %s'
+                % (elapsed / 1e6, percent, match_count, worst_time / 1e3, worst_length, kind, pattern)
+            )
+        return True
+
+    @staticmethod
+    def _profile(match, lines, candidates=20, repeat=5):
+        '''Returns total time, match count, worst time and length of the
+        line taking the worst time for the given match function'''
+        elapsed, match_count = 0, 0
+        slowest = []
+        clock = time.perf_counter_ns
+        for index, line in enumerate(lines):
+            start = clock()
+            result = match(line)
+            line_time = clock() - start
+            elapsed += line_time
+            if result is not None:
+                match_count += 1
+            if len(slowest) < candidates:
+                heapq.heappush(slowest, (line_time, index))
+            elif line_time > slowest[0][0]:
+                heapq.heapreplace(slowest, (line_time, index))
+
+        # Single measures are noisy, time the slowest lines again and keep
+        # their best time to find the actual worst case
+        worst_time, worst_length = 0, 0
+        for _, index in slowest:
+            line = lines[index]
+            line_time = min(_ProfileLogPatterns._time(match, line) for _ in range(repeat))
+            if line_time > worst_time:
+                worst_time, worst_length = line_time, len(line)
+        return elapsed, match_count, worst_time, worst_length
+
+    @staticmethod
+    def _time(match, line):
+        start = time.perf_counter_ns()
+        match(line)
+        return time.perf_counter_ns() - start
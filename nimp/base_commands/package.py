@@ -142,6 +142,7 @@ class UnrealPackageConfiguration:
         self.pak_collection = []
         self.pak_compression = False
         self.pak_compression_exclusions = []
+        self.pak_max_concurrency = 1
         self.layout_file_path = None
         self.ignored_errors = []
         self.ignored_warnings = []
@@ -279,6 +280,7 @@ class Package(nimp.command.Command):
         package_configuration.package_type = 'application'
         package_configuration.pak_collection = [None]
         package_configuration.pak_compression = env.compress
+        package_configuration.pak_max_concurrency = getattr(env, 'pak_max_concurrency', 1)
         package_configuration.is_microsoft = env.is_microsoft_platform
         package_configuration.is_sony = env.is_sony_platform
         package_configuration.is_nintendo = env.is_nintendo_platform
@@ -918,6 +920,19 @@ class Package(nimp.command.Command):
     def create_pak_file(env, package_configuration, pak_name, patch_base, destination):
         '''Create a content archive with the Unreal pak format'''
 
+        pak_command = Package._prepare_pak_file(env, package_configuration, pak_name, patch_base, destination)
+        if pak_command is None:
+            return
+
+        pak_success = nimp.sys.process.call(pak_command, dry_run=env.dry_run)
+        if pak_success != 0:
+            raise RuntimeError('Pak creation failed')
+
+    @staticmethod
+    def _prepare_pak_file(env, package_configuration, pak_name, patch_base, destination):
+        '''Writes the manifest of a pak file and returns the UnrealPak command
+        creating it, or None if there is nothing to pak'''
+
         engine_binaries_directory = (
             package_configuration.engine_directory + '/Binaries/' + package_configuration.worker_platform
         )
@@ -966,7 +981,7 @@ class Package(nimp.command.Command):
 
         if not all_files:
             logging.warning('No files for %s', pak_file_name)
-            return
+            return None
 
         logging.info('Creating manifest for pak %s', pak_file_name)
         if not env.dry_run:
@@ -1000,9 +1015,7 @@ class Package(nimp.command.Command):
         if is_patch:
             pak_command += ['-GeneratePatch=' + os.path.abspath(patch_base + '/' + pak_file_name + '.pak')]
 
-        pak_success = nimp.sys.process.call(pak_command, dry_run=env.dry_run)
-        if pak_success != 0:
-            raise RuntimeError('Pak creation failed')
+        return pak_command
 
     @staticmethod
     def _stage_title_files(package_configuration, dry_run):
@@ -1239,8 +1252,22 @@ class Package(nimp.command.Command):
 
         pak_patch_base = '{patch_base_directory}/{project}/Content/Paks'.format(**vars(package_configuration))
         pak_destination_directory = '{stage_directory}/{project}/Content/Paks'.format(**vars(package_configuration))
+        pak_jobs = []
         for pak_name in package_configuration.pak_collection:
-            Package.create_pak_file(env, package_configuration, pak_name, pak_patch_base, pak_destination_directory)
+            pak_command = Package._prepare_pak_file(
+                env, package_configuration, pak_name, pak_patch_base, pak_destination_directory
+            )
+            if pak_command is not None:
+                pak_jobs.append(
+                    nimp.sys.process.ProcessJob(pak_command, name=pak_name or package_configuration.project)
+                )
+
+        # Independent paks can be created concurrently
+        pak_results = nimp.sys.process.call_many(
+            pak_jobs, max_workers=package_configuration.pak_max_concurrency, dry_run=env.dry_run
+        )
+        if any(result != 0 for result in pak_results):
+            raise RuntimeError('Pak creation failed')
 
     @staticmethod
     def _stage_file(stage_directory, source, destination, dry_run):
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014-2025 Dontnod Entertainment
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Nimp server command'''
+
+import nimp.command
+import nimp.server
+import nimp.summary
+
+
+class Serve(nimp.command.Command):
+    '''Runs nimp commands of this workspace from a warm nimp process'''
+
+    def __init__(self):
+        super(Serve, self).__init__()
+
+    def configure_arguments(self, env, parser):
+        parser.add_argument(
+            '--idle-timeout',
+            metavar='<minutes>',
+            help='Stop serving after this time without commands, defaults to 60',
+            type=float,
+            default=60,
+        )
+        parser.add_argument('--stop', dest='stop_server', help='Stop the server of this workspace', action='store_true')
+        return True
+
+    def is_available(self, env):
+        if not nimp.server.is_supported():
+            return False, 'Serving nimp commands is not supported on Windows, as it needs Unix sockets and fork'
+        return True, ''
+
+    def run(self, env):
+        if env.stop_server:
+            return nimp.server.stop()
+
+        # Imported here, as it imports every command
+        from nimp.nimp_cli import run as run_command_line
+
+        # Commands are imported once, instead of in each served command
+        nimp.command.discover(env)
+        # Served commands are forked, which needs this process to run no
+        # other thread
+        nimp.summary.stop_logging_threads()
+        idle_timeout = env.idle_timeout * 60 if env.idle_timeout > 0 else None
+        return nimp.server.serve(run_command_line, idle_timeout)
@@ -34,47 +34,102 @@ import nimp.sys.process
 import nimp.system
 
 
-def _try_excecute(command, cwd='.', capture_output=True, max_attemtps=5, delay=5, time_out=120, dry_run=False):
-    '''retry in case autoSDK or devenv cache fails us'''
+# Output patterns telling that a devenv / MSBuild / UBT run is bound to fail.
+# Rules are (message, patterns) couples, patterns being a regular expression
+# or a tuple of regular expressions that must all be found in the output.
+RETRY_PATTERNS = [
+    ('AutoSDK error.', (r'ERROR: Unhandled exception: System\.', r':\\autoSDK\\HostWin64\\')),
+    ('Devenv cache error', r"Package 'RoslynPackage' failed to load"),
+    ('Devenv cache error', r"Package 'Visual Studio Build Manager Package' failed to load"),
+]
+
+ABORT_PATTERNS = [
+    ('Visual Studio appears to have failed', r'Cannot run if when setup is in progress\.'),
+]
+
+
+class _OutputRule:
+    '''Watches process output lines for a retry or abort rule'''
+
+    def __init__(self, message, patterns):
+        self.message = message
+        if isinstance(patterns, str):
+            patterns = (patterns,)
+        self._patterns = [re.compile(pattern) for pattern in patterns]
+        self._missing = []
+        self.reset()
+
+    def reset(self):
+        '''Forgets patterns found during a previous attempt'''
+        self._missing = list(self._patterns)
+
+    def feed(self, line):
+        '''Returns True once all patterns of this rule have been found'''
+        self._missing = [pattern for pattern in self._missing if pattern.search(line) is None]
+        return not self._missing
+
+
+def _try_excecute(
+    command,
+    cwd='.',
+    capture_output=True,
+    max_attemtps=5,
+    delay=5,
+    time_out=120,
+    dry_run=False,
+    retry_patterns=None,
+    abort_patterns=None,
+):
+    '''retry in case autoSDK or devenv cache fails us
+
+    Output is matched line by line against RETRY_PATTERNS / ABORT_PATTERNS and
+    the given retry_patterns / abort_patterns, without being kept in memory.
+    The process is killed as soon as a rule matches, unless it ran longer than
+    time_out seconds, in which case it is left to finish and not retried.'''
+    retry_rules = [_OutputRule(message, patterns) for message, patterns in RETRY_PATTERNS + (retry_patterns or [])]
+    abort_rules = [_OutputRule(message, patterns) for message, patterns in ABORT_PATTERNS + (abort_patterns or [])]
+
     attempt = 0
     while attempt <= max_attemtps:
-        retry = False
         start_time = time.time()
-        result, output, err = nimp.sys.process.call(command, cwd=cwd, capture_output=capture_output, dry_run=dry_run)
+        triggered = {}
+        for rule in retry_rules + abort_rules:
+            rule.reset()
+
+        def _watch_output(_, line):
+            for kind, rules in [('abort', abort_rules), ('retry', retry_rules)]:
+                for rule in rules:
+                    if kind in triggered or not rule.feed(line):
+                        continue
+                    triggered[kind] = rule
+                    logging.warn(rule.message)
+                    is_early = time.time() - start_time <= time_out
+                    if kind == 'abort' or (is_early and attempt < max_attemtps):
+                        raise nimp.sys.process.StopProcess(rule.message)
+
+        result = nimp.sys.process.call(
+            command, cwd=cwd, capture_output=_watch_output if capture_output else False, dry_run=dry_run
+        )
         if dry_run:
             return 0
         time_passed = time.time() - start_time
 
-        if result != 0:
-            # Legacy
-            if "Cannot run if when setup is in progress." in output:
-                logging.error('Visual Studio appears to have failed')
-                return False
-
-            if "ERROR: Unhandled exception: System." in output and ":\\autoSDK\\HostWin64\\" in output:
-                logging.warn('AutoSDK error.')
-                retry = True
-            if "Package 'RoslynPackage' failed to load" in output:
-                logging.warn('Devenv cache error')
-                retry = True
-            if "Package 'Visual Studio Build Manager Package' failed to load" in output:
-                logging.warn('Devenv cache error')
-                retry = True
-
-            if retry:
-                if attempt >= max_attemtps:
-                    logging.error('Max attempts reached, bailing...')
-                    return result
-                if time_passed > time_out:
-                    logging.warn('Not retrying error that happened late in the process')
-                    return result
-                attempt += 1
-                logging.warn(f'Retrying : attempt {attempt} out of {max_attemtps}...')
-                time.sleep(delay)
-            else:
-                return result
-        else:
+        if 'abort' in triggered:
+            logging.error('%s, not retrying', triggered['abort'].message)
+            return result if result != 0 else 1
+
+        if result == 0 or 'retry' not in triggered:
+            return result
+
+        if attempt >= max_attemtps:
+            logging.error('Max attempts reached, bailing...')
+            return result
+        if time_passed > time_out:
+            logging.warn('Not retrying error that happened late in the process')
             return result
+        attempt += 1
+        logging.warn(f'Retrying : attempt {attempt} out of {max_attemtps}...')
+        time.sleep(delay)
     return result
 
 
@@ -86,6 +141,8 @@ def msbuild(
     vs_version='14',
     dotnet_version='4.6',
     additional_flags=None,
+    retry_patterns=None,
+    abort_patterns=None,
 ):
     '''Builds a project with MSBuild'''
 
@@ -123,13 +180,23 @@ def msbuild(
     if additional_flags is not None:
         command += additional_flags
 
-    result = _try_excecute(command, capture_output=needCapture)
+    result = _try_excecute(
+        command, capture_output=needCapture, retry_patterns=retry_patterns, abort_patterns=abort_patterns
+    )
 
     return result == 0
 
 
 def vsbuild(
-    solution, platform_name, configuration, project=None, vs_version='14', target='Build', dotnet_version='4.6'
+    solution,
+    platform_name,
+    configuration,
+    project=None,
+    vs_version='14',
+    target='Build',
+    dotnet_version='4.6',
+    retry_patterns=None,
+    abort_patterns=None,
 ):
     '''Builds a project with Visual Studio'''
 
@@ -144,7 +211,7 @@ def vsbuild(
         if project is not None:
             command = command + ['/project', project]
 
-        result = _try_excecute(command)
+        result = _try_excecute(command, retry_patterns=retry_patterns, abort_patterns=abort_patterns)
 
         return result == 0
 
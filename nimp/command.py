@@ -24,6 +24,9 @@
 
 import abc
 import argparse
+import hashlib
+import importlib
+import json
 import logging
 import os
 import re
@@ -31,9 +34,13 @@ import sys
 
 import nimp.base_commands
 import nimp.command
+import nimp.system
 from nimp.utils.python import get_class_instances
 from nimp.utils.python import iter_plugins_entry_points
 
+# Increase when the command index format changes
+_COMMAND_INDEX_VERSION = 2
+
 
 class Command(metaclass=abc.ABCMeta):
     '''Abstract class for commands'''
@@ -106,31 +113,34 @@ def add_common_arguments(parser, *arg_ids):
             assert False, 'Unknown argument type'
 
 
-def discover(env):
+def discover(env, command_name=None):
+    '''Lists available commands in env.command_list. When command_name is
+    given and found in the command index, only the module defining this
+    command is imported'''
+    _add_project_paths(env)
+    if command_name is not None:
+        command = _load_indexed_command(env, command_name)
+        if command is not None:
+            env.command_list = [command]
+            return
+
     all_commands = {}
+    # Modules defining commands, used to invalidate the command index
+    package_names = ['nimp.base_commands', 'monorepo_commands', 'commands']
+    plugin_versions = {}
 
     # Import commands from base nimp
     get_class_instances(nimp.base_commands, nimp.command.Command, all_commands)
 
-    # Import legacy project-local commands from .nimp/commands
-    localpath = os.path.abspath(os.path.join(env.root_dir, '.nimp'))
-    if localpath not in sys.path:
-        sys.path.insert(0, localpath)
-        # Import monorepo commands if any - not legacy
-        if hasattr(env, 'uproject_dir') and hasattr(env, 'has_monorepo_commands') and env.has_monorepo_commands:
-            if os.path.exists(os.path.join(localpath, 'monorepo_commands')):
-                try:
-                    # pylint: disable=import-error
-                    import monorepo_commands
-
-                    get_class_instances(monorepo_commands, nimp.command.Command, all_commands)
-                except ImportError:
-                    pass
-    # Import project-local commands from .nimp/commands - not legacy
-    if hasattr(env, 'uproject_dir'):
-        uproject_dir = os.path.abspath(os.path.join(env.uproject_dir, '.nimp'))
-        if uproject_dir not in sys.path:
-            sys.path.insert(0, uproject_dir)
+    # Import monorepo commands if any - not legacy
+    if _has_monorepo_commands(env):
+        try:
+            # pylint: disable=import-error
+            import monorepo_commands
+
+            get_class_instances(monorepo_commands, nimp.command.Command, all_commands)
+        except ImportError:
+            pass
 
     try:
         # pylint: disable=import-error
@@ -142,6 +152,8 @@ def discover(env):
 
     # Import commands from plugins
     for entry_point in iter_plugins_entry_points():
+        package_names.append(entry_point.module)
+        plugin_versions[entry_point.value] = _get_plugin_version(entry_point)
         try:
             module = entry_point.load()
             get_class_instances(module, nimp.command.Command, all_commands)
@@ -152,6 +164,145 @@ def discover(env):
         [it for it in all_commands.values() if not it.__class__.__name__.startswith('_')],
         key=lambda command: command.__class__.__name__,
     )
+    _save_command_index(env, package_names, plugin_versions)
+
+
+def get_command_name(command):
+    '''Returns the name of a command on the command line'''
+    # custom command name, this comes in handy when command-names duplicate across sub command-groups
+    # i.e. nimp command-group sub-command-group-a generic-command-name
+    #      nimp command-group sub-command-group-b generic-command-name
+    command_name = getattr(command, "__command_name__", None)
+    # or else, guess from class name
+    if command_name is None:
+        name_array = re.findall('[A-Z][^A-Z]*', type(command).__name__)
+        command_name = '-'.join([it for it in name_array])
+    # mandatory
+    return command_name.lower()
+
+
+def _get_project_command_dirs(env):
+    '''Returns directories where project command packages are looked for,
+    and the packages themselves, which may not exist yet'''
+    nimp_dirs = [os.path.abspath(os.path.join(env.root_dir, '.nimp'))]
+    if hasattr(env, 'uproject_dir'):
+        nimp_dirs.append(os.path.abspath(os.path.join(env.uproject_dir, '.nimp')))
+    command_dirs = []
+    for nimp_dir in nimp_dirs:
+        command_dirs += [nimp_dir, os.path.join(nimp_dir, 'commands'), os.path.join(nimp_dir, 'monorepo_commands')]
+    return command_dirs
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _add_project_paths(env):
+    # Legacy project-local commands from .nimp/commands, and monorepo commands
+    localpath = os.path.abspath(os.path.join(env.root_dir, '.nimp'))
+    if localpath not in sys.path:
+        sys.path.insert(0, localpath)
+    # Project-local commands from .nimp/commands - not legacy
+    if hasattr(env, 'uproject_dir'):
+        uproject_dir = os.path.abspath(os.path.join(env.uproject_dir, '.nimp'))
+        if uproject_dir not in sys.path:
+            sys.path.insert(0, uproject_dir)
+
+
+def _has_monorepo_commands(env):
+    localpath = os.path.abspath(os.path.join(env.root_dir, '.nimp'))
+    return (
+        hasattr(env, 'uproject_dir')
+        and getattr(env, 'has_monorepo_commands', False)
+        and os.path.exists(os.path.join(localpath, 'monorepo_commands'))
+    )
+
+
+def _get_plugin_version(entry_point):
+    # Entry points only know their distribution since Python 3.10
+    dist = getattr(entry_point, 'dist', None)
+    return dist.version if dist is not None else None
+
+
+def _get_command_index_path(env):
+    key = [os.path.abspath(env.root_dir), os.path.abspath(getattr(env, 'uproject_dir', None) or '.')]
+    key.append(bool(_has_monorepo_commands(env)))
+    key_hash = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(nimp.system.get_cache_dir(), 'command_index_%s.json' % key_hash)
+
+
+def _get_source_mtimes(package_names):
+    '''Returns modification times of the modules imported from the given
+    packages, as well as of package directories so new modules are noticed'''
+    mtimes = {}
+    for module_name, module in list(sys.modules.items()):
+        if not any(module_name == it or module_name.startswith(it + '.') for it in package_names):
+            continue
+        paths = list(getattr(module, '__path__', []))
+        if getattr(module, '__file__', None):
+            paths.append(module.__file__)
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+    return mtimes
+
+
+def _save_command_index(env, package_names, plugin_versions):
+    index = {
+        'version': _COMMAND_INDEX_VERSION,
+        'sources': _get_source_mtimes(package_names),
+        'plugins': plugin_versions,
+        # Adding or removing project command packages and modules changes
+        # these, even when no command was found there before
+        'project_dirs': {it: _get_mtime(it) for it in _get_project_command_dirs(env)},
+        'commands': {},
+    }
+    for command in env.command_list:
+        command_class = type(command)
+        index['commands'][get_command_name(command)] = [command_class.__module__, command_class.__name__]
+
+    index_path = _get_command_index_path(env)
+    try:
+        nimp.system.write_file_atomically(index_path, json.dumps(index).encode('utf-8'))
+    except OSError as ex:
+        logging.debug('Error while saving command index %s: %s', index_path, ex)
+
+
+def _load_indexed_command(env, command_name):
+    index_path = _get_command_index_path(env)
+    try:
+        with open(index_path, encoding='utf-8') as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        return None
+
+    if index.get('version') != _COMMAND_INDEX_VERSION or command_name not in index['commands']:
+        return None
+    for path, mtime in index['sources'].items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime:
+                return None
+        except OSError:
+            return None
+    plugin_versions = {it.value: _get_plugin_version(it) for it in iter_plugins_entry_points()}
+    if plugin_versions != index['plugins']:
+        return None
+    if {it: _get_mtime(it) for it in _get_project_command_dirs(env)} != index['project_dirs']:
+        return None
+
+    module_name, class_name = index['commands'][command_name]
+    try:
+        command_class = getattr(importlib.import_module(module_name), class_name)
+        return command_class()
+    # pylint: disable=broad-except
+    except Exception as ex:
+        logging.debug('Error loading indexed command %s: %s', command_name, ex)
+        return None
 
 
 def load_arguments(env):
@@ -176,29 +327,27 @@ def add_commands_subparser(commands, parser, env, required=False):
     )
     subparsers = parser.add_subparsers(metavar='<command>', description=command_description, required=required)
 
+    # Commands not named on the command line cannot be selected, so they are
+    # neither probed nor configured, only listed
+    command_words = getattr(env, 'command_words', None)
+
     for command_it in commands:
         command_class = type(command_it)
+        command_name = get_command_name(command_it)
 
-        # custom command name, this comes in handy when command-names duplicate across sub command-groups
-        # i.e. nimp command-group sub-command-group-a generic-command-name
-        #      nimp command-group sub-command-group-b generic-command-name
-        command_name = getattr(command_it, "__command_name__", None)
-        # or else, guess from class name
-        if command_name is None:
-            name_array = re.findall('[A-Z][^A-Z]*', command_class.__name__)
-            command_name = '-'.join([it for it in name_array])
-        # mandatory
-        command_name = command_name.lower()
+        description = ''
+        command_help = command_class.__doc__ or "NO HELP AVAILABLE, FIX ME!"
+        command_help = command_help.split('\n')[0]
+
+        if command_words is not None and command_name not in command_words:
+            subparsers.add_parser(command_name, help=command_help)
+            continue
 
         try:
             enabled, reason = command_it.is_available(env)
         except Exception as ex:  # pylint: disable = broad-except
             enabled, reason = False, 'Unexpected error: ' + str(ex)
 
-        description = ''
-        command_help = command_class.__doc__ or "NO HELP AVAILABLE, FIX ME!"
-        command_help = command_help.split('\n')[0]
-
         if not enabled:
             description = 'This command is currently disabled :\n' + reason
             command_help = '[DISABLED] ' + command_help
@@ -28,13 +28,14 @@ import logging
 import os
 import re
 import sys
-import time
 
 import nimp.command
 import nimp.summary
 import nimp.sys.platform
 import nimp.system
 import nimp.unreal
+import nimp.utils.config_cache
+import nimp.utils.interpolation
 import nimp.utils.profiling
 from nimp.exceptions import NimpCommandFailed
 from nimp.utils.python import iter_plugins_entry_points
@@ -45,6 +46,8 @@ _LOG_FORMATS = {  # pylint: disable = invalid-name
 
 _SUMMARY_HANDLERS = {  # pylint: disable = invalid-name
     'default': nimp.summary.DefaultSummaryHandler,
+    'jsonl': nimp.summary.JsonLinesSummaryHandler,
+    'sarif': nimp.summary.SarifSummaryHandler,
     'unreal': nimp.unreal.UnrealSummaryHandler,
 }
 
@@ -62,13 +65,22 @@ class Environment:
         self.dry_run = False
         self.summary = None
         self.debug_env = {}
+        # Words of the command line, only commands named there are configured
+        # in the argument parser. None configures every command.
+        self.command_words = None
 
     def load_argument_parser(self, parent_parser):
         '''Returns an argument parser for nimp and its subcommands'''
+        parser = self._create_argument_parser(parent_parser)
+        nimp.command.add_commands_subparser(self.command_list, parser, self)
+        return parser
+
+    def _create_argument_parser(self, parent_parser, **kwargs):
+        '''Returns an argument parser for nimp options, without subcommands'''
         # prog_description = 'Script utilities to ship games, mostly Unreal Engine based ones.'
         # parser = argparse.ArgumentParser(description = prog_description)
         prog_description = 'Script utilities to ship games, mostly Unreal Engine based ones.'
-        parser = argparse.ArgumentParser(description=prog_description, parents=[parent_parser])
+        parser = argparse.ArgumentParser(description=prog_description, parents=[parent_parser], **kwargs)
         log_group = parser.add_argument_group("Logging")
         profiling_group = parser.add_argument_group("Profiling")
 
@@ -98,11 +110,31 @@ class Environment:
         log_group.add_argument('-v', '--verbose', help='Enable verbose mode', action='store_true')
 
         profiling_group.add_argument('--nimp-profiling', help='Profile nimp command', action='store_true')
-
-        nimp.command.add_commands_subparser(self.command_list, parser, self)
+        profiling_group.add_argument(
+            '--nimp-profiling-output',
+            metavar='<prefix>',
+            help='Profiling output files prefix, defaults to nimp_profile',
+            type=str,
+            default='nimp_profile',
+        )
 
         return parser
 
+    def _get_command_name(self, parent_parser, argv):
+        '''Returns the name of the command given on the command line, or None
+        if there is none or help on nimp itself is requested'''
+        parser = self._create_argument_parser(parent_parser, add_help=False, exit_on_error=False)
+        try:
+            _, remaining = parser.parse_known_args(argv[1:])
+        except argparse.ArgumentError:
+            return None
+        for arg in remaining:
+            if arg in ('-h', '--help'):
+                return None
+            if not arg.startswith('-'):
+                return arg
+        return None
+
     def load_arguments(self):
         '''Executes arguments loader to clean and tweak argument variables'''
         for argument_loader in Environment.argument_loaders:
@@ -122,30 +154,16 @@ class Environment:
 
     def run(self, argv):
         '''Runs nimp with argv and argc'''
+        with nimp.utils.profiling.profile_run(self, argv):
+            return self._run(argv)
+
+    def _run(self, argv):
         exit_success = 0
         exit_error = 1
         exit_warnings = 2
 
         # parses sys.argv in search of a manual uproject input
-        parent_parser = argparse.ArgumentParser(add_help=False)
-        parent_parser.add_argument(
-            '--uproject',
-            metavar='<unreal project>',
-            help='Select an Unreal project to work with, i.e. PRO/PRO.uproject',
-            type=str,
-        )
-        parent_parser.add_argument(
-            '--branch', metavar='<project branch>', help='Select a project branch to work with', type=str
-        )
-        parent_parser.add_argument(
-            '--user-config', metavar='<config file>', help='Custom nimp configuration file', type=str
-        )
-        parent_parser.add_argument(
-            '--default-to-config',
-            action='store_true',
-            default=False,
-            help='If enabled, missing arguments will be read from the configuration files',
-        )
+        parent_parser = _create_parent_parser()
         parent_args, unkown_args = parent_parser.parse_known_args(sys.argv[1:])
 
         # Set this early so we can use it from command.add_commands_subparser
@@ -154,41 +172,30 @@ class Environment:
         # verify that uproject seems somewhat legit
         self.validate_uproject(parent_args.uproject)
 
-        # base_conf for monorepo
-        if not self._load_nimp_conf('.baseNimp.conf'):
-            return exit_error
-        # legacy conf
-        if not hasattr(self, 'root_dir') or not self.root_dir:
-            if not self._load_nimp_conf('.nimp.conf'):
+        with nimp.utils.profiling.phase('config loading'):
+            if not self._load_config(parent_args):
                 return exit_error
 
-        if parent_args.user_config:
-            if not self._load_nimp_conf(parent_args.user_config):
-                return exit_error
-
-        for config_loader in Environment.config_loaders:
-            if not config_loader(self):
-                logging.error('Error while loading nimp config')
-                return exit_error
-
-        if not self._load_project_conf():
-            return exit_error
-
-        if not hasattr(self, 'root_dir') or not self.root_dir:
-            self.root_dir = '.'
-
         # Discover platforms
-        nimp.sys.platform.discover(self)
+        with nimp.utils.profiling.phase('platform discovery'):
+            nimp.sys.platform.discover(self)
 
-        # Discover all available commands
-        nimp.command.discover(self)
+        # Discover available commands, only importing the selected one when
+        # the command index knows where it is defined
+        with nimp.utils.profiling.phase('command discovery'):
+            nimp.command.discover(self, self._get_command_name(parent_parser, argv))
 
         # Loads argument parser, parses argv with it and adds command line parameters
-        # as properties of the environment
-        parser = self.load_argument_parser(parent_parser)
-        if self.default_to_config:
-            self.set_parser_defaults(parser)
-        arguments, unknown = parser.parse_known_args(argv[1:])
+        # as properties of the environment. Help lists every command, with
+        # disabled ones marked as such.
+        with nimp.utils.profiling.phase('argument parsing'):
+            if '-h' not in argv[1:] and '--help' not in argv[1:]:
+                self.command_words = set(argv[1:])
+            parser = self.load_argument_parser(parent_parser)
+            self.command_words = None
+            if self.default_to_config:
+                self.set_parser_defaults(parser)
+            arguments, unknown = parser.parse_known_args(argv[1:])
 
         # TODO: remove this crappy hacks
         arguments.branch = self.branch if hasattr(self, 'branch') and arguments.branch is None else arguments.branch
@@ -211,10 +218,6 @@ class Environment:
 
         summary_format = getattr(self, 'summary_format')
         with _SUMMARY_HANDLERS[summary_format](self) as log_handler:
-            if "NIMP_LOG_FILE" in os.environ:
-                # PATCHING ROOT LOGGER
-                logging.getLogger().addHandler(log_handler.log_all_handler)
-
             # Always display engine and selected uproject info
             self.display_unreal_info()
 
@@ -244,7 +247,7 @@ class Environment:
                 success = True
             else:
                 try:
-                    with nimp.utils.profiling.nimp_profile(self):
+                    with nimp.utils.profiling.nimp_profile(self), nimp.utils.profiling.phase('command'):
                         success = self.command.run(self)
                         if not success:
                             raise NimpCommandFailed("Nimp command failed.")
@@ -275,11 +278,7 @@ class Environment:
         '''Interpolates given string with config values & command line para-
         meters set in the environment'''
         assert isinstance(fmt, str)
-        kwargs = vars(self).copy()
-        kwargs.update(override_kwargs)
-        result = fmt.format(**kwargs)
-        result = time.strftime(result)
-        return result
+        return nimp.utils.interpolation.interpolate(fmt, vars(self), override_kwargs)
 
     def call(self, method, *args, **override_kwargs):
         '''Calls a method after interpolating its arguments'''
@@ -311,6 +310,62 @@ class Environment:
 
         return True
 
+    def _load_config(self, parent_args):
+        '''Loads configuration files and runs config loaders. When the
+        NIMP_ENVIRONMENT_SNAPSHOT environment variable is set, or when run by
+        nimp serve, the resulting environment is saved and reused until any
+        file read, directory listed or environment variable read while loading
+        changes.'''
+        use_snapshot = os.environ.get('NIMP_ENVIRONMENT_SNAPSHOT') or nimp.utils.config_cache.keeps_snapshots()
+        if not use_snapshot:
+            return self._load_config_files(parent_args)
+
+        snapshot_key = _get_snapshot_key(os.getcwd(), parent_args)
+        snapshot = nimp.utils.config_cache.load_snapshot(snapshot_key)
+        if snapshot is not None:
+            logging.debug('Using environment snapshot')
+            values, changed_variables = snapshot
+            self.__dict__.update(values)
+            # Configuration files may also have changed environment variables
+            for name, value in changed_variables.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            return True
+
+        with nimp.utils.config_cache.record_inputs() as inputs:
+            if not self._load_config_files(parent_args):
+                return False
+        nimp.utils.config_cache.save_snapshot(snapshot_key, vars(self), inputs)
+        return True
+
+    def _load_config_files(self, parent_args):
+        # base_conf for monorepo
+        if not self._load_nimp_conf('.baseNimp.conf'):
+            return False
+        # legacy conf
+        if not hasattr(self, 'root_dir') or not self.root_dir:
+            if not self._load_nimp_conf('.nimp.conf'):
+                return False
+
+        if parent_args.user_config:
+            if not self._load_nimp_conf(parent_args.user_config):
+                return False
+
+        for config_loader in Environment.config_loaders:
+            if not config_loader(self):
+                logging.error('Error while loading nimp config')
+                return False
+
+        if not self._load_project_conf():
+            return False
+
+        if not hasattr(self, 'root_dir') or not self.root_dir:
+            self.root_dir = '.'
+
+        return True
+
     def setup_envvars(self):
         '''Applies environment variables from .nimp.conf'''
 
@@ -340,6 +395,9 @@ class Environment:
 
         nimp_conf_file = '.nimp.conf'
 
+        # Creating project configuration files must invalidate snapshots
+        nimp.utils.config_cache.add_input(os.path.join(self.uproject_dir, nimp_conf_file))
+        nimp.utils.config_cache.add_input(os.path.join(self.uproject_dir, '.nimp', 'config.py'))
         if not os.path.isfile(os.path.join(self.uproject_dir, nimp_conf_file)):
             return True
 
@@ -397,6 +455,49 @@ class Environment:
         return hasattr(self, attribute_name) and getattr(self, attribute_name) is not None
 
 
+def _create_parent_parser():
+    '''Returns the parser of options needed before loading configuration'''
+    parent_parser = argparse.ArgumentParser(add_help=False)
+    parent_parser.add_argument(
+        '--uproject',
+        metavar='<unreal project>',
+        help='Select an Unreal project to work with, i.e. PRO/PRO.uproject',
+        type=str,
+    )
+    parent_parser.add_argument(
+        '--branch', metavar='<project branch>', help='Select a project branch to work with', type=str
+    )
+    parent_parser.add_argument(
+        '--user-config', metavar='<config file>', help='Custom nimp configuration file', type=str
+    )
+    parent_parser.add_argument(
+        '--default-to-config',
+        action='store_true',
+        default=False,
+        help='If enabled, missing arguments will be read from the configuration files',
+    )
+    return parent_parser
+
+
+def _get_snapshot_key(cwd, parent_args):
+    loaders = ['%s.%s' % (it.__module__, it.__qualname__) for it in Environment.config_loaders]
+    return [cwd, vars(parent_args), loaders]
+
+
+def get_command_name(argv):
+    '''Returns the name of the command given on a nimp command line, or None'''
+    # pylint: disable = protected-access
+    return Environment()._get_command_name(_create_parent_parser(), argv)
+
+
+def load_config_snapshot(argv, cwd):
+    '''Loads the environment snapshot of a nimp command line run from the
+    given directory, if there is a valid one. Snapshots are kept in memory
+    when requested to nimp.utils.config_cache, for processes forked later.'''
+    parent_args, _ = _create_parent_parser().parse_known_args(argv[1:])
+    return nimp.utils.config_cache.load_snapshot(_get_snapshot_key(cwd, parent_args)) is not None
+
+
 def execute_hook(hook_name, *args):
     '''Executes a hook in the .nimp/hooks directory'''
     # Always look for project level hook first
@@ -415,15 +516,21 @@ def execute_hook(hook_name, *args):
 def read_config_file(filename):
     '''Reads a config file and returns a dictionary with values defined in it'''
     try:
-        conf = open(filename, "rb").read()
+        # Compiled configuration files are cached, as they are not imported
+        code = nimp.utils.config_cache.load_code(filename)
+        if code is None:
+            conf = open(filename, "rb").read()
     except IOError as ex:
         logging.error("Unable to open configuration file: %s", ex)
         return None
     # Parse configuration file
     try:
+        if code is None:
+            code = compile(conf, filename, 'exec')
+            nimp.utils.config_cache.save_code(filename, code)
         local_vars = {}
         # pylint: disable=exec-used
-        exec(compile(conf, filename, 'exec'), local_vars)
+        exec(code, local_vars)
         if "config" in local_vars:
             return local_vars["config"]
         logging.error("Configuration file %s has no 'config' section.", filename)
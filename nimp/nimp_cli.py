@@ -32,13 +32,15 @@ import traceback
 
 import nimp.command
 import nimp.environment
+import nimp.server
 import nimp.system
 import nimp.sys.process
 import nimp.unreal
 
 import nimp.base_commands
 
-sys.dont_write_bytecode = 1
+# Bytecode of project commands is kept in the nimp cache, not in workspaces
+sys.pycache_prefix = os.path.join(nimp.system.get_cache_dir(), 'pycache')
 
 if 'MSYS_NT' in platform.system():
     raise NotImplementedError('MSYS Python is not supported; please use MinGW Python instead')
@@ -66,6 +68,24 @@ def _clean_environment_variables():
 def main(argv=sys.argv):
     '''Nimp entry point'''
 
+    # Commands are run by the nimp server of the workspace, if one is running
+    result = nimp.server.forward(argv)
+    if result is not None:
+        return result
+
+    nimp.environment.Environment.config_loaders += [nimp.unreal.load_config]
+
+    argument_loaders = [nimp.command.load_arguments, nimp.unreal.load_arguments]
+
+    nimp.environment.Environment.argument_loaders += argument_loaders
+
+    return run(argv)
+
+
+def run(argv):
+    '''Runs a nimp command line, config and argument loaders being already
+    registered'''
+
     start = time.time()
 
     result = 0
@@ -80,12 +100,6 @@ def main(argv=sys.argv):
 
         _clean_environment_variables()
 
-        nimp.environment.Environment.config_loaders += [nimp.unreal.load_config]
-
-        argument_loaders = [nimp.command.load_arguments, nimp.unreal.load_arguments]
-
-        nimp.environment.Environment.argument_loaders += argument_loaders
-
         result = nimp.environment.Environment().run(argv)
 
     except KeyboardInterrupt:
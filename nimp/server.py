@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014-2025 Dontnod Entertainment
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Nimp server, running command lines of a workspace from forked copies of a
+warm nimp process, and the client forwarding command lines to it'''
+
+import hashlib
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import nimp.environment
+import nimp.system
+import nimp.utils.config_cache
+import nimp.utils.profiling
+
+# Increase when messages exchanged between clients and servers change
+_PROTOCOL_VERSION = 1
+
+_FORWARDED_SIGNALS = ['SIGINT', 'SIGTERM', 'SIGHUP']
+
+
+def is_supported():
+    '''Returns True if nimp can be served on this platform, which needs Unix
+    sockets able to pass file descriptors, and fork'''
+    return hasattr(socket, 'AF_UNIX') and hasattr(socket, 'send_fds') and hasattr(os, 'fork')
+
+
+def get_socket_path():
+    '''Returns the path of the socket of the server of the workspace
+    containing the working directory'''
+    workspace_dir = os.getcwd()
+    for marker in ('.baseNimp.conf', '.nimp.conf'):
+        marker_dir = nimp.system.find_dir_containing_file(marker)
+        if marker_dir:
+            workspace_dir = os.path.abspath(marker_dir)
+            break
+    key = hashlib.sha1(workspace_dir.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(_get_servers_dir(), key + '.sock')
+
+
+def _get_servers_dir():
+    return os.path.join(nimp.system.get_cache_dir(), 'servers')
+
+
+def forward(argv):
+    '''Runs a command line with the server of the current workspace, the
+    command using this process standard streams. Returns its exit code, or
+    None if there is no server to run it or if disabled by setting the
+    NIMP_SERVER environment variable to 0.'''
+    if os.environ.get('NIMP_SERVER') == '0' or not is_supported():
+        return None
+    # Every nimp run goes through here, so looking for the workspace is only
+    # done once some server is running
+    try:
+        if not os.listdir(_get_servers_dir()):
+            return None
+    except OSError:
+        return None
+    socket_path = get_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    if nimp.environment.get_command_name(argv) == 'serve':
+        return None
+
+    request = {
+        'version': _PROTOCOL_VERSION,
+        'argv': list(argv),
+        'cwd': os.getcwd(),
+        'environment': dict(os.environ),
+    }
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        # Commands write directly to standard streams, so they see the same
+        # terminal as if run from this process
+        socket.send_fds(client, [b'\0'], [0, 1, 2])
+        _send_message(client, request)
+        reader = client.makefile('rb')
+        response = _read_message(reader)
+    except (OSError, ValueError) as ex:
+        logging.debug('Cannot use nimp server %s: %s', socket_path, ex)
+        client.close()
+        return None
+    if response is None or not response.get('accepted'):
+        client.close()
+        return None
+
+    def _forward_signal(signum, _):
+        try:
+            _send_message(client, {'signal': signum})
+        except OSError:
+            pass
+
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signal_name in _FORWARDED_SIGNALS:
+            signum = getattr(signal, signal_name)
+            previous_handlers[signum] = signal.signal(signum, _forward_signal)
+    try:
+        response = _read_message(reader)
+    except (OSError, ValueError):
+        response = None
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        client.close()
+
+    if response is None:
+        logging.error('Lost connection to nimp server %s', socket_path)
+        return 1
+    return response['exit_code']
+
+
+def stop():
+    '''Stops the server of the current workspace'''
+    socket_path = get_socket_path()
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(b'\0')
+        _send_message(client, {'version': _PROTOCOL_VERSION, 'stop': True})
+        response = _read_message(client.makefile('rb'))
+    except (OSError, ValueError) as ex:
+        logging.error('No nimp server to stop: %s', ex)
+        return False
+    finally:
+        client.close()
+    return response is not None and response.get('accepted', False)
+
+
+def serve(run, idle_timeout=None):
+    '''Serves command lines of the current workspace until stopped or idle
+    for idle_timeout seconds. Each command line runs in a process forked from
+    this one, calling run with it, where configuration and argument loaders
+    are already registered and nimp modules imported.
+
+    Serving is not supported on Windows, and must be done from the main
+    thread while no other thread runs, as forking from a process running
+    other threads may leave the forked process deadlocked.'''
+    if not is_supported():
+        logging.error('Serving nimp commands needs Unix sockets and fork, which are not available on this platform')
+        return False
+    other_threads = [it.name for it in threading.enumerate() if it is not threading.current_thread()]
+    if threading.current_thread() is not threading.main_thread() or other_threads:
+        logging.error(
+            'Nimp commands can only be served from the main thread, with no other thread running: %s',
+            ', '.join(other_threads),
+        )
+        return False
+    return _Server(run, idle_timeout).serve()
+
+
+class _Server:
+    '''Single threaded server, so it can safely fork: a selector waits for
+    clients, for signals forwarded by clients of running commands, and for
+    SIGCHLD, which reports finished commands'''
+
+    def __init__(self, run, idle_timeout):
+        self._run = run
+        self._idle_timeout = idle_timeout
+        self._socket_path = get_socket_path()
+        self._listener = None
+        self._selector = None
+        self._wakeup_sockets = ()
+        self._sources = {}
+        # Client connections of running commands, by pid
+        self._children = {}
+
+    def serve(self):
+        os.makedirs(os.path.dirname(self._socket_path), mode=0o700, exist_ok=True)
+        if self._is_running():
+            logging.error('A nimp server is already running for this workspace (%s)', self._socket_path)
+            return False
+        try:
+            os.unlink(self._socket_path)
+        except FileNotFoundError:
+            pass
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self._socket_path)
+        os.chmod(self._socket_path, 0o600)
+        socket_inode = os.stat(self._socket_path).st_ino
+        self._listener.listen()
+        self._listener.setblocking(False)
+
+        # Signal handlers only set a flag, the selector is woken up by
+        # signal bytes written to the wakeup socket
+        self._wakeup_sockets = socket.socketpair()
+        for wakeup_socket in self._wakeup_sockets:
+            wakeup_socket.setblocking(False)
+        previous_wakeup_fd = signal.set_wakeup_fd(self._wakeup_sockets[1].fileno())
+        previous_sigchld_handler = signal.signal(signal.SIGCHLD, lambda *_: None)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_sockets[0], selectors.EVENT_READ)
+
+        # Children load environment snapshots from the server memory
+        nimp.utils.config_cache.keep_snapshots()
+        self._sources = _get_source_signatures()
+
+        logging.info('Serving nimp commands on %s', self._socket_path)
+        action = None
+        try:
+            action = self._serve_forever()
+        finally:
+            signal.signal(signal.SIGCHLD, previous_sigchld_handler)
+            signal.set_wakeup_fd(previous_wakeup_fd)
+            self._selector.close()
+            self._listener.close()
+            for wakeup_socket in self._wakeup_sockets:
+                wakeup_socket.close()
+            try:
+                if os.stat(self._socket_path).st_ino == socket_inode:
+                    os.unlink(self._socket_path)
+            except OSError:
+                pass
+
+        if action == 'restart':
+            _restart()
+        return True
+
+    def _serve_forever(self):
+        '''Serves until stopped, returning 'stop', 'restart' or None if idle
+        for too long'''
+        idle_since = time.monotonic()
+        while True:
+            timeout = None
+            if self._children:
+                idle_since = time.monotonic()
+            elif self._idle_timeout is not None:
+                timeout = idle_since + self._idle_timeout - time.monotonic()
+                if timeout <= 0:
+                    logging.info('Stopping nimp server, idle for %d seconds', self._idle_timeout)
+                    return None
+
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._listener:
+                    try:
+                        connection, _ = self._listener.accept()
+                    except BlockingIOError:
+                        continue
+                    idle_since = time.monotonic()
+                    action = self._handle(connection)
+                    if action is not None:
+                        return action
+                elif key.fileobj is self._wakeup_sockets[0]:
+                    _drain(key.fileobj)
+                else:
+                    self._read_client(key.fileobj, key.data)
+            self._reap_children()
+
+    def _is_running(self):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(self._socket_path)
+            return True
+        except OSError:
+            return False
+        finally:
+            client.close()
+
+    def _handle(self, connection):
+        '''Handles a client connection, returning 'stop' or 'restart' if the
+        server has to'''
+        fds = []
+        try:
+            connection.setblocking(True)
+            connection.settimeout(10)
+            _, fds, _, _ = socket.recv_fds(connection, 1, 3)
+            # Clients wait for the response before sending anything else, so
+            # nothing more than the request can be buffered by the reader
+            request = _read_message(connection.makefile('rb'))
+            if request is None or request.get('version') != _PROTOCOL_VERSION:
+                raise ValueError('unsupported request')
+            if request.get('stop'):
+                logging.info('Stopping nimp server')
+                _send_message(connection, {'accepted': True})
+                connection.close()
+                return 'stop'
+            if len(fds) != 3:
+                raise ValueError('missing standard streams')
+
+            # Imported code cannot be reloaded, so the server starts over
+            # when any of it changes. Clients run their command themselves.
+            if _get_source_signatures(self._sources) != self._sources:
+                logging.info('Nimp sources changed, restarting nimp server')
+                _send_message(connection, {'accepted': False})
+                connection.close()
+                return 'restart'
+
+            try:
+                nimp.environment.load_config_snapshot(request['argv'], request['cwd'])
+            # pylint: disable=broad-except
+            except Exception as ex:
+                logging.debug('Error while loading environment snapshot: %s', ex)
+
+            _send_message(connection, {'accepted': True})
+            connection.setblocking(False)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                self._run_child(connection, fds, request)
+        except (OSError, ValueError) as ex:
+            logging.warning('Error while handling nimp client: %s', ex)
+            connection.close()
+            return None
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+        logging.info('Running "%s" (pid %d)', ' '.join(request['argv'][1:]), pid)
+        self._children[pid] = connection
+        self._selector.register(connection, selectors.EVENT_READ, (pid, bytearray()))
+        return None
+
+    def _read_client(self, connection, data):
+        '''Forwards signals sent by the client of a running command, the
+        command being terminated when its client is gone'''
+        pid, buffer = data
+        try:
+            received = connection.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            received = b''
+        signums = []
+        if received:
+            buffer += received
+            *lines, buffer[:] = buffer.split(b'\n')
+            for line in lines:
+                try:
+                    signums.append(json.loads(line).get('signal'))
+                except ValueError:
+                    pass
+        else:
+            # Nobody is waiting for the command anymore
+            self._selector.unregister(connection)
+            signums.append(signal.SIGTERM)
+
+        forwarded_signals = {getattr(signal, it) for it in _FORWARDED_SIGNALS}
+        for signum in signums:
+            if signum in forwarded_signals:
+                # Children are only reaped by this thread, so pid can't have
+                # been reused yet
+                try:
+                    os.kill(pid, signum)
+                except OSError:
+                    pass
+
+    def _reap_children(self):
+        for pid, connection in list(self._children.items()):
+            try:
+                waited_pid, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                waited_pid, status = pid, 1 << 8
+            if waited_pid == 0:
+                continue
+            exit_code = os.waitstatus_to_exitcode(status)
+            if exit_code < 0:
+                exit_code = 128 - exit_code
+            del self._children[pid]
+            try:
+                self._selector.unregister(connection)
+            except KeyError:
+                # Already gone with its client
+                pass
+            try:
+                connection.setblocking(True)
+                _send_message(connection, {'exit_code': exit_code})
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+
+    def _run_child(self, connection, fds, request):
+        exit_code = 1
+        try:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            self._selector.close()
+            self._listener.close()
+            for wakeup_socket in self._wakeup_sockets:
+                wakeup_socket.close()
+            for other_connection in self._children.values():
+                other_connection.close()
+            connection.close()
+            # Commands must not be interrupted by Ctrl-C in the server
+            # terminal, nor stopped when reading the client one
+            os.setsid()
+            for target_fd, fd in enumerate(fds):
+                os.dup2(fd, target_fd)
+                os.close(fd)
+            fds.clear()
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['environment'])
+            sys.argv = list(request['argv'])
+            _reset_child_state()
+            exit_code = self._run(sys.argv)
+        # pylint: disable=broad-except
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            _close_log_handlers()
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(exit_code)
+
+
+def _reset_child_state():
+    '''Forgets the state of the server run, so a forked process starts like a
+    new nimp process'''
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    # Handlers of the server run still reference its own files and threads,
+    # they are dropped without being closed
+    child_processes_logger = logging.getLogger('child_processes')
+    for logger in (logging.getLogger(), child_processes_logger):
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+    child_processes_logger.propagate = True
+    nimp.system.clear_workspace_scans()
+    nimp.utils.profiling.reset_phase_times()
+
+
+def _close_log_handlers():
+    '''Flushes log handlers of a forked process, as it does not run exit
+    handlers'''
+    handlers = logging.getLogger().handlers + logging.getLogger('child_processes').handlers
+    for handler in set(handlers):
+        try:
+            handler.flush()
+            handler.close()
+        # pylint: disable=broad-except
+        except Exception:
+            pass
+
+
+def _restart():
+    '''Replaces this process with a new nimp server'''
+    if not hasattr(sys, 'orig_argv'):
+        logging.info('Restart nimp server to keep serving commands')
+        return
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+    os.execv(sys.executable, [sys.executable, *sys.orig_argv[1:]])
+
+
+def _get_source_signatures(previous_signatures=None):
+    '''Returns modification times and sizes of source files of imported
+    modules, or of the given ones'''
+    if previous_signatures is not None:
+        paths = previous_signatures.keys()
+    else:
+        paths = {it.__file__ for it in list(sys.modules.values()) if getattr(it, '__file__', None)}
+    signatures = {}
+    for path in paths:
+        signatures[path] = nimp.system.get_file_signature(path)
+    return signatures
+
+
+def _send_message(connection, message):
+    connection.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _read_message(reader):
+    line = reader.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def _drain(wakeup_socket):
+    try:
+        while wakeup_socket.recv(4096):
+            pass
+    except BlockingIOError:
+        pass
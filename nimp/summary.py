@@ -24,11 +24,203 @@
 values and command line parameters set for this nimp execution'''
 
 import collections
+import functools
+import hashlib
+import itertools
+import json
 import logging
-from logging.handlers import WatchedFileHandler
 import os
+import queue
 import re
 import sys
+import tempfile
+import threading
+import time
+
+import nimp.sys.logging
+
+
+class PatternSet:
+    """Ordered list of regular expressions matched in a single pass.
+
+    Patterns are combined into one alternation, each one wrapped in a named
+    group so the first pattern matching a line can be told apart. Named
+    groups of each pattern are renamed to stay unique, and renamed back in
+    the dictionaries returned by match. Patterns that cannot be combined
+    (back references, flags) are matched on their own, in order.
+
+    When every pattern requires a literal string, lines containing none of
+    them are rejected with plain substring searches before any regex runs."""
+
+    _UNSAFE_SYNTAX = re.compile(r'\\[1-9]|\(\?\(')
+    _NAMED_GROUP = re.compile(r'\(\?P(<|=)(\w+)')
+    _REPEAT = re.compile(r'\d*(,\d*)?\}')
+    # Escapes spanning more than one character: hexadecimal and unicode ones,
+    # which are decoded, then named, octal and back references, which aren't
+    _LONG_ESCAPE = re.compile(r'x([0-9a-fA-F]{2})|u([0-9a-fA-F]{4})|U([0-9a-fA-F]{8})|N\{[^}]*\}|\d+')
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._literals = PatternSet._get_literals(self.patterns)
+        # Each segment is a (regex, pattern index, {group name: (pattern index, {renamed: name})}) tuple
+        self._segments = []
+        combinable = []
+        for index, pattern in enumerate(self.patterns):
+            renamed = PatternSet._rename_groups(pattern, len(combinable))
+            if renamed is None:
+                self._add_segment(combinable)
+                combinable = []
+                self._segments.append((pattern, index, None))
+            else:
+                combinable.append((index, pattern, renamed))
+        self._add_segment(combinable)
+
+    def match(self, msg):
+        """Returns the group dictionary of the first pattern matching the
+        beginning of msg, or None if no pattern matches"""
+        result = self.match_index(msg)
+        return None if result is None else result[1]
+
+    def match_index(self, msg):
+        """Returns the index in patterns of the first pattern matching the
+        beginning of msg along with its group dictionary, or None if no
+        pattern matches"""
+        if self._literals is not None:
+            # Plain loop, noticeably cheaper than any() on a generator
+            for literal in self._literals:
+                if literal in msg:
+                    break
+            else:
+                return None
+        for regex, index, alternatives in self._segments:
+            match = regex.match(msg)
+            if match is None:
+                continue
+            if alternatives is None:
+                return index, match.groupdict()
+            index, group_names = alternatives[match.lastgroup]
+            return index, {name: match.group(renamed) for renamed, name in group_names.items()}
+        return None
+
+    @staticmethod
+    def _rename_groups(pattern, index):
+        if pattern.flags & ~re.UNICODE or PatternSet._UNSAFE_SYNTAX.search(pattern.pattern):
+            return None
+        group_names = {}
+
+        def _rename(match):
+            renamed = f'_p{index}_{match.group(2)}'
+            group_names[renamed] = match.group(2)
+            return f'(?P{match.group(1)}{renamed}'
+
+        source = PatternSet._NAMED_GROUP.sub(_rename, pattern.pattern)
+        if set(group_names.values()) != set(pattern.groupindex):
+            return None
+        return source, group_names
+
+    def _add_segment(self, combinable):
+        if not combinable:
+            return
+        if len(combinable) == 1:
+            index, pattern, _ = combinable[0]
+            self._segments.append((pattern, index, None))
+            return
+        source = '|'.join(f'(?P<_p{i}>{renamed[0]})' for i, (_, _, renamed) in enumerate(combinable))
+        try:
+            regex = re.compile(source)
+        # pylint: disable=broad-except
+        except Exception:
+            self._segments.extend((pattern, index, None) for index, pattern, _ in combinable)
+            return
+        alternatives = {f'_p{i}': (index, renamed[1]) for i, (index, _, renamed) in enumerate(combinable)}
+        self._segments.append((regex, None, alternatives))
+
+    @staticmethod
+    def _get_literals(patterns):
+        literals = []
+        for pattern in patterns:
+            literal = PatternSet._get_required_literal(pattern)
+            if literal is None:
+                return None
+            literals.append(literal)
+        # A literal containing another one is redundant
+        literals = sorted(set(literals), key=len)
+        return [it for i, it in enumerate(literals) if not any(other in it for other in literals[:i])]
+
+    @staticmethod
+    def _get_required_literal(pattern, min_length=3):
+        """Returns the longest string any match of pattern must contain,
+        only looking at top-level characters, or None"""
+        if pattern.flags & (re.IGNORECASE | re.VERBOSE):
+            return None
+        source = pattern.pattern
+        runs, run = [], ''
+        depth, i = 0, 0
+        while i < len(source):
+            char = source[i]
+            i += 1
+            literal = None
+            if char == '\\':
+                long_escape = PatternSet._LONG_ESCAPE.match(source, i)
+                if long_escape is not None:
+                    i = long_escape.end()
+                    code = long_escape.group(1) or long_escape.group(2) or long_escape.group(3)
+                    literal = chr(int(code, 16)) if code else None
+                else:
+                    escaped = source[i : i + 1]
+                    i += 1
+                    if escaped in ('n', 't', 'r', 'f', 'v'):
+                        literal = {'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v'}[escaped]
+                    elif escaped and not escaped.isalnum():
+                        literal = escaped
+            elif char == '[':
+                # Skip character classes, ']' is literal when it comes first
+                i += 1 if source[i : i + 1] == '^' else 0
+                i += 1 if source[i : i + 1] == ']' else 0
+                while i < len(source) and source[i] != ']':
+                    i += 2 if source[i] == '\\' else 1
+                i += 1
+            elif char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            elif char == '|' and depth == 0:
+                return None
+            elif char in '?*' or (char == '{' and PatternSet._REPEAT.match(source, i)):
+                # Previous item is optional, as far as we are concerned
+                run = run[:-1]
+                if char == '{':
+                    i = PatternSet._REPEAT.match(source, i).end()
+            elif char not in '.^$+' and depth == 0:
+                literal = char
+
+            if literal is not None and depth == 0:
+                run += literal
+            else:
+                if run:
+                    runs.append(run)
+                    run = ''
+        if run:
+            runs.append(run)
+        longest = max(runs, key=len, default='')
+        return longest if len(longest) >= min_length else None
+
+
+# Summary handlers between __enter__ and __exit__
+_active_handlers = set()
+
+
+def stop_logging_threads():
+    '''Handles pending records and stops logging threads of summary handlers
+    in use, records being handled by the thread logging them afterwards. Locks
+    held by other threads stay locked in forked processes, so this must be
+    called before forking.'''
+    for handler in list(_active_handlers):
+        handler._stop_logging()
+        log_all_handler = getattr(handler, 'log_all_handler', None)
+        if log_all_handler is not None:
+            # Writes records right away once closed
+            log_all_handler.close()
 
 
 class SummaryHandler(logging.Handler):
@@ -40,32 +232,41 @@ class SummaryHandler(logging.Handler):
         super().__init__(logging.DEBUG)
 
         if "NIMP_LOG_FILE" in os.environ:
-            self.log_all_handler = WatchedFileHandler(os.environ["NIMP_LOG_FILE"])
-            self.log_all_handler.setLevel(logging.DEBUG)
-            self.log_all_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
+            try:
+                self.log_all_handler = SummaryHandler._create_log_all_handler(os.environ["NIMP_LOG_FILE"])
+            # pylint: disable=broad-except
+            except Exception as ex:
+                logging.error('Error while opening log file %s: %s', os.environ["NIMP_LOG_FILE"], ex)
 
         self._env = env
+        self._child_processes_handler = None
+        self._queue = queue.SimpleQueue()
+        self._worker = None
+        self._max_line_length = getattr(env, 'summary_max_line_length', 16 * 1024)
         self._ignore_patterns = []
         self._error_patterns = []
         self._warning_patterns = []
         self._context_patterns = []
         self._summary = {'errors': [], 'warnings': []}
 
+        # Patterns are matched at the beginning of each line. Anything before
+        # the file location is matched lazily so each position is only tried
+        # once, which keeps matching time linear in the line length.
         error_patterns = [
             # GCC
-            r'[\/\w\W\-. ]+:\d+:\d+: (fatal )?error: .*',  # GCC errors
-            r'[\/\w\W\-. ]+:\d+: undefined reference to .*',  # GCC linker error
+            r'.+?:\d+:\d+: (fatal )?error: .*',  # GCC errors
+            r'.+?:\d+: undefined reference to .*',  # GCC linker error
             # Clang
-            r'[\/\w\W\-. ]+\(\d+,\d+\): (fatal ?)error : .*',
-            r'[\/\w\W\-. ]+ : error : [A-Z0-9]+: reference to undefined symbol.*',
+            r'.+?\(\d+,\d+\): (fatal ?)error : .*',
+            r'.+? : error : [A-Z0-9]+: reference to undefined symbol.*',
             r'^duplicate symbol \w+ in:',
             r': multiple definition of ',
             r'clang: error: no such file or directory:.*',
             # .NET / Mono
-            r'[\/\w\W\-. ]+\(\d+,\d+\) : error [A-Z\d]+: .*',
+            r'.+?\(\d+,\d+\) : error [A-Z\d]+: .*',
             # MSVC
-            r'[\/\w\W\-. ]+\(\d+\): error [A-Z\d]+: .*',
-            r'[\/\w\W\-. ]+\ : error [A-Z\d]+: unresolved external symbol .*',
+            r'.+?\(\d+\): error [A-Z\d]+: .*',
+            r'.+? : error [A-Z\d]+: unresolved external symbol .*',
             # PS4 SDK (Orbis)
             r'\[Error\]\t.*',
             # XboxOne SDK
@@ -74,14 +275,14 @@ class SummaryHandler(logging.Handler):
             r'Chunk [0-9]+ is invalid: it contains 0 files\.',
             r'The layout contained an invalid chunk\.',
             r'Chunks must contain at least 1 non-empty file\.',
-            r'FileGroup .* did not match any files\.',
+            r'FileGroup .*? did not match any files\.',
         ]
 
         warning_patterns = [
-            r'[\/\w\W\-.: ]+\(\d+,\d+\) : warning [A-Z\d]+: .*',  # MSVC .NET / Mono
-            r'[\/\w\W\-.: ]+:\d+:\d+: warning: .*',  # GCC
-            r'[\/\w\W\-.: ]+\(\d+,\d+\): warning : .*',  # Clang
-            r'[\/\w\W\-.: ]+\(\d+\): warning [A-Z\d]+: .*',  # MSVC
+            r'.+?\(\d+,\d+\) : warning [A-Z\d]+: .*',  # MSVC .NET / Mono
+            r'.+?:\d+:\d+: warning: .*',  # GCC
+            r'.+?\(\d+,\d+\): warning : .*',  # Clang
+            r'.+?\(\d+\): warning [A-Z\d]+: .*',  # MSVC
             r'\[Warn\]\t.*',  # PS4 SDK (Orbis)
         ]
 
@@ -97,20 +298,65 @@ class SummaryHandler(logging.Handler):
 
         self._compile_patterns([], 'context_patterns', self._context_patterns)
 
+        self._ignore_pattern_set = PatternSet(self._ignore_patterns)
+        self._error_pattern_set = PatternSet(self._error_patterns)
+        self._warning_pattern_set = PatternSet(self._warning_patterns)
+
+    @staticmethod
+    def _create_log_all_handler(path):
+        handler = nimp.sys.logging.BufferedFileHandler(
+            path,
+            flush_size=int(os.environ.get('NIMP_LOG_FILE_FLUSH_SIZE', 1024 * 1024)),
+            flush_interval=float(os.environ.get('NIMP_LOG_FILE_FLUSH_INTERVAL', 1)),
+            max_bytes=int(os.environ.get('NIMP_LOG_FILE_MAX_SIZE', 0)),
+            backup_count=int(os.environ.get('NIMP_LOG_FILE_BACKUP_COUNT', 0)),
+        )
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(nimp.sys.logging.ChildProcessFormatter('%(asctime)s [%(levelname)s] %(message)s'))
+        return handler
+
     def _compile_patterns(self, patterns, key, destination):
         config_key = 'summary_%s' % key
+        additionnal_patterns = []
         if hasattr(self._env, config_key):
-            additionnal_patterns = getattr(self._env, config_key)
-            if additionnal_patterns is not None:
-                patterns.extend(additionnal_patterns)
+            additionnal_patterns = getattr(self._env, config_key) or []
+            patterns.extend(additionnal_patterns)
 
         for pattern in patterns:
+            if pattern in additionnal_patterns and not SummaryHandler._check_pattern(pattern):
+                continue
             try:
                 destination.append(re.compile(pattern))
             # pylint: disable=broad-except
             except Exception as ex:
                 logging.error('Error while compiling pattern %s: %s', pattern, ex)
 
+    # A repeated group ending with a repeated wildcard, like (\w+)* or
+    # (.*\s*)+, takes exponential time to fail
+    _NESTED_WILDCARDS = re.compile(r'(\.|\\[wWsSdD]|\])[*+]\??\)[*+{]')
+    # A repeated group ending with any other repeated item, like (\w+\s?)*, may
+    # take exponential time too
+    _NESTED_QUANTIFIERS = re.compile(r'[*+?}]\)[*+{]')
+    # Consecutive wildcards, like .*.* or .+\s*.*, take polynomial time to fail
+    _CONSECUTIVE_WILDCARDS = re.compile(r'\.[*+]\??(\\[sSwW][*+?]\??)*\.[*+]')
+
+    @staticmethod
+    def _check_pattern(pattern):
+        '''Rejects configured patterns prone to catastrophic backtracking, and
+        warns about patterns whose matching time may grow faster than lines.
+        Patterns may be given already compiled.'''
+        pattern = getattr(pattern, 'pattern', pattern)
+        if not isinstance(pattern, str):
+            return True
+        if SummaryHandler._NESTED_WILDCARDS.search(pattern):
+            logging.error('Ignoring pattern %s: nested wildcard repetitions take exponential time to match', pattern)
+            return False
+        if SummaryHandler._NESTED_QUANTIFIERS.search(pattern):
+            logging.warning('Pattern %s: nested repetitions may take exponential time to match', pattern)
+        elif SummaryHandler._CONSECUTIVE_WILDCARDS.search(pattern):
+            logging.warning('Pattern %s: consecutive wildcards may take quadratic time to match', pattern)
+        return True
+
     def __enter__(self):
         # Sets up logging
         log_level = logging.INFO
@@ -126,23 +372,40 @@ class SummaryHandler(logging.Handler):
                 root_logger.removeHandler(handler)
             logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', level=log_level)
 
+        if hasattr(self, "log_all_handler"):
+            root_logger.addHandler(self.log_all_handler)
+
         child_processes_logger = logging.getLogger('child_processes')
         child_processes_logger.propagate = False
         child_processes_logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setFormatter(logging.Formatter('%(message)s'))
-        child_processes_logger.addHandler(handler)
+        handler = nimp.sys.logging.BatchedStreamHandler(sys.stdout)
+        handler.setFormatter(nimp.sys.logging.ChildProcessFormatter('%(message)s'))
+        child_processes_handlers = [handler]
 
         # Enables warnings and errors recording
         if self._env.summary is not None:
+            self._worker = threading.Thread(target=self._run_worker, name='nimp_summary', daemon=True)
+            self._worker.start()
             root_logger.addHandler(self)
             child_processes_logger.addHandler(self)
             if hasattr(self, "log_all_handler"):
+                # Already formats and writes records from its own thread
                 child_processes_logger.addHandler(self.log_all_handler)
 
+        # Child process output is written from a dedicated thread, so a slow
+        # terminal never stalls the child process pipes
+        self._child_processes_handler = nimp.sys.logging.QueuedHandlers(*child_processes_handlers)
+        self._child_processes_handler.start()
+        child_processes_logger.addHandler(self._child_processes_handler)
+
+        _active_handlers.add(self)
         return self
 
     def __exit__(self, ex_type, value, traceback):
+        _active_handlers.discard(self)
+        self._stop_logging()
+        self._close_log_all_handler()
+
         if self._env.summary is not None:
             summary = self._env.summary
             # So we can print summary to stdout
@@ -152,21 +415,148 @@ class SummaryHandler(logging.Handler):
                 with open(summary, 'w', encoding='utf-8') as out:
                     self._write_summary(out)
 
+    def _stop_logging(self):
+        '''Handles remaining records and stops logging threads'''
+        if self._child_processes_handler is not None:
+            child_processes_logger = logging.getLogger('child_processes')
+            child_processes_logger.removeHandler(self._child_processes_handler)
+            self._child_processes_handler.stop()
+            for handler in self._child_processes_handler.handlers:
+                child_processes_logger.addHandler(handler)
+            self._child_processes_handler = None
+
+        if self._worker is not None:
+            self._queue.put_nowait(None)
+            self._worker.join()
+            self._worker = None
+
+    def _close_log_all_handler(self):
+        '''Removes the NIMP_LOG_FILE handler from loggers and closes it, writing
+        buffered records'''
+        if hasattr(self, "log_all_handler"):
+            logging.getLogger().removeHandler(self.log_all_handler)
+            logging.getLogger('child_processes').removeHandler(self.log_all_handler)
+            self.log_all_handler.close()
+
     def has_errors(self):
         '''Returns true if errors were emitted during program execution'''
+        self.flush()
         return len(self._summary['errors']) > 0
 
     def has_warnings(self):
         '''Returns true if warnings were emitted during program execution'''
+        self.flush()
         return len(self._summary['warnings']) > 0
 
+    @property
+    def max_line_length(self):
+        '''Length lines are truncated to before being matched, 0 if they aren't'''
+        return self._max_line_length
+
+    def get_patterns(self):
+        '''Returns (kind, compiled pattern) tuples of every pattern lines are matched against'''
+        patterns = [('ignore', it) for it in self._ignore_patterns]
+        patterns += [('error', it) for it in self._error_patterns]
+        patterns += [('warning', it) for it in self._warning_patterns]
+        patterns += [('context', it) for it in self._context_patterns]
+        return patterns
+
+    def get_pattern_sets(self):
+        '''Returns (kind, PatternSet) tuples of pattern sets each line is matched against'''
+        return [
+            ('ignore', self._ignore_pattern_set),
+            ('error', self._error_pattern_set),
+            ('warning', self._warning_pattern_set),
+        ]
+
     def emit(self, record):
-        msg = record.getMessage()
+        # Records are classified by the worker thread once started, so the
+        # number of configured patterns never slows down logging threads
+        if self._worker is None:
+            self._classify(record, record.getMessage())
+            return
+        # Arguments may change by the time the worker handles the record
+        self._queue.put_nowait((record, record.getMessage() if record.args else record.msg))
+
+    def flush(self):
+        '''Waits until all records emitted so far have been classified'''
+        if self._worker is not None and self._worker is not threading.current_thread():
+            done = threading.Event()
+            self._queue.put_nowait(done)
+            done.wait()
+
+    def _run_worker(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                if isinstance(item, threading.Event):
+                    item.set()
+                    continue
+                record = None
+                try:
+                    if callable(item):
+                        item()
+                    else:
+                        record, msg = item
+                        self._classify(record, str(msg))
+                # pylint: disable=broad-except
+                except Exception:
+                    self.handleError(record)
+        finally:
+            # Never leave flush() or merge_chunk() waiting on a dead worker
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    # Number of lines preceding a log chunk to classify before it, so that
+    # state depending on previous lines, like context, is the same as when
+    # analyzing the whole log
+    CHUNK_CONTEXT_LINES = 0
+
+    def analyze_chunk(self, context_lines, lines):
+        '''Classifies lines of a log chunk, and returns the resulting state to
+        merge into the handler analyzing the whole log using merge_chunk'''
+        record = logging.makeLogRecord({'levelno': logging.INFO, 'levelname': 'INFO'})
+        for line in context_lines:
+            self._classify(record, line)
+        self._clear_summary()
+        for line in lines:
+            self._classify(record, line)
+        return self._get_chunk_state()
+
+    def merge_chunk(self, state):
+        '''Merges the state returned by analyze_chunk, chunks being merged in
+        log order'''
+        if self._worker is None:
+            self._merge_chunk_state(state)
+            return
+        # Summary state is only ever modified by the worker
+        done = threading.Event()
+        self._queue.put_nowait(functools.partial(self._merge_chunk_state, state))
+        self._queue.put_nowait(done)
+        done.wait()
+
+    def _clear_summary(self):
+        pass
+
+    def _get_chunk_state(self):
+        return None
 
-        for pattern in self._ignore_patterns:
-            if pattern.match(msg):
-                self._add_notif(msg)
-                return
+    def _merge_chunk_state(self, state):
+        pass
+
+    def _classify(self, record, msg):
+        # Giant lines (UHT or cook dumps…) are truncated, no pattern should
+        # ever need more than a few kilobytes to match
+        if self._max_line_length and len(msg) > self._max_line_length:
+            msg = msg[: self._max_line_length]
+
+        if self._ignore_pattern_set.match(msg) is not None:
+            self._add_notif(msg)
+            return
 
         if record.levelno == logging.CRITICAL or record.levelno == logging.ERROR:
             self._add_msg('error', self.format(record))
@@ -176,19 +566,17 @@ class SummaryHandler(logging.Handler):
             return
         else:
             self._add_notif(msg)
-        self._match_message(self._error_patterns, msg, 'error')
-        self._match_message(self._warning_patterns, msg, 'warning')
-
-    def _match_message(self, patterns, msg, notif_lvl):
-        for pattern in patterns:
-            match = pattern.match(msg)
-            if match is not None:
-                group_dict = match.groupdict()
-                if 'message' in group_dict:
-                    msg = group_dict['message']
-                self._add_msg(notif_lvl, msg)
-                return True
-        return False
+        self._match_message(self._error_pattern_set, msg, 'error')
+        self._match_message(self._warning_pattern_set, msg, 'warning')
+
+    def _match_message(self, pattern_set, msg, notif_lvl):
+        group_dict = pattern_set.match(msg)
+        if group_dict is None:
+            return False
+        if 'message' in group_dict:
+            msg = group_dict['message']
+        self._add_msg(notif_lvl, msg)
+        return True
 
     def _add_notif(self, msg):
         pass
@@ -200,6 +588,204 @@ class SummaryHandler(logging.Handler):
         pass
 
 
+_VOLATILE_PATTERNS = [
+    (re.compile(r'^\[\d{4}\.\d{2}\.\d{2}-\d{2}\.\d{2}\.\d{2}:\d{3}\]\[ *\d+\]'), ''),  # Unreal log prefix
+    (re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}([.,]\d+)?'), '<time>'),
+    (re.compile(r'\b\d{2}:\d{2}:\d{2}([.,]\d+)?\b'), '<time>'),
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), '<address>'),
+    (re.compile(r'\b[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}\b'), '<guid>'),
+    (re.compile(r'\b\d+(\.\d+)? ?(ms|s|sec|seconds)\b'), '<duration>'),
+]
+
+
+def _get_message_key(msg):
+    '''Returns msg without its volatile parts (timestamps, addresses, GUIDs,
+    durations), so repeated messages can be told apart from new ones'''
+    for pattern, replacement in _VOLATILE_PATTERNS:
+        msg = pattern.sub(replacement, msg)
+    return msg
+
+
+class _SummaryEntry:
+    def __init__(self, sequence, first, last=None, count=1):
+        # Entries are written in the order their message was first seen
+        self.sequence = sequence
+        self.first = first
+        self.last = last
+        self.count = count
+
+
+class _SpilledEntry:
+    def __init__(self, sequence, count, first_offset):
+        self.sequence = sequence
+        self.count = count
+        # Offsets of the first and last occurrences in the spill file, the
+        # last one being None until the entry is spilled again
+        self.first_offset = first_offset
+        self.last_offset = None
+        self.last_size = 0
+
+
+class _SummaryStore:
+    """Errors or warnings of a DefaultSummaryHandler, deduplicated.
+
+    Messages only differing by volatile parts (timestamps, addresses, GUIDs,
+    durations) share a single entry counting occurrences and keeping the first
+    and last context. When there are more than max_entries entries, the least
+    recently seen ones are written to a temporary file, so memory only grows
+    with the number of distinct messages, never with the number of lines. Only
+    a hash of their key, their count and their position in the file are kept
+    in memory, so they are still counted when seen again, and they are put
+    back in order when the summary is written. Occurrences replaced in the file
+    are dropped once they take more room than the ones still used."""
+
+    # Spill files are never compacted below this size
+    _MIN_COMPACTION_SIZE = 1024 * 1024
+
+    def __init__(self, notif_lvl, max_entries):
+        self._notif_lvl = notif_lvl
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._next_sequence = 0
+        self._spill = None
+        # Size of occurrences of the spill file still used
+        self._spill_live_size = 0
+        # Spilled entries, by key hash
+        self._spilled_entries = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, msg, context):
+        '''Records an occurrence of msg, with the context lines preceding it'''
+        self._add(_get_message_key(msg), (msg, context), None, 1)
+
+    def merge(self, other):
+        '''Adds entries of other, recorded after the ones of this store'''
+        assert other._spill is None
+        for key, other_entry in sorted(other._entries.items(), key=lambda it: it[1].sequence):
+            self._add(key, other_entry.first, other_entry.last, other_entry.count)
+
+    def _add(self, key, first, last, count):
+        self._count += count
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.count += count
+            entry.last = last or first
+            self._entries.move_to_end(key)
+            return
+
+        spilled_entry = self._spilled_entries.get(_SummaryStore._hash_key(key))
+        if spilled_entry is None:
+            entry = _SummaryEntry(self._next_sequence, first, last, count)
+            self._next_sequence += 1
+        else:
+            # Continues an entry that was spilled, the first occurrence is in the spill file
+            entry = _SummaryEntry(spilled_entry.sequence, None, last or first, count)
+
+        self._entries[key] = entry
+        if len(self._entries) > self._max_entries:
+            self._evict()
+
+    def _evict(self):
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile('w+b')
+        evicted_key, evicted = self._entries.popitem(last=False)
+        key_hash = _SummaryStore._hash_key(evicted_key)
+        spilled_entry = self._spilled_entries.get(key_hash)
+        if spilled_entry is None:
+            spilled_entry = _SpilledEntry(evicted.sequence, 0, self._write_occurrence_record(evicted.first)[0])
+            self._spilled_entries[key_hash] = spilled_entry
+        else:
+            # Replaces the previous last occurrence
+            self._spill_live_size -= spilled_entry.last_size
+        spilled_entry.count += evicted.count
+        if evicted.last is not None:
+            spilled_entry.last_offset, spilled_entry.last_size = self._write_occurrence_record(evicted.last)
+
+        spill_size = self._spill.tell()
+        if spill_size > max(2 * self._spill_live_size, _SummaryStore._MIN_COMPACTION_SIZE):
+            self._compact_spill()
+
+    def _write_occurrence_record(self, occurrence):
+        '''Appends an occurrence to the spill file, returning its offset and size'''
+        data = json.dumps(occurrence).encode('utf-8') + b'\n'
+        offset = self._spill.tell()
+        self._spill.write(data)
+        self._spill_live_size += len(data)
+        return offset, len(data)
+
+    def _read_occurrence_record(self, offset):
+        self._spill.seek(offset)
+        occurrence = json.loads(self._spill.readline())
+        self._spill.seek(0, os.SEEK_END)
+        return occurrence
+
+    def _compact_spill(self):
+        '''Copies occurrences still used to a new spill file'''
+        spill = self._spill
+        self._spill = tempfile.TemporaryFile('w+b')
+        self._spill_live_size = 0
+        for spilled_entry in sorted(self._spilled_entries.values(), key=lambda it: it.first_offset):
+            for attribute in ('first_offset', 'last_offset'):
+                offset = getattr(spilled_entry, attribute)
+                if offset is None:
+                    continue
+                spill.seek(offset)
+                data = spill.readline()
+                setattr(spilled_entry, attribute, self._spill.tell())
+                self._spill.write(data)
+                self._spill_live_size += len(data)
+                if attribute == 'last_offset':
+                    spilled_entry.last_size = len(data)
+        spill.close()
+
+    @staticmethod
+    def _hash_key(key):
+        return hashlib.blake2b(key.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
+
+    def write(self, destination):
+        '''Writes all entries to destination, in the order they were first seen'''
+        # Entries still in memory are either not spilled, or continue a
+        # spilled entry with its most recent occurrences
+        parts = [(it.sequence, 0, it) for it in self._spilled_entries.values()]
+        parts.extend((it.sequence, 1, it) for it in self._entries.values())
+        parts.sort(key=lambda it: it[:2])
+
+        for _, entry_parts in itertools.groupby(parts, key=lambda it: it[0]):
+            first, last, count = None, None, 0
+            for _, _, part in entry_parts:
+                if isinstance(part, _SpilledEntry):
+                    first = self._read_occurrence_record(part.first_offset)
+                    if part.last_offset is not None:
+                        last = self._read_occurrence_record(part.last_offset)
+                else:
+                    first = first or part.first
+                    last = part.last or last
+                count += part.count
+            self._write_entry(destination, first, last, count)
+
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        self._spill_live_size = 0
+        self._spilled_entries.clear()
+        self._entries.clear()
+
+    def _write_entry(self, destination, first, last, count):
+        destination.write('\n *********************************************\n')
+        self._write_occurrence(destination, *first)
+        if count > 1:
+            destination.write(f'[ REPEAT ] {count - 1} more time(s), last one:\n')
+            self._write_occurrence(destination, *last)
+
+    def _write_occurrence(self, destination, msg, context):
+        for line in context:
+            destination.write('[  NOTIF  ] %s\n' % (line,))
+        destination.write(f'[ {self._notif_lvl.upper()} ] {msg}\n')
+
+
 class DefaultSummaryHandler(SummaryHandler):
     """Default summary handler, showing one line by error / warning and
     adding three lines of context before / after errors"""
@@ -207,25 +793,206 @@ class DefaultSummaryHandler(SummaryHandler):
     def __init__(self, env):
         super().__init__(env)
         self._context = collections.deque([], 4)
+        self._clear_summary()
+        # Context patterns without a message group never change the context
+        # line, the first one with such a group to match is used
+        self._context_pattern_set = PatternSet(it for it in self._context_patterns if 'message' in it.groupindex)
 
     def _add_notif(self, msg):
-        for pattern in self._context_patterns:
-            match = pattern.match(msg)
-            if match is not None:
-                group_dict = match.groupdict()
-                if 'message' in group_dict:
-                    msg = group_dict['message']
-                    break
+        group_dict = self._context_pattern_set.match(msg)
+        if group_dict is not None:
+            msg = group_dict['message']
         self._context.append(msg)
 
     def _add_msg(self, notif_lvl, msg):
-        self._summary[f'{notif_lvl}s'].append('\n *********************************************\n')
+        self._summary[f'{notif_lvl}s'].add(msg, self._pop_context())
+
+    CHUNK_CONTEXT_LINES = 4
+
+    def _clear_summary(self):
+        max_entries = getattr(self._env, 'summary_max_entries', 1000)
+        self._summary = {
+            'errors': _SummaryStore('error', max_entries),
+            'warnings': _SummaryStore('warning', max_entries),
+        }
+
+    def _get_chunk_state(self):
+        return self._summary
+
+    def _merge_chunk_state(self, state):
+        for lvl, store in state.items():
+            self._summary[lvl].merge(store)
+
+    def _pop_context(self):
+        '''Returns context lines preceding the current message, if enough
+        lines were seen since the previous one'''
+        context = ()
         if len(self._context) == self._context.maxlen:
-            while self._context:
-                self._summary[f'{notif_lvl}s'].append('[  NOTIF  ] %s\n' % (self._context.popleft(),))
-        self._summary[f'{notif_lvl}s'].append(f'[ {notif_lvl.upper()} ] {msg}\n')
+            context = tuple(self._context)
+            self._context.clear()
+        return context
 
     def _write_summary(self, destination):
         '''Writes summary to destination'''
         for lvl in ['errors', 'warnings']:
-            destination.writelines(self._summary[lvl])
+            self._summary[lvl].write(destination)
+
+
+class StreamingSummaryHandler(DefaultSummaryHandler):
+    """Base class for summary handlers writing each error and warning to the
+    summary as soon as it is matched, so it can be followed while nimp runs"""
+
+    # Leading file location, GCC (file:line:column:) or MSVC (file(line,column):) style
+    _LOCATION_PATTERN = re.compile(
+        r'\s*(?P<file>(?:[A-Za-z]:)?[^:(]+?)'
+        r'(?::(?P<line>\d+)(?::(?P<column>\d+))?:|\((?P<msvc_line>\d+)(?:,(?P<msvc_column>\d+))?\) ?:)'
+    )
+
+    def __init__(self, env):
+        super().__init__(env)
+        self._output = None
+        self._counts = {'error': 0, 'warning': 0}
+        # Results of a log chunk, see analyze_chunk
+        self._chunk_results = None
+
+    def __enter__(self):
+        if self._env.summary is not None:
+            if self._env.summary.lower() == 'stdout':
+                self._output = sys.stdout
+            else:
+                self._output = open(self._env.summary, 'w', encoding='utf-8')
+            self._write_header(self._output)
+            self._output.flush()
+        return super().__enter__()
+
+    def __exit__(self, ex_type, value, traceback):
+        _active_handlers.discard(self)
+        self._stop_logging()
+        self._close_log_all_handler()
+        if self._output is not None:
+            self._write_footer(self._output)
+            if self._output is sys.stdout:
+                self._output.flush()
+            else:
+                self._output.close()
+            self._output = None
+
+    def flush(self):
+        super().flush()
+        output = self._output
+        if output is not None:
+            output.flush()
+
+    def has_errors(self):
+        '''Returns true if errors were emitted during program execution'''
+        self.flush()
+        return self._counts['error'] > 0
+
+    def has_warnings(self):
+        '''Returns true if warnings were emitted during program execution'''
+        self.flush()
+        return self._counts['warning'] > 0
+
+    def _clear_summary(self):
+        super()._clear_summary()
+        self._chunk_results = []
+
+    def _get_chunk_state(self):
+        return self._chunk_results
+
+    def _merge_chunk_state(self, state):
+        for notif_lvl, msg, context in state:
+            self._add_result(notif_lvl, msg, context)
+
+    def _add_msg(self, notif_lvl, msg):
+        context = self._pop_context()
+        if self._chunk_results is not None:
+            self._chunk_results.append((notif_lvl, msg, context))
+            return
+        self._add_result(notif_lvl, msg, context)
+
+    def _add_result(self, notif_lvl, msg, context):
+        self._counts[notif_lvl] += 1
+        if self._output is None:
+            return
+        self._write_result(self._output, notif_lvl, msg, context)
+        # Flushing once no more records are waiting still lets the summary be
+        # followed, without a flush per message on bursts
+        if self._worker is None or self._queue.empty():
+            self._output.flush()
+
+    def _get_location(self, msg):
+        '''Returns the file, line and column an error or warning refers to,
+        or None if it does not start with a file location'''
+        match = StreamingSummaryHandler._LOCATION_PATTERN.match(msg)
+        if match is None:
+            return None
+        line = match.group('line') or match.group('msvc_line')
+        column = match.group('column') or match.group('msvc_column')
+        return match.group('file'), int(line), int(column) if column else None
+
+    def _write_header(self, destination):
+        pass
+
+    def _write_result(self, destination, notif_lvl, msg, context):
+        pass
+
+    def _write_footer(self, destination):
+        pass
+
+
+class JsonLinesSummaryHandler(StreamingSummaryHandler):
+    """Summary handler writing one JSON object per error / warning"""
+
+    def _write_result(self, destination, notif_lvl, msg, context):
+        result = {
+            'time': time.time(),
+            'level': notif_lvl,
+            'message': msg,
+            'key': _get_message_key(msg),
+            'context': list(context),
+        }
+        location = self._get_location(msg)
+        if location is not None:
+            result['file'], result['line'], result['column'] = location
+        destination.write(json.dumps(result) + '\n')
+
+
+class SarifSummaryHandler(StreamingSummaryHandler):
+    """Summary handler writing a SARIF 2.1.0 log, results being written as
+    they are matched. The log is only valid JSON once nimp exits."""
+
+    def __init__(self, env):
+        super().__init__(env)
+        self._result_count = 0
+
+    def _write_header(self, destination):
+        destination.write(
+            '{"$schema": "https://json.schemastore.org/sarif-2.1.0.json", "version": "2.1.0", "runs": [{'
+            '"tool": {"driver": {"name": "nimp", "informationUri": "https://github.com/dontnod/nimp"}}, '
+            '"results": [\n'
+        )
+
+    def _write_result(self, destination, notif_lvl, msg, context):
+        result = {
+            'ruleId': f'nimp/{notif_lvl}',
+            'level': notif_lvl,
+            'message': {'text': msg},
+            'partialFingerprints': {'nimpMessageKey/v1': _get_message_key(msg)},
+        }
+        location = self._get_location(msg)
+        if location is not None:
+            path, line, column = location
+            region = {'startLine': line}
+            if column is not None:
+                region['startColumn'] = column
+            artifact = {'uri': path.strip().replace('\\', '/')}
+            result['locations'] = [{'physicalLocation': {'artifactLocation': artifact, 'region': region}}]
+        if context:
+            result['properties'] = {'context': list(context)}
+        separator = ',\n' if self._result_count else ''
+        destination.write(separator + json.dumps(result))
+        self._result_count += 1
+
+    def _write_footer(self, destination):
+        destination.write('\n]}]}\n')
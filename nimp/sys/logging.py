@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) Dontnod Entertainment
 
+import gzip
 import itertools
 import logging
+import logging.handlers
+import os
+import queue
 import re
+import sys
+import threading
+import traceback
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 class FilteredLogging(object):
@@ -26,6 +38,315 @@ class FilteredLogging(object):
             logging.getLogger(logger_name).removeFilter(filter)
 
 
+class ChildProcessFormatter(logging.Formatter):
+    """Formatter prefixing child process lines with the name of the job they
+    come from, when run through nimp.sys.process.call_many"""
+
+    def formatMessage(self, record):
+        job = getattr(record, 'nimp_job', None)
+        if job is None:
+            return super().formatMessage(record)
+        message = record.message
+        record.message = f'[{job}] {message}'
+        try:
+            return super().formatMessage(record)
+        finally:
+            record.message = message
+
+
+# Set while QueuedHandlers handles a batch of records, which it flushes after
+_BATCHING = threading.local()
+
+
+class BatchedWritesMixin:
+    """Handler mixin buffering formatted records while QueuedHandlers handles
+    a batch, so that bursts of child process output end up in a single write
+    instead of one write and one flush per line. Records emitted from any
+    other thread are written right away."""
+
+    MAX_PENDING = 1024
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = []
+
+    def emit(self, record):
+        try:
+            self._pending.append(self.format(record) + self.terminator)
+            if len(self._pending) >= self.MAX_PENDING or not getattr(_BATCHING, 'active', False):
+                self.flush()
+        # pylint: disable=broad-except
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self._pending:
+                # Pending records are dropped on error, as they would have
+                # been when written one by one
+                data = ''.join(self._pending)
+                self._pending.clear()
+                self.stream.write(data)
+            super().flush()
+        finally:
+            self.release()
+
+
+class BatchedStreamHandler(BatchedWritesMixin, logging.StreamHandler):
+    """StreamHandler only writing to its stream when flushed"""
+
+
+class BufferedFileHandler(logging.Handler):
+    """File handler writing records from a background thread.
+
+    Emitting a record only appends it to a buffer, which is formatted and
+    written once it holds flush_size bytes or after flush_interval seconds,
+    whichever comes first, so formatting never slows down the threads reading
+    child process pipes. Files ending with .gz or .zst are compressed on the fly, the latter
+    requiring the zstandard package. When max_bytes and backup_count are both
+    set, the file is rotated once the uncompressed size written to it would
+    exceed max_bytes.
+    Like WatchedFileHandler, the file is reopened when moved or deleted by
+    another program, but this is only checked once per write."""
+
+    def __init__(self, filename, flush_size=1024 * 1024, flush_interval=1.0, max_bytes=0, backup_count=0):
+        super().__init__()
+        self.baseFilename = os.path.abspath(filename)
+        self.terminator = '\n'
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._compression = next((ext for ext in ('.gz', '.zst') if self.baseFilename.endswith(ext)), None)
+        if self._compression == '.zst' and zstandard is None:
+            raise ImportError("nimp requires the 'zstd' extra dependency to write zstd compressed logs")
+        self._stream = None
+        self._stream_id = None
+        self._stream_size = 0
+        self._buffer = []
+        self._buffer_size = 0
+        self._flush_events = []
+        self._closing = False
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    def emit(self, record):
+        try:
+            # Arguments may change by the time the record is formatted. Child
+            # process lines come without any, like most records.
+            item = self._format_item(record) if record.args or record.exc_info else record
+            with self._condition:
+                if self._closing:
+                    # Late records, logged after shutdown, are written right away
+                    with self._write_lock:
+                        self._write(self._format_item(item).encode('utf-8'))
+                    return
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='nimp_log_file', daemon=True)
+                    self._thread.start()
+                self._buffer.append(item)
+                self._buffer_size += len(item) if isinstance(item, str) else len(str(item.msg))
+                if self._buffer_size >= self.flush_size:
+                    self._condition.notify()
+        # pylint: disable=broad-except
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """Blocks until records emitted so far are written"""
+        with self._condition:
+            if self._thread is None or self._closing or self._thread is threading.current_thread():
+                return
+            done = threading.Event()
+            self._flush_events.append(done)
+            self._condition.notify()
+        done.wait()
+
+    def close(self):
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        with self._write_lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+        super().close()
+
+    def _run(self):
+        closing = False
+        while not closing:
+            with self._condition:
+                if not self._closing and not self._flush_events and self._buffer_size < self.flush_size:
+                    self._condition.wait(self.flush_interval)
+                items, self._buffer = self._buffer, []
+                self._buffer_size = 0
+                flush_events, self._flush_events = self._flush_events, []
+                closing = self._closing
+            data = ''.join(self._format_items(items))
+            try:
+                if data:
+                    with self._write_lock:
+                        self._write(data.encode('utf-8'))
+            # pylint: disable=broad-except
+            except Exception:
+                # Buffered records are dropped, as a failing WatchedFileHandler would
+                if logging.raiseExceptions:
+                    traceback.print_exc(file=sys.stderr)
+            for event in flush_events:
+                event.set()
+
+    def _format_item(self, item):
+        '''Returns a buffered item, a record or an already formatted one, as written'''
+        if isinstance(item, str):
+            return item
+        return self.format(item) + self.terminator
+
+    def _format_items(self, items):
+        for item in items:
+            try:
+                yield self._format_item(item)
+            # pylint: disable=broad-except
+            except Exception:
+                self.handleError(item)
+
+    def _write(self, data):
+        if self._stream is not None and self._stream_id != self._get_file_id():
+            self._stream.close()
+            self._stream = None
+        if self._stream is not None and self._should_rotate(len(data)):
+            self._stream.close()
+            self._stream = None
+            self._rotate()
+        if self._stream is None:
+            self._stream = self._open()
+        self._stream.write(data)
+        self._stream.flush()
+        self._stream_size += len(data)
+
+    def _get_file_id(self):
+        try:
+            stat = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _should_rotate(self, size):
+        return self.max_bytes > 0 and self.backup_count > 0 and self._stream_size + size > self.max_bytes
+
+    def _get_backup_filename(self, index):
+        # Compression extension is kept last, so backups can still be read
+        # with the usual tools
+        if self._compression is None:
+            return '%s.%d' % (self.baseFilename, index)
+        return '%s.%d%s' % (self.baseFilename[: -len(self._compression)], index, self._compression)
+
+    def _rotate(self):
+        for index in range(self.backup_count - 1, 0, -1):
+            source = self._get_backup_filename(index)
+            if os.path.exists(source):
+                os.replace(source, self._get_backup_filename(index + 1))
+        if os.path.exists(self.baseFilename):
+            os.replace(self.baseFilename, self._get_backup_filename(1))
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        # Appending to a compressed file adds a new member / frame to it,
+        # which decompression tools handle transparently
+        if self._compression == '.gz':
+            stream = gzip.open(self.baseFilename, 'ab')
+        elif self._compression == '.zst':
+            stream = zstandard.ZstdCompressor().stream_writer(open(self.baseFilename, 'ab'))
+        else:
+            stream = open(self.baseFilename, 'ab')
+        self._stream_id = self._get_file_id()
+        self._stream_size = 0 if self._compression is not None else os.path.getsize(self.baseFilename)
+        return stream
+
+
+class QueuedHandlers(logging.handlers.QueueHandler):
+    """Forwards records to a set of handlers from a dedicated thread.
+
+    Emitting a record only costs a queue insertion, so formatting, writing and
+    summary matching no longer slow down the threads reading child process
+    pipes. Records are handled in batches and handlers are flushed once the
+    queue is drained. flush() blocks until all records queued so far have been
+    handled, which keeps child output ordered with other log messages."""
+
+    BATCH_SIZE = 1024
+
+    def __init__(self, *handlers):
+        super().__init__(queue.SimpleQueue())
+        self.handlers = list(handlers)
+        self._thread = None
+
+    def prepare(self, record):
+        # Child process lines come without arguments nor exception info,
+        # merging them into the message would only cost a copy
+        if record.args or record.exc_info:
+            return super().prepare(record)
+        return record
+
+    def start(self):
+        """Starts the thread handling queued records"""
+        assert self._thread is None
+        self._thread = threading.Thread(target=self._run, name='nimp_log_writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Handles remaining records, then stops the thread"""
+        if self._thread is not None:
+            self.queue.put_nowait(None)
+            self._thread.join()
+            self._thread = None
+
+    def flush(self):
+        if self._thread is not None and self._thread is not threading.current_thread():
+            done = threading.Event()
+            self.queue.put_nowait(done)
+            done.wait()
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.BATCH_SIZE:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            flushed = []
+            _BATCHING.active = True
+            try:
+                for item in batch:
+                    if item is None:
+                        running = False
+                    elif isinstance(item, threading.Event):
+                        flushed.append(item)
+                    else:
+                        for handler in self.handlers:
+                            if item.levelno >= handler.level:
+                                handler.handle(item)
+            finally:
+                _BATCHING.active = False
+            self._flush_handlers()
+            for event in flushed:
+                event.set()
+
+    def _flush_handlers(self):
+        for handler in self.handlers:
+            try:
+                handler.flush()
+            # pylint: disable=broad-except
+            except Exception:
+                logging.debug('Error while flushing log handler %s', handler, exc_info=True)
+
+
 class SensitiveDataFilter(logging.Filter):
     """Custom filter to hide specific information from logging stream"""
 
@@ -24,19 +24,33 @@
 
 from __future__ import annotations
 
+import abc
+import codecs
+import collections
+import concurrent.futures
 import ctypes
+import json
 import locale
 import logging
 import os
 import os.path
+import queue
+import re
+import selectors
+import signal
 import struct
 import subprocess
+import sys
+import tempfile
 import threading
 import time
 from enum import Enum
 from typing import TYPE_CHECKING
 
+import psutil
+
 import nimp.sys.platform
+import nimp.utils.profiling
 
 if TYPE_CHECKING:
     from typing import Callable
@@ -52,27 +66,48 @@ class ProcessOutputStream(Enum):
     STDDBG = 3
 
 
+class StopProcess(Exception):
+    '''Raised from a capture_output callback to kill the child process right
+    away, i.e. when its output shows it is bound to fail'''
+
+
+# capture_output mode returning CapturedOutput objects instead of strings
+CAPTURE_SPILL = 'spill'
+
+# Size of the reads performed on child process pipes. Reading large chunks
+# lets us process many lines per system call on chatty processes.
+_READ_CHUNK_SIZE = 64 * 1024
+
+
 def call(
     command,
     cwd='.',
     heartbeat=0,
     stdin=None,
     encoding='utf-8',
-    capture_output: bool | Callable[[ProcessOutputStream, str], None] = False,
+    capture_output: bool | str | Callable[[ProcessOutputStream, str], None] = False,
     capture_debug=False,
     hide_output=False,
     dry_run=False,
     timeout=None,
+    log_prefix=None,
     **popen_kwargs,
 ):
-    '''Calls a process redirecting its output to nimp's output'''
+    '''Calls a process redirecting its output to nimp's output
+
+    With capture_output=True, the exit code is returned along with the whole
+    stdout and stderr strings. With capture_output=CAPTURE_SPILL, they are
+    returned as CapturedOutput objects with bounded memory usage instead.'''
     command = _sanitize_command(command)
+    job_tag = f'[{log_prefix}] ' if log_prefix else ''
 
     if not hide_output:
-        logging.info('%s "%s" in "%s"', '[DRY-RUN]' if dry_run else 'Running', command, os.path.abspath(cwd))
+        logging.info('%s%s "%s" in "%s"', job_tag, '[DRY-RUN]' if dry_run else 'Running', command, os.path.abspath(cwd))
     if dry_run:
         if capture_output is True:
             return 0, '', ''
+        elif capture_output == CAPTURE_SPILL:
+            return 0, CapturedOutput(), CapturedOutput()
         else:
             return 0
 
@@ -103,21 +138,23 @@ def call(
             stderr=subprocess.PIPE,
             stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
             bufsize=-1,
+            **_get_process_group_kwargs(),
         )
     except FileNotFoundError as ex:
         logging.error(ex)
         return 1
+    _register_child(process)
 
     if debug_pipe:
         debug_pipe.attach(process.pid)
         debug_pipe.start()
 
-    # FIXME: put all this in a class instead!
     all_pipes = {
         ProcessOutputStream.STDOUT: process.stdout,
         ProcessOutputStream.STDERR: process.stderr,
-        ProcessOutputStream.STDDBG: debug_pipe.output if debug_pipe else None,
     }
+    if debug_pipe:
+        all_pipes[ProcessOutputStream.STDDBG] = debug_pipe.output
 
     all_captures: dict[ProcessOutputStream, list[str]] = {
         ProcessOutputStream.STDOUT: [],
@@ -128,103 +165,121 @@ def call(
         if (capture_array := all_captures.get(stream)) is not None:
             capture_array.append(value)
 
+    all_spills: dict[ProcessOutputStream, CapturedOutput] = {}
+
+    def _capture_output_spill(stream: ProcessOutputStream, value: str):
+        if (capture := all_spills.get(stream)) is not None:
+            capture.append(value)
+
     capture_processor: Callable[[ProcessOutputStream, str], None] | None = None
     if capture_output is True:
         capture_processor = _capture_output_default
+    elif capture_output == CAPTURE_SPILL:
+        all_spills[ProcessOutputStream.STDOUT] = CapturedOutput()
+        all_spills[ProcessOutputStream.STDERR] = CapturedOutput()
+        capture_processor = _capture_output_spill
     elif callable(capture_output):
         capture_processor = capture_output
 
+    logger = logging.getLogger('child_processes')
+    # Child process formatters prepend the job name to each line, so summary
+    # patterns still see the original line
+    log_extra = {'nimp_job': log_prefix} if log_prefix else None
+    force_ascii = locale.getpreferredencoding().lower() != 'utf-8'
+    # Try to decode as UTF-8 with BOM first; if it fails, try CP850 on
+    # Windows, or UTF-8 with BOM and error substitution elsewhere. If
+    # it fails again, try CP850 with error substitution.
+    encodings = [
+        (encoding, 'strict'),
+        ('ascii', 'backslashreplace') if force_ascii else ('utf-8-sig', 'strict'),
+        ('cp850', 'strict') if nimp.sys.platform.is_windows() else ('utf-8-sig', 'replace'),
+        ('cp850', 'replace'),
+    ]
     debug_info = [False]
+    stop_requests: list[StopProcess] = []
 
-    def _heartbeat_worker(heartbeat):
-        last_time = time.monotonic()
-        while process is not None:
-            if heartbeat > 0 and time.monotonic() > last_time + heartbeat:
-                logging.info("Keepalive for %s", command[0])
-                last_time += heartbeat
-            time.sleep(0.050)
+    def _output_handler(index: ProcessOutputStream, line: str) -> None:
+        if capture_processor is not None:
+            try:
+                capture_processor(index, line)
+            except StopProcess as stop:
+                # The process is stopped from the pump loop, once the lines
+                # already read have all been handled
+                if not stop_requests:
+                    stop_requests.append(stop)
+                    pump.stop()
+
+        # Stop logging stdout once data has arrived on OutputDebugString, the
+        # same messages would otherwise be logged twice. The pipe is still
+        # drained so the child never blocks on a full buffer.
+        if index == ProcessOutputStream.STDDBG:
+            if not debug_info[0]:
+                logging.info('Stopping stdout monitoring (OutputDebugString is active)')
+            debug_info[0] = True
+        elif index == ProcessOutputStream.STDOUT and debug_info[0]:
+            return
 
-    def _input_worker(in_pipe, data):
-        in_pipe.write(data)
-        in_pipe.close()
+        if not hide_output and logger.isEnabledFor(logging.INFO):
+            # Build the record directly: looking up the caller frame, as
+            # logger.info does, costs more than handling the record itself
+            record = logger.makeRecord(
+                logger.name, logging.INFO, __file__, 0, line.strip('\n').strip('\r'), None, None, extra=log_extra
+            )
+            logger.handle(record)
 
-    def _output_worker(index: ProcessOutputStream, decoding_format) -> None:
-        in_pipe = all_pipes[index]
-        if in_pipe is None:
-            return
-        force_ascii = locale.getpreferredencoding().lower() != 'utf-8'
-        while process is not None:
-            logger = logging.getLogger('child_processes')
-            # Try to decode as UTF-8 with BOM first; if it fails, try CP850 on
-            # Windows, or UTF-8 with BOM and error substitution elsewhere. If
-            # it fails again, try CP850 with error substitution.
-            encodings = [
-                (decoding_format, 'strict'),
-                ('ascii', 'backslashreplace') if force_ascii else ('utf-8-sig', 'strict'),
-                ('cp850', 'strict') if nimp.sys.platform.is_windows() else ('utf-8-sig', 'replace'),
-                ('cp850', 'replace'),
-            ]
-            for data in iter(in_pipe.readline, b''):
-                for encoding, errors in encodings:
-                    try:
-                        line = data.decode(encoding, errors=errors)
-                        break
-                    except UnicodeError:
-                        pass
-
-                if capture_processor is not None:
-                    capture_processor(index, line)
-
-                # Stop reading data from stdout if data has arrived on OutputDebugString
-                if index == 2:
-                    debug_info[0] = True
-                elif index == 0 and debug_info[0]:
-                    logging.info('Stopping stdout monitoring (OutputDebugString is active)')
-                    all_pipes[ProcessOutputStream.STDOUT].close()
-                    return
-
-                if not hide_output:
-                    logger.info(line.strip('\n').strip('\r'))
-
-            # Sleep for 10 milliseconds if there was no data,
-            # or we’ll hog the CPU.
-            time.sleep(0.010)
-
-    # Default threads
-    all_workers = [
-        threading.Thread(target=_output_worker, args=(i, encoding))
-        for i in [
-            ProcessOutputStream.STDOUT,
-            ProcessOutputStream.STDERR,
-            ProcessOutputStream.STDDBG,
-        ]
-    ]
+    pump = _OutputPump.create(all_pipes, _output_handler, encodings)
+    # The debug pipe is only closed when the logger is stopped, which can
+    # only happen once the child process has exited
+    pump.set_auxiliary(ProcessOutputStream.STDDBG)
 
-    # Thread to feed stdin data if necessary
-    if stdin is not None:
-        all_workers.append(threading.Thread(target=_input_worker, args=(process.stdin, stdin.encode(encoding))))
+    resources = _ResourceMonitor(process.pid)
+    pump.add_timer(_ResourceMonitor.SAMPLE_INTERVAL, resources.sample)
 
     # Send keepalive to stderr if requested
     if heartbeat > 0:
-        all_workers.append(threading.Thread(target=_heartbeat_worker, args=(heartbeat,)))
+        pump.add_timer(heartbeat, lambda: logging.info("%sKeepalive for %s", job_tag, command[0]))
 
-    for thread in all_workers:
-        thread.start()
+    # Thread to feed stdin data if necessary
+    input_worker = None
+    if stdin is not None:
+        input_worker = threading.Thread(target=_input_worker, args=(process.stdin, stdin.encode(encoding)))
+        input_worker.start()
 
     try:
-        exit_code = process.wait(timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not pump.run(deadline):
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        resources.sample()
+        if stop_requests:
+            if not hide_output:
+                logging.info('%sStopping %s: %s', job_tag, command[0], stop_requests[0])
+            kill_process_tree(process.pid)
+        exit_code = process.wait(None if deadline is None else max(0, deadline - time.monotonic()))
     finally:
-        process = None
-        # For some reason, must be done _before_ threads are joined, or
-        # we get stuck waiting for something!
+        # Timeout, Ctrl-C or any other error: don't leave the process tree behind
+        if process.poll() is None:
+            logging.debug('Killing process tree of %s (pid %d)', command[0], process.pid)
+            kill_process_tree(process.pid)
+        _unregister_child(process)
+        # Must be done _before_ the pump is closed, so the debug pipe reaches
+        # end of file and its reader can be joined
         if debug_pipe:
             debug_pipe.stop()
             debug_pipe = None
-        for thread in all_workers:
-            thread.join()
+        pump.close()
+        if input_worker is not None:
+            input_worker.join()
 
+    resources.stop()
+    nimp.utils.profiling.add_phase_time('child processes', resources.wall_time)
     if not hide_output:
-        logging.info('Finished with exit code %d (0x%08x)', exit_code, exit_code)
+        # Child output may still be queued for writing, make sure it comes
+        # before the exit code
+        for handler in logger.handlers:
+            handler.flush()
+        logging.info('%sFinished with exit code %d (0x%08x)', job_tag, exit_code, exit_code)
+        resources.log(job_tag)
+    resources.write_metrics(command, cwd, exit_code)
 
     if capture_output is True:
         return (
@@ -232,9 +287,595 @@ def call(
             ''.join(all_captures[ProcessOutputStream.STDOUT]),
             ''.join(all_captures[ProcessOutputStream.STDERR]),
         )
+    if capture_output == CAPTURE_SPILL:
+        return exit_code, all_spills[ProcessOutputStream.STDOUT], all_spills[ProcessOutputStream.STDERR]
     return exit_code
 
 
+class _ResourceMonitor:
+    '''Samples the resources used by a child process and its descendants.
+
+    Values are sampled, so descendants living less than SAMPLE_INTERVAL may
+    be missed. When the NIMP_PROCESS_METRICS_FILE environment variable is set,
+    a JSON record is appended to that file for each process.'''
+
+    SAMPLE_INTERVAL = 1.0
+    _METRICS_LOCK = threading.Lock()
+
+    def __init__(self, pid):
+        self._start_time = time.time()
+        self._start = time.monotonic()
+        self.wall_time = 0.0
+        self.peak_rss = 0
+        self._cpu_times = {}
+        self._io_counters = {}
+        try:
+            self._root = psutil.Process(pid)
+        except psutil.Error:
+            self._root = None
+        self.sample()
+
+    @property
+    def user_time(self):
+        return sum(user for user, _ in self._cpu_times.values())
+
+    @property
+    def system_time(self):
+        return sum(system for _, system in self._cpu_times.values())
+
+    @property
+    def read_bytes(self):
+        return sum(read for read, _ in self._io_counters.values())
+
+    @property
+    def write_bytes(self):
+        return sum(write for _, write in self._io_counters.values())
+
+    def sample(self):
+        '''Records current resource usage of the process tree'''
+        if self._root is None:
+            return
+        try:
+            processes = [self._root, *self._root.children(recursive=True)]
+        except psutil.Error:
+            return
+
+        rss = 0
+        for process in processes:
+            try:
+                with process.oneshot():
+                    rss += process.memory_info().rss
+                    cpu_times = process.cpu_times()
+                    io_counters = process.io_counters() if hasattr(process, 'io_counters') else None
+            except psutil.Error:
+                continue
+            # psutil.Process objects are identified by pid and creation time,
+            # so recycled pids are not mixed up
+            self._cpu_times[process] = (cpu_times.user, cpu_times.system)
+            if io_counters is not None:
+                self._io_counters[process] = (io_counters.read_bytes, io_counters.write_bytes)
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def stop(self):
+        '''Stops the wall clock'''
+        self.wall_time = time.monotonic() - self._start
+
+    def log(self, job_tag=''):
+        byte2mib = 1.0 / 1024 / 1024
+        logging.info(
+            '%sResources: %.2fs wall, %.2fs user, %.2fs system, %.2f MiB peak RSS, %.2f MiB read, %.2f MiB written',
+            job_tag,
+            self.wall_time,
+            self.user_time,
+            self.system_time,
+            self.peak_rss * byte2mib,
+            self.read_bytes * byte2mib,
+            self.write_bytes * byte2mib,
+        )
+
+    def write_metrics(self, command, cwd, exit_code):
+        '''Appends a JSON record to the NIMP_PROCESS_METRICS_FILE file, if set'''
+        metrics_file_path = os.environ.get('NIMP_PROCESS_METRICS_FILE')
+        if not metrics_file_path:
+            return
+        record = {
+            'command': command,
+            'cwd': os.path.abspath(cwd),
+            'start_time': self._start_time,
+            'exit_code': exit_code,
+            'wall_time': self.wall_time,
+            'user_time': self.user_time,
+            'system_time': self.system_time,
+            'peak_rss': self.peak_rss,
+            'read_bytes': self.read_bytes,
+            'write_bytes': self.write_bytes,
+        }
+        try:
+            with _ResourceMonitor._METRICS_LOCK, open(metrics_file_path, 'a', encoding='utf-8') as metrics_file:
+                metrics_file.write(json.dumps(record) + '\n')
+        except OSError as ex:
+            logging.warning('Unable to write process metrics to %s: %s', metrics_file_path, ex)
+
+
+class CapturedOutput:
+    '''Child process stream captured with bounded memory usage.
+
+    The last lines are kept in memory in `tail`, while the whole stream is
+    spooled to a temporary file once it grows big. Iterating or searching the
+    capture reads it back chunk by chunk, it is never loaded at once unless
+    read() is called.'''
+
+    TAIL_LINES = 1000
+    SPOOL_SIZE = 1024 * 1024
+    _READ_SIZE = 1024 * 1024
+
+    def __init__(self, tail_lines=None):
+        self.tail = collections.deque(maxlen=tail_lines or CapturedOutput.TAIL_LINES)
+        self._file = tempfile.SpooledTemporaryFile(
+            max_size=CapturedOutput.SPOOL_SIZE, mode='w+', encoding='utf-8', newline=''
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ex_type, value, traceback):
+        self.close()
+
+    def close(self):
+        '''Releases the temporary file backing this capture'''
+        self._file.close()
+
+    def append(self, line):
+        '''Adds a line to the capture'''
+        self.tail.append(line)
+        self._file.write(line)
+
+    def chunks(self):
+        '''Iterates over the captured text by large chunks'''
+        position = 0
+        while True:
+            self._file.seek(position)
+            chunk = self._file.read(CapturedOutput._READ_SIZE)
+            position = self._file.tell()
+            # Put the file back where append() expects it
+            self._file.seek(0, os.SEEK_END)
+            if not chunk:
+                return
+            yield chunk
+
+    def __iter__(self):
+        pending = ''
+        for chunk in self.chunks():
+            lines = (pending + chunk).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if pending:
+            yield pending
+
+    def __contains__(self, text):
+        overlap = len(text) - 1
+        previous = ''
+        for chunk in self.chunks():
+            window = previous + chunk
+            if text in window:
+                return True
+            previous = window[len(window) - overlap :] if overlap > 0 else ''
+        return False
+
+    def __str__(self):
+        return self.read()
+
+    def finditer(self, pattern, flags=0):
+        '''Yields the matches of a regular expression on each captured line'''
+        regex = re.compile(pattern, flags)
+        for line in self:
+            yield from regex.finditer(line)
+
+    def read(self):
+        '''Returns the whole captured text'''
+        return ''.join(self.chunks())
+
+
+class ProcessJob:
+    '''A child process to run with call_many'''
+
+    def __init__(self, command, name=None, **call_kwargs):
+        self.command = command
+        self.name = name
+        self.call_kwargs = call_kwargs
+
+
+def call_many(jobs, max_workers=None, **call_kwargs):
+    '''Runs several processes concurrently, at most max_workers at a time
+    (CPU count by default). Jobs are ProcessJob instances or plain commands,
+    call_kwargs are passed to every call and may be overridden per job. Output
+    lines of each job are prefixed with its name (its index by default).
+    Returns the results of each call, in job order.'''
+    jobs = [job if isinstance(job, ProcessJob) else ProcessJob(job) for job in jobs]
+    if not jobs:
+        return []
+
+    def _run_job(index, job):
+        kwargs = {**call_kwargs, **job.call_kwargs}
+        kwargs.setdefault('log_prefix', job.name if job.name is not None else str(index))
+        try:
+            return call(job.command, **kwargs)
+        # pylint: disable=broad-except
+        except Exception as ex:
+            logging.error('%s failed: %s', kwargs['log_prefix'], ex)
+            if kwargs.get('capture_output') is True:
+                return 1, '', ''
+            if kwargs.get('capture_output') == CAPTURE_SPILL:
+                return 1, CapturedOutput(), CapturedOutput()
+            return 1
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+    with concurrent.futures.ThreadPoolExecutor(thread_name_prefix='nimp_call_many_', max_workers=max_workers) as pool:
+        futures = [pool.submit(_run_job, index, job) for index, job in enumerate(jobs)]
+        try:
+            return [future.result() for future in futures]
+        except KeyboardInterrupt:
+            # Children lead their own process group and don't get the Ctrl-C
+            for future in futures:
+                future.cancel()
+            _kill_running_children()
+            raise
+
+
+def _input_worker(in_pipe, data):
+    try:
+        in_pipe.write(data)
+        in_pipe.close()
+    except (BrokenPipeError, OSError):
+        # The child process exited without reading all of its input
+        pass
+
+
+class _StreamDecoder:
+    '''Incrementally decodes a child process stream.
+
+    Encodings are (encoding, errors) couples tried in order. Whole chunks are
+    decoded with the first one, which is much cheaper than decoding line by
+    line. When a chunk fails, it is decoded line by line instead, and only the
+    offending lines are decoded with the next encodings. After repeated
+    failures, the first encoding is given up on for the rest of the stream.'''
+
+    MAX_FAILURES = 16
+
+    def __init__(self, encodings):
+        self._encodings = encodings
+        encoding, errors = encodings[0]
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+        self._failures = 0
+        # Start of the current line, when the previous chunk was decoded line by line
+        self._line_start = b''
+
+    def decode(self, data, final=False):
+        '''Decodes a chunk of data, returning what can be decoded so far'''
+        text = ''
+        if self._line_start:
+            end = len(data) if final else data.find(b'\n') + 1
+            if not end and not final:
+                self._line_start += data
+                return ''
+            text = self._decode_lines(self._line_start + data[:end])
+            self._line_start = b''
+            data = data[end:]
+
+        if self._failures < self.MAX_FAILURES:
+            buffered, _ = self._decoder.getstate()
+            try:
+                return text + self._decoder.decode(data, final)
+            except UnicodeError:
+                # Bytes held back by the decoder (i.e. an incomplete multibyte
+                # sequence) are part of the chunk to decode line by line
+                self._decoder.reset()
+                data = buffered + data
+
+        end = len(data) if final else data.rfind(b'\n') + 1
+        self._line_start = data[end:]
+        return text + self._decode_lines(data[:end])
+
+    def _decode_lines(self, data):
+        return ''.join(self._decode_line(line) for line in data.splitlines(keepends=True))
+
+    def _decode_line(self, line):
+        first = 0 if self._failures < self.MAX_FAILURES else 1
+        for index in range(first, len(self._encodings)):
+            encoding, errors = self._encodings[index]
+            try:
+                text = line.decode(encoding, errors=errors)
+            except UnicodeError:
+                continue
+            if index > first:
+                self._failures += 1
+                if self._failures == self.MAX_FAILURES:
+                    logging.debug('Falling back to %s to decode process output', self._encodings[1][0])
+            return text
+        return line.decode(self._encodings[-1][0], errors='replace')
+
+
+class _OutputPump(metaclass=abc.ABCMeta):
+    '''Multiplexes the output streams of a child process on the calling thread.
+
+    Data is read in large chunks, decoded and split into lines that are handed
+    to the line handler, and timers (e.g. heartbeats) fire from the same loop, so no
+    polling is ever needed. Subclasses only implement the way chunks are
+    waited for, which is platform specific.'''
+
+    def __init__(self, pipes, line_handler, encodings):
+        self._pipes = {stream: pipe for stream, pipe in pipes.items() if pipe is not None}
+        self._line_handler = line_handler
+        self._decoders = {stream: _StreamDecoder(encodings) for stream in self._pipes}
+        self._pending = {stream: '' for stream in self._pipes}
+        self._open_streams = set(self._pipes)
+        self._auxiliary_streams = set()
+        self._timers = []
+        self._is_stopping = False
+
+    @staticmethod
+    def create(pipes, line_handler, encodings):
+        '''Returns the best pump implementation for the running platform'''
+        if nimp.sys.platform.is_windows():
+            return _ThreadedOutputPump(pipes, line_handler, encodings)
+        return _SelectorOutputPump(pipes, line_handler, encodings)
+
+    def set_auxiliary(self, stream):
+        '''Marks a stream the pump shouldn't wait for in run()'''
+        self._auxiliary_streams.add(stream)
+
+    def add_timer(self, interval, callback):
+        '''Calls callback every interval seconds while the pump runs'''
+        self._timers.append([time.monotonic() + interval, interval, callback])
+
+    def stop(self):
+        '''Makes run() return once the chunks being handled are done'''
+        self._is_stopping = True
+
+    def run(self, deadline=None):
+        '''Pumps output until all non-auxiliary streams are closed or stop()
+        is called. Returns False if the monotonic deadline was reached first.'''
+        while self._open_streams - self._auxiliary_streams and not self._is_stopping:
+            now = time.monotonic()
+            wait = self._fire_timers(now)
+            if deadline is not None:
+                if now >= deadline:
+                    return False
+                wait = deadline - now if wait is None else min(wait, deadline - now)
+            for stream, chunk in self._wait_for_chunks(wait):
+                self._feed(stream, chunk)
+        return True
+
+    def close(self):
+        '''Processes any remaining data and releases pump resources'''
+        for stream in list(self._open_streams):
+            self._feed(stream, b'')
+
+    def _fire_timers(self, now):
+        next_timer = None
+        for timer in self._timers:
+            if now >= timer[0]:
+                timer[2]()
+                # Don't try to catch up with missed ticks
+                timer[0] = max(timer[0] + timer[1], now)
+            next_timer = timer[0] - now if next_timer is None else min(next_timer, timer[0] - now)
+        return next_timer
+
+    def _feed(self, stream, chunk):
+        if stream not in self._open_streams:
+            return
+        is_final = not chunk
+        if is_final:
+            self._open_streams.discard(stream)
+
+        text = self._decoders[stream].decode(chunk, is_final)
+        lines = (self._pending[stream] + text).split('\n')
+        self._pending[stream] = lines.pop()
+        for line in lines:
+            self._line_handler(stream, line + '\n')
+
+        if is_final and self._pending[stream]:
+            self._line_handler(stream, self._pending[stream])
+            self._pending[stream] = ''
+
+    @abc.abstractmethod
+    def _wait_for_chunks(self, timeout):
+        '''Blocks up to timeout seconds (forever if None) and returns a list of
+        (stream, chunk) tuples; an empty chunk means end of file'''
+        pass
+
+
+class _SelectorOutputPump(_OutputPump):
+    '''Output pump waiting on all pipes at once with a selector'''
+
+    def __init__(self, pipes, line_handler, encodings):
+        super().__init__(pipes, line_handler, encodings)
+        self._selector = selectors.DefaultSelector()
+        for stream, pipe in self._pipes.items():
+            self._selector.register(pipe, selectors.EVENT_READ, stream)
+
+    def close(self):
+        # Process what is readily available without blocking, the pipes may
+        # still be held open by a child that is being torn down
+        while self._selector.get_map():
+            chunks = self._wait_for_chunks(0)
+            if not chunks:
+                break
+            for stream, chunk in chunks:
+                self._feed(stream, chunk)
+        self._selector.close()
+        super().close()
+
+    def _read(self, key):
+        try:
+            chunk = os.read(key.fileobj.fileno(), _READ_CHUNK_SIZE)
+        except (OSError, ValueError):
+            chunk = b''
+        if not chunk:
+            self._selector.unregister(key.fileobj)
+        return [(key.data, chunk)]
+
+    def _wait_for_chunks(self, timeout):
+        chunks = []
+        for key, _ in self._selector.select(timeout):
+            chunks.extend(self._read(key))
+        return chunks
+
+
+class _ThreadedOutputPump(_OutputPump):
+    '''Output pump for platforms where pipes can't be selected (Windows): one
+    blocking reader thread per pipe feeds a queue consumed by the pump'''
+
+    def __init__(self, pipes, line_handler, encodings):
+        super().__init__(pipes, line_handler, encodings)
+        self._queue = queue.SimpleQueue()
+        self._readers = [
+            threading.Thread(target=self._reader_worker, args=(stream, pipe), daemon=True)
+            for stream, pipe in self._pipes.items()
+        ]
+        for reader in self._readers:
+            reader.start()
+
+    def close(self):
+        for reader in self._readers:
+            reader.join()
+        while not self._queue.empty():
+            self._feed(*self._queue.get_nowait())
+        super().close()
+
+    def _reader_worker(self, stream, pipe):
+        try:
+            while chunk := pipe.read1(_READ_CHUNK_SIZE):
+                self._queue.put((stream, chunk))
+        except (OSError, ValueError):
+            pass
+        self._queue.put((stream, b''))
+
+    def _wait_for_chunks(self, timeout):
+        try:
+            chunks = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while not self._queue.empty():
+            chunks.append(self._queue.get_nowait())
+        return chunks
+
+
+# Child processes currently running, killed by the monitor when nimp ends
+_RUNNING_CHILDREN = set()
+_RUNNING_CHILDREN_LOCK = threading.Lock()
+
+# On POSIX, children lead their own process group, so killing the process
+# group of nimp doesn't reach them, and nothing in nimp runs once it is killed.
+# This process, leading its own group too, is told about process groups of
+# children over its standard input, and kills the remaining ones once nimp is
+# gone and its standard input closed.
+_WATCHDOG_SCRIPT = '''
+import os, signal, sys
+groups = set()
+for line in sys.stdin:
+    (groups.add if line[0] == '+' else groups.discard)(int(line[1:]))
+for group in groups:
+    try:
+        os.killpg(group, signal.SIGKILL)
+    except OSError:
+        pass
+'''
+_watchdog = None
+
+
+def _register_child(process):
+    with _RUNNING_CHILDREN_LOCK:
+        _RUNNING_CHILDREN.add(process)
+        _notify_watchdog('+%d\n' % process.pid)
+
+
+def _unregister_child(process):
+    with _RUNNING_CHILDREN_LOCK:
+        if process in _RUNNING_CHILDREN:
+            _RUNNING_CHILDREN.remove(process)
+            _notify_watchdog('-%d\n' % process.pid)
+
+
+def _notify_watchdog(message):
+    '''Sends a message to the watchdog process, starting it if needed. Must
+    be called with _RUNNING_CHILDREN_LOCK held.'''
+    global _watchdog
+    if nimp.sys.platform.is_windows():
+        return
+    try:
+        if _watchdog is None:
+            _watchdog = subprocess.Popen(
+                [sys.executable, '-I', '-c', _WATCHDOG_SCRIPT], stdin=subprocess.PIPE, **_get_process_group_kwargs()
+            )
+        _watchdog.stdin.write(message.encode('ascii'))
+        _watchdog.stdin.flush()
+    except OSError as ex:
+        logging.debug('Error while notifying child process watchdog: %s', ex)
+
+
+def _forget_watchdog():
+    # Forked processes must not keep the watchdog waiting once nimp is gone,
+    # and start their own one if they run children
+    global _watchdog
+    if _watchdog is not None:
+        try:
+            _watchdog.stdin.close()
+        except OSError:
+            pass
+        _watchdog = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_watchdog)
+
+
+def _kill_running_children():
+    with _RUNNING_CHILDREN_LOCK:
+        running_children = list(_RUNNING_CHILDREN)
+    for process in running_children:
+        if process.poll() is None:
+            kill_process_tree(process.pid)
+
+
+def kill_process_tree(pid):
+    '''Kills a process and all of its descendants'''
+    try:
+        root = psutil.Process(pid)
+        processes = [root, *root.children(recursive=True)]
+    except psutil.Error:
+        processes = []
+
+    # Children started by call() lead their own process group on POSIX, this
+    # also catches descendants that were reparented
+    if not nimp.sys.platform.is_windows():
+        try:
+            if os.getpgid(pid) == pid:
+                os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    for process in processes:
+        try:
+            process.kill()
+        except psutil.Error:
+            pass
+
+
+def _get_process_group_kwargs():
+    '''Popen arguments making the child lead a new process group on POSIX, so
+    the whole tree can be killed at once. Unlike preexec_fn, they are safe to
+    use while other threads are running. Children are then out of reach of
+    signals sent to the process group of nimp, so the watchdog process kills
+    them if nimp is killed.'''
+    if nimp.sys.platform.is_windows():
+        return {}
+    if sys.version_info >= (3, 11):
+        return {'process_group': 0}
+    return {'start_new_session': True}
+
+
 def _sanitize_command(command):
     new_command = []
     for it in command:
@@ -405,8 +1046,28 @@ if nimp.sys.platform.is_windows():
 else:
 
     class Monitor:
+        '''Watchdog killing child process trees when nimp ends or is
+        terminated. Children are killed by the watchdog process if nimp is
+        killed.'''
+
+        def __init__(self):
+            self._previous_handlers = {}
+
         def start(self):
-            pass
+            # Signal handlers can only be installed from the main thread
+            if threading.current_thread() is not threading.main_thread():
+                return
+            for signum in [signal.SIGTERM, signal.SIGHUP]:
+                self._previous_handlers[signum] = signal.signal(signum, self._on_signal)
+
+        def _on_signal(self, signum, _):
+            logging.debug('Received signal %d: child processes are going to be killed', signum)
+            _kill_running_children()
+            raise SystemExit(128 + signum)
 
         def stop(self):
-            pass
+            '''Stops this monitor'''
+            _kill_running_children()
+            for signum, handler in self._previous_handlers.items():
+                signal.signal(signum, handler)
+            self._previous_handlers = {}
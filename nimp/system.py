@@ -35,11 +35,11 @@ import stat
 import time
 from typing import TYPE_CHECKING
 
-import glob2
-
 import nimp.environment
 import nimp.sys.platform
 import nimp.sys.process
+import nimp.utils.globbing
+import nimp.utils.interpolation
 from nimp.utils.python import iter_plugins_entry_points
 
 if TYPE_CHECKING:
@@ -237,18 +237,101 @@ def all_map(mapper, fileset):
     return True
 
 
+def get_cache_dir():
+    '''Returns the directory where nimp keeps data between runs, which can be
+    overridden with the NIMP_CACHE_DIR environment variable'''
+    cache_dir = os.environ.get('NIMP_CACHE_DIR')
+    if cache_dir:
+        return cache_dir
+    if nimp.sys.platform.is_windows():
+        base_dir = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache'))
+    return os.path.join(base_dir, 'nimp')
+
+
+# Files looked for in parent directories at startup, all found in one scan
+WORKSPACE_MARKERS = ['.baseNimp.conf', '.nimp.conf'] + [
+    os.path.join(it, 'Engine', 'Build', 'Build.version') for it in ('UE', 'UE4', '')
+]
+
+# Results of find_dir_containing_file, per working directory
+_WORKSPACE_SCANS = {}
+
+
+def write_file_atomically(path, data):
+    '''Writes bytes to a file, creating its directory if needed. Data is
+    written to a temporary file first, then moved in place, so concurrent nimp
+    instances writing the same file never read it partially written. Raises
+    OSError on failure.'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def get_file_signature(path):
+    '''Returns the modification time and size of a file, changing when the
+    file does, or None if it does not exist'''
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+    return file_stat.st_mtime_ns, file_stat.st_size
+
+
 def find_dir_containing_file(filename):
-    '''Recursively search parent directories for a file'''
+    '''Recursively search parent directories for a file. Parent directories
+    are only listed once for the requested file and every WORKSPACE_MARKERS
+    file, results being kept for later calls'''
+    filename = os.path.normpath(filename)
+    if os.path.isabs(filename):
+        return '.' if os.path.isfile(filename) else None
+    scan = _WORKSPACE_SCANS.setdefault(os.getcwd(), {})
+    if filename not in scan:
+        markers = {filename} | {os.path.normpath(it) for it in WORKSPACE_MARKERS if os.path.normpath(it) not in scan}
+        scan.update(_scan_parent_directories(markers))
+    return scan[filename]
+
+
+def clear_workspace_scans():
+    '''Forgets results of find_dir_containing_file, for long running processes'''
+    _WORKSPACE_SCANS.clear()
+
+
+def _scan_parent_directories(filenames):
+    '''Returns the closest parent directory of the working directory
+    containing each file, or None'''
+    result = {}
+    pending = set(filenames)
     search_dir = '.'
-    while os.path.abspath(os.sep) != os.path.abspath(search_dir):
-        if os.path.exists(os.path.join(search_dir, filename)):
+    while pending:
+        try:
+            entries = {os.path.normcase(it) for it in os.listdir(search_dir)}
+        except OSError:
+            entries = set()
+        for filename in list(pending):
+            # Only check the whole path when its first component is there
+            if os.path.normcase(filename.split(os.sep)[0]) not in entries:
+                continue
+            file_path = os.path.join(search_dir, filename)
+            if os.path.exists(file_path):
+                pending.remove(filename)
+                result[filename] = search_dir if os.path.isfile(file_path) else None
+        if os.path.abspath(os.sep) == os.path.abspath(search_dir):
             break
         search_dir = os.path.join('..', search_dir)
 
-    if not os.path.isfile(os.path.join(search_dir, filename)):
-        return None
-
-    return search_dir
+    result.update((it, None) for it in pending)
+    return result
 
 
 def map_files(env):
@@ -299,30 +382,26 @@ class FileMapper:
             else:
                 source_path_len = len(split_path(src))
 
-            for pattern in patterns:
-                found = False
-                pattern = self._format(pattern)
-                if src is None:
-                    glob_path = pattern
-                else:
-                    glob_path = os.path.join(src, pattern)
-
-                for glob_source in glob2.glob(glob_path, include_hidden=True):
-                    found = True
-                    glob_source = str(glob_source)
-                    # This is merely equivalent to os.path.relpath(src, self._source_path)
-                    # except it will handle globs pattern in the base path.
-                    glob_source = os.path.normpath(glob_source)
+            formatted_patterns = [self._format(it) for it in patterns]
+            if src is None:
+                glob_paths = formatted_patterns
+            else:
+                glob_paths = [os.path.join(src, it) for it in formatted_patterns]
+
+            # Patterns are all matched in a single walk of the directories
+            all_matches = nimp.utils.globbing.glob_many(glob_paths)
+            for pattern, glob_path, matches in zip(formatted_patterns, glob_paths, all_matches):
+                for glob_source, glob_source_parts in matches:
                     if dest is not None:
-                        new_dest = split_path(glob_source)[source_path_len:]
-                        new_dest = '/'.join(new_dest)
-                        new_dest = os.path.join(dest, new_dest)
+                        # Equivalent to os.path.relpath(glob_source, src), except
+                        # it handles glob patterns in src
+                        new_dest = os.path.join(dest, *glob_source_parts[source_path_len:])
                         new_dest = os.path.normpath(new_dest)
                     else:
                         new_dest = None
 
                     yield (glob_source, new_dest)
-                if not found:
+                if not matches:
                     logging.info('No match for "%s" in "%s" (aka. "%s")', pattern, src, glob_path)
 
         return self.append(_glob_mapper)
@@ -517,9 +596,7 @@ class FileMapper:
         '''Formats given string using format arguments defined on all the
         nodes of the list.
         '''
-        result = fmt.format(**self._format_args)
-        result = time.strftime(result)
-        return result
+        return nimp.utils.interpolation.interpolate(fmt, self._format_args)
 
     def __getattr__(self, name):
         '''Usefull to simply retrieve format arguments, in config files for example.'''
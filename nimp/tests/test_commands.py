@@ -22,11 +22,22 @@
 
 '''System utilities unit tests'''
 
+import contextlib
+import glob
+import importlib
+import io
+import json
+import os
+import sys
+import tempfile
 import unittest
 import unittest.mock
 
 import nimp.tests.utils
 import nimp.nimp_cli
+import nimp.base_commands.p4
+import nimp.command
+import nimp.environment
 
 
 class _CommandTests(unittest.TestCase):
@@ -34,3 +45,100 @@ class _CommandTests(unittest.TestCase):
         '''Checks if adding files to perforce is working'''
         self.assertEqual(nimp.nimp_cli.main(['nimp', 'check', 'processes']), 0)
         self.assertEqual(nimp.nimp_cli.main(['nimp', 'check', 'status']), 0)
+
+    def test_command_index(self):
+        '''Only the selected command should be loaded once the command index is up to date'''
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with unittest.mock.patch.dict(os.environ, {'NIMP_CACHE_DIR': cache_dir}):
+                env = nimp.environment.Environment()
+                env.root_dir = '.'
+                nimp.command.discover(env, 'check')
+                self.assertGreater(len(env.command_list), 1)
+
+                nimp.command.discover(env, 'check')
+                self.assertEqual([type(it).__name__ for it in env.command_list], ['Check'])
+                nimp.command.discover(env, 'unknown-command')
+                self.assertGreater(len(env.command_list), 1)
+
+                # Modified sources invalidate the index
+                index_path = glob.glob(os.path.join(cache_dir, 'command_index_*.json'))[0]
+                with open(index_path, encoding='utf-8') as index_file:
+                    index = json.load(index_file)
+                index['sources'] = {path: 0 for path in index['sources']}
+                with open(index_path, 'w', encoding='utf-8') as index_file:
+                    json.dump(index, index_file)
+                nimp.command.discover(env, 'check')
+                self.assertGreater(len(env.command_list), 1)
+                self.assertEqual(nimp.nimp_cli.main(['nimp', 'check', 'status']), 0)
+
+    def test_command_index_project_commands(self):
+        '''New project commands packages should invalidate the command index'''
+        sys_path = list(sys.path)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            try:
+                with unittest.mock.patch.dict(os.environ, {'NIMP_CACHE_DIR': os.path.join(tmp_dir, 'cache')}):
+                    env = nimp.environment.Environment()
+                    env.root_dir = tmp_dir
+                    nimp.command.discover(env, 'check')
+                    nimp.command.discover(env, 'check')
+                    self.assertEqual([type(it).__module__ for it in env.command_list], ['nimp.base_commands.check'])
+
+                    os.makedirs(os.path.join(tmp_dir, '.nimp', 'commands'))
+                    with open(os.path.join(tmp_dir, '.nimp', 'commands', '__init__.py'), 'w') as init_file:
+                        init_file.write(
+                            'import nimp.command\n\n'
+                            'class Check(nimp.command.Command):\n'
+                            '    def configure_arguments(self, env, parser):\n'
+                            '        return True\n\n'
+                            '    def is_available(self, env):\n'
+                            "        return True, ''\n\n"
+                            '    def run(self, env):\n'
+                            '        return True\n'
+                        )
+                    # Like a new nimp process would
+                    importlib.invalidate_caches()
+                    nimp.command.discover(env, 'check')
+                    self.assertIn('commands', [type(it).__module__ for it in env.command_list])
+            finally:
+                sys.path[:] = sys_path
+                sys.modules.pop('commands', None)
+
+    def test_lazy_subparsers(self):
+        '''Only commands named on the command line should be probed, unless help is requested'''
+        with unittest.mock.patch.object(
+            nimp.base_commands.p4.P4, 'is_available', autospec=True, return_value=(True, '')
+        ) as is_available:
+            self.assertEqual(nimp.nimp_cli.main(['nimp', 'check', 'status']), 0)
+            is_available.assert_not_called()
+            with unittest.mock.patch('sys.stdout'):
+                nimp.nimp_cli.main(['nimp', '-h'])
+            is_available.assert_called()
+
+    def test_analyze_log(self):
+        '''Log chunks should be analyzed by worker processes'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, 'sample.log')
+            summary_path = os.path.join(tmp_dir, 'summary.txt')
+            with open(log_path, 'w', encoding='utf-8') as log_file:
+                log_file.write('foo\nfoo.cpp(12): error C2065: undeclared\nfoo.c:4:5: warning: unused\n')
+            with contextlib.redirect_stdout(io.StringIO()):
+                nimp.nimp_cli.main(['nimp', '--summary', summary_path, 'dev', 'analyze-log', log_path])
+            with open(summary_path, encoding='utf-8') as summary_file:
+                summary = summary_file.read()
+        self.assertIn('[ ERROR ] foo.cpp(12): error C2065: undeclared\n', summary)
+        self.assertIn('[ WARNING ] foo.c:4:5: warning: unused\n', summary)
+
+    def test_profile_log_patterns(self):
+        '''Each summary pattern should be profiled on the sample log'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, 'sample.log')
+            with open(log_path, 'w', encoding='utf-8') as log_file:
+                log_file.write('foo\nfoo.cpp(12): error C2065: undeclared\nfoo.c:4:5: warning: unused\n')
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertEqual(nimp.nimp_cli.main(['nimp', 'dev', 'profile-log-patterns', log_path]), 0)
+        lines = output.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('3 lines, '))
+        # Rows of pattern sets have no percentage: time, matches, worst time, line length, kind and name
+        matches = {row[4]: int(row[1]) for row in (line.split() for line in lines[2:]) if row[5] == '<all'}
+        self.assertEqual(matches, {'ignore': 0, 'error': 1, 'warning': 1, 'hint': 0, 'asset': 0})
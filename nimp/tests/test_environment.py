@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014-2025 Dontnod Entertainment
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Environment loading unit tests'''
+
+import argparse
+import contextlib
+import glob
+import os
+import pstats
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import nimp.environment
+import nimp.system
+import nimp.unreal
+import nimp.utils.profiling
+
+
+@contextlib.contextmanager
+def _workspace(files):
+    '''Creates files in a temporary directory and makes it the working directory'''
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for path, content in files.items():
+            os.makedirs(os.path.dirname(os.path.join(tmp_dir, path)), exist_ok=True)
+            with open(os.path.join(tmp_dir, path), 'w', encoding='utf-8') as workspace_file:
+                workspace_file.write(content)
+        with unittest.mock.patch.dict(os.environ, {'NIMP_CACHE_DIR': os.path.join(tmp_dir, 'cache')}):
+            os.chdir(tmp_dir)
+            try:
+                yield tmp_dir
+            finally:
+                os.chdir(cwd)
+
+
+def _write_config(path, **values):
+    with open(path, 'w', encoding='utf-8') as config_file:
+        config_file.write('config = %r\n' % values)
+
+
+class _EnvironmentTests(unittest.TestCase):
+    def test_find_dir_containing_file(self):
+        '''Parent directories should be searched for workspace files'''
+        files = {'.nimp.conf': '', 'UE/Engine/Build/Build.version': '', 'a/b/.baseNimp.conf': '', 'a/b/c/d': ''}
+        with _workspace(files) as tmp_dir:
+            os.chdir(os.path.join('a', 'b', 'c'))
+            self.assertEqual(nimp.system.find_dir_containing_file('.baseNimp.conf'), os.path.join('..', '.'))
+            with unittest.mock.patch('os.listdir', side_effect=AssertionError):
+                # Found by the first scan
+                self.assertEqual(
+                    nimp.system.find_dir_containing_file('.nimp.conf'), os.path.join('..', '..', '..', '.')
+                )
+                self.assertEqual(
+                    nimp.system.find_dir_containing_file('UE/Engine/Build/Build.version'),
+                    os.path.join('..', '..', '..', '.'),
+                )
+                self.assertIsNone(nimp.system.find_dir_containing_file('Engine/Build/Build.version'))
+            self.assertIsNone(nimp.system.find_dir_containing_file('c'))
+            self.assertEqual(nimp.system.find_dir_containing_file(os.path.join(tmp_dir, '.nimp.conf')), '.')
+
+    def test_config_code_cache(self):
+        '''Compiled configuration files should be cached until they change'''
+        with _workspace({}):
+            _write_config('.nimp.conf', foo='bar')
+            self.assertEqual(nimp.environment.read_config_file('.nimp.conf'), {'foo': 'bar'})
+            with unittest.mock.patch('nimp.environment.compile', create=True, side_effect=AssertionError):
+                self.assertEqual(nimp.environment.read_config_file('.nimp.conf'), {'foo': 'bar'})
+            _write_config('.nimp.conf', foo='quux')
+            self.assertEqual(nimp.environment.read_config_file('.nimp.conf'), {'foo': 'quux'})
+
+    def test_environment_snapshot(self):
+        '''Environment snapshots should be reused until configuration files change'''
+        parent_args = argparse.Namespace(uproject=None, branch=None, user_config=None, default_to_config=False)
+        with _workspace({}), unittest.mock.patch.object(nimp.environment.Environment, 'config_loaders', []):
+            with unittest.mock.patch.dict(os.environ, {'NIMP_ENVIRONMENT_SNAPSHOT': '1'}):
+                _write_config('.nimp.conf', foo='bar')
+                env = nimp.environment.Environment()
+                self.assertTrue(env._load_config(parent_args))
+                self.assertEqual((env.foo, env.root_dir), ('bar', '.'))
+
+                with unittest.mock.patch('nimp.environment.read_config_file', side_effect=AssertionError):
+                    env = nimp.environment.Environment()
+                    self.assertTrue(env._load_config(parent_args))
+                self.assertEqual(env.foo, 'bar')
+
+                _write_config('.nimp.conf', foo='quux')
+                env = nimp.environment.Environment()
+                self.assertTrue(env._load_config(parent_args))
+                self.assertEqual(env.foo, 'quux')
+
+    def test_environment_snapshot_cached_code(self):
+        '''Environment snapshots should be invalidated by configuration files loaded from the code cache'''
+        parent_args = argparse.Namespace(uproject=None, branch=None, user_config=None, default_to_config=False)
+        with _workspace({}), unittest.mock.patch.object(nimp.environment.Environment, 'config_loaders', []):
+            _write_config('.nimp.conf', foo='bar')
+            self.assertEqual(nimp.environment.read_config_file('.nimp.conf'), {'foo': 'bar'})
+            with unittest.mock.patch.dict(os.environ, {'NIMP_ENVIRONMENT_SNAPSHOT': '1'}):
+                self.assertTrue(nimp.environment.Environment()._load_config(parent_args))
+
+                with open('.nimp.conf', 'a', encoding='utf-8') as config_file:
+                    config_file.write("config['foo'] = 'appended'\n")
+                env = nimp.environment.Environment()
+                self.assertTrue(env._load_config(parent_args))
+                self.assertEqual(env.foo, 'appended')
+
+    def test_environment_snapshot_variables(self):
+        '''Environment snapshots should depend on environment variables read by configuration files'''
+        parent_args = argparse.Namespace(uproject=None, branch=None, user_config=None, default_to_config=False)
+        config = "import os\nos.environ['NIMP_TEST_BAR'] = 'bar'\nconfig = {'foo': os.getenv('NIMP_TEST_FOO')}\n"
+        with _workspace({'.nimp.conf': config}):
+            with unittest.mock.patch.object(nimp.environment.Environment, 'config_loaders', []):
+                with unittest.mock.patch.dict(os.environ, {'NIMP_ENVIRONMENT_SNAPSHOT': '1', 'NIMP_TEST_FOO': 'a'}):
+                    self.assertTrue(nimp.environment.Environment()._load_config(parent_args))
+                    del os.environ['NIMP_TEST_BAR']
+
+                    with unittest.mock.patch('nimp.environment.read_config_file', side_effect=AssertionError):
+                        env = nimp.environment.Environment()
+                        self.assertTrue(env._load_config(parent_args))
+                    self.assertEqual((env.foo, os.environ.get('NIMP_TEST_BAR')), ('a', 'bar'))
+
+                    os.environ['NIMP_TEST_FOO'] = 'b'
+                    env = nimp.environment.Environment()
+                    self.assertTrue(env._load_config(parent_args))
+                    self.assertEqual(env.foo, 'b')
+
+    def test_uproject_index(self):
+        '''Discovered uprojects should be reused until the layout changes'''
+        files = {'Default.uprojectdirs': '; Comment\nGames/\n', 'Games/Foo/Foo.uproject': '', 'Games/Bar/bar.txt': ''}
+        with _workspace(files) as tmp_dir:
+            env = argparse.Namespace(root_dir=tmp_dir)
+            expected = {os.path.join(tmp_dir, 'Games', 'Foo', 'Foo.uproject')}
+            self.assertEqual(nimp.unreal._find_uprojects(env, tmp_dir), expected)
+            self.assertTrue(os.path.isfile(os.path.join(tmp_dir, '.nimp', 'uproject_index.json')))
+            with unittest.mock.patch('glob.glob', wraps=glob.glob) as mock_glob:
+                self.assertEqual(nimp.unreal._find_uprojects(env, tmp_dir), expected)
+            self.assertEqual(mock_glob.call_count, 1)
+
+            uproject_path = os.path.join(tmp_dir, 'Games', 'Bar', 'Bar.uproject')
+            with open(uproject_path, 'w', encoding='utf-8'):
+                pass
+            self.assertEqual(nimp.unreal._find_uprojects(env, tmp_dir), expected | {uproject_path})
+
+            # Paths are relative to the working directory, as found by find_dir_containing_file
+            os.chdir(os.path.join('Games', 'Bar'))
+            with unittest.mock.patch('glob.glob', wraps=glob.glob) as mock_glob:
+                self.assertEqual(
+                    nimp.unreal._find_uprojects(env, os.path.join('..', '..', '.')),
+                    {os.path.join('..', '..', 'Games', it, it + '.uproject') for it in ('Foo', 'Bar')},
+                )
+            self.assertEqual(mock_glob.call_count, 1)
+
+    def test_profiling(self):
+        '''Profiling should write cProfile statistics and sampled stacks, and time phases'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            env = argparse.Namespace(nimp_profiling_output=os.path.join(tmp_dir, 'profile'))
+            phase_time = nimp.utils.profiling.get_phase_times().get('test', 0)
+            with unittest.mock.patch.object(nimp.utils.profiling, 'IS_PROFILING_API_AVAILABLE', False):
+                with nimp.utils.profiling.profile_run(env, ['nimp', '--nimp-profiling']):
+                    with nimp.utils.profiling.phase('test'):
+                        time.sleep(0.1)
+            self.assertGreaterEqual(nimp.utils.profiling.get_phase_times()['test'] - phase_time, 0.1)
+            pstats.Stats(os.path.join(tmp_dir, 'profile.pstats'))
+            with open(os.path.join(tmp_dir, 'profile.collapsed'), encoding='utf-8') as collapsed_file:
+                self.assertIn('test_profiling (test_environment.py:', collapsed_file.read())
+
+    def test_format(self):
+        '''Formatting should behave like str.format followed by time.strftime'''
+        env = nimp.environment.Environment()
+        env.project = 'Foo'
+        env.platforms = ['win64', 'ps5']
+        env.config = argparse.Namespace(name='shipping')
+        self.assertEqual(env.format('{project}/{platforms[1]}/{config.name!r}'), "Foo/ps5/'shipping'")
+        self.assertEqual(env.format('{project:>5}-{{}}-{count:03d}', count=7), '  Foo-{}-007')
+        self.assertEqual(env.format('{project}', project='Bar'), 'Bar')
+        self.assertEqual(env.format('{project:{width}}', width=4), 'Foo ')
+        self.assertEqual(env.format('%Y-{project}'), time.strftime('%Y') + '-Foo')
+        self.assertEqual(env.format('no fields'), 'no fields')
+        self.assertFalse(hasattr(env, 'count'))
+        with self.assertRaises(KeyError):
+            env.format('{missing}')
+        with self.assertRaises(IndexError):
+            env.format('{0}')
+        with self.assertRaises(ValueError):
+            env.format('{project')
+
+        mapper = nimp.system.FileMapper(None, format_args=vars(env))
+        self.assertEqual(mapper._format('{project}/%%'), 'Foo/%')  # pylint: disable = protected-access
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014-2025 Dontnod Entertainment
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+'''Logging utilities unit tests'''
+
+import gzip
+import io
+import logging
+import os
+import tempfile
+import threading
+import unittest
+
+import nimp.sys.logging
+
+
+class _LoggingTests(unittest.TestCase):
+    def test_queued_handlers(self):
+        '''Queued handlers should write every record, in order, once flushed'''
+        stream = io.StringIO()
+        handler = nimp.sys.logging.QueuedHandlers(nimp.sys.logging.BatchedStreamHandler(stream))
+        logger = logging.getLogger('nimp_test_queued_handlers')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        handler.start()
+        try:
+            for i in range(5000):
+                logger.info('line %d', i)
+            handler.flush()
+            self.assertEqual(stream.getvalue(), ''.join('line %d\n' % i for i in range(5000)))
+            logger.warning('last')
+        finally:
+            logger.removeHandler(handler)
+            handler.stop()
+        self.assertTrue(stream.getvalue().endswith('line 4999\nlast\n'))
+
+    def test_batched_handler(self):
+        '''Batched handlers should write right away when not used by queued handlers'''
+        stream = io.StringIO()
+        handler = nimp.sys.logging.BatchedStreamHandler(stream)
+        handler.handle(logging.makeLogRecord({'msg': 'foo', 'levelno': logging.INFO}))
+        self.assertEqual(stream.getvalue(), 'foo\n')
+
+    def test_buffered_file_handler(self):
+        '''Buffered file handlers should write every record once flushed, and rotate compressed files'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'nimp.log.gz')
+            handler = nimp.sys.logging.BufferedFileHandler(
+                path, flush_size=1024, flush_interval=60, max_bytes=64 * 1024, backup_count=2
+            )
+            try:
+                for i in range(20000):
+                    handler.handle(logging.makeLogRecord({'msg': 'line %d' % i, 'levelno': logging.INFO}))
+                handler.flush()
+            finally:
+                handler.close()
+            self.assertFalse(os.path.exists(os.path.join(tmp_dir, 'nimp.log.3.gz')))
+            lines = []
+            for file_name in ('nimp.log.2.gz', 'nimp.log.1.gz', 'nimp.log.gz'):
+                with gzip.open(os.path.join(tmp_dir, file_name), 'rt', encoding='utf-8') as log_file:
+                    lines += log_file.read().splitlines()
+            self.assertEqual(lines, ['line %d' % i for i in range(20000 - len(lines), 20000)])
+            self.assertGreater(len(lines), 10000)
+
+    def test_buffered_file_handler_formatting(self):
+        '''Buffered file handlers should format records from their own thread, except ones with arguments'''
+        formatting_threads = []
+
+        class _Formatter(logging.Formatter):
+            def format(self, record):
+                formatting_threads.append(threading.current_thread().name)
+                return super().format(record)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'nimp.log')
+            handler = nimp.sys.logging.BufferedFileHandler(path, flush_interval=60)
+            handler.setFormatter(_Formatter('%(asctime)s %(message)s'))
+            try:
+                handler.handle(logging.makeLogRecord({'msg': 'foo', 'levelno': logging.INFO}))
+                args = ['bar']
+                handler.handle(logging.makeLogRecord({'msg': '%s', 'args': (args,), 'levelno': logging.INFO}))
+                args[0] = 'baz'
+                handler.flush()
+            finally:
+                handler.close()
+            with open(path, encoding='utf-8') as log_file:
+                lines = log_file.read().splitlines()
+        self.assertEqual([it.split(' ', 2)[2] for it in lines], ['foo', "['bar']"])
+        self.assertEqual(formatting_threads, ['MainThread', 'nimp_log_file'])
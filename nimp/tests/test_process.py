@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014-2025 Dontnod Entertainment
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+'''Process utilities unit tests'''
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import psutil
+
+import nimp.sys.platform
+import nimp.sys.process
+
+
+def _python(script):
+    return [sys.executable, '-c', script]
+
+
+class _ProcessTests(unittest.TestCase):
+    def test_capture_output(self):
+        '''Captured output should be returned per stream, line endings included'''
+        command = _python('import sys; print("foo"); print("bar", file=sys.stderr); sys.stdout.write("baz")')
+        result, output, error = nimp.sys.process.call(command, capture_output=True, hide_output=True)
+        self.assertEqual(result, 0)
+        self.assertEqual(output, 'foo\nbaz')
+        self.assertEqual(error, 'bar\n')
+
+    def test_exit_code(self):
+        '''Exit code of the child process should be returned'''
+        self.assertEqual(nimp.sys.process.call(_python('import sys; sys.exit(3)'), hide_output=True), 3)
+
+    def test_stdin(self):
+        '''Data given as stdin should be fed to the child process'''
+        command = _python('import sys; sys.stdout.write(sys.stdin.read().upper())')
+        _, output, _ = nimp.sys.process.call(command, stdin='foo\nbar', capture_output=True, hide_output=True)
+        self.assertEqual(output, 'FOO\nBAR')
+
+    def test_capture_callback(self):
+        '''Capture callbacks should receive every line'''
+        lines = []
+        command = _python('for i in range(10000): print(i)')
+        nimp.sys.process.call(command, capture_output=lambda _, line: lines.append(line), hide_output=True)
+        self.assertEqual(lines, ['%d\n' % i for i in range(10000)])
+
+    def test_timeout(self):
+        '''Timeout should be raised when the child process runs for too long'''
+        with self.assertRaises(subprocess.TimeoutExpired):
+            nimp.sys.process.call(_python('import time; time.sleep(5)'), timeout=0.2, hide_output=True)
+
+    def test_stop_process(self):
+        '''StopProcess should kill the child once the lines already read are handled'''
+        lines = []
+
+        def _capture(_, line):
+            lines.append(line)
+            if 'stop\n' in lines:
+                raise nimp.sys.process.StopProcess('stopping')
+
+        command = _python(
+            'import sys, time; sys.stdout.write("foo\\nstop\\nbar\\n"); sys.stdout.flush(); time.sleep(30)'
+        )
+        start = time.monotonic()
+        with self.assertLogs('child_processes') as logs:
+            nimp.sys.process.call(command, capture_output=_capture)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(lines, ['foo\n', 'stop\n', 'bar\n'])
+        self.assertEqual([record.getMessage() for record in logs.records], ['foo', 'stop', 'bar'])
+
+    def test_call_many(self):
+        '''call_many should return per-job results in job order'''
+        jobs = [
+            nimp.sys.process.ProcessJob(_python('import sys, time; time.sleep(0.2); sys.exit(2)'), name='slow'),
+            _python('print("fast")'),
+        ]
+        results = nimp.sys.process.call_many(jobs, max_workers=2, capture_output=True, hide_output=True)
+        self.assertEqual(results, [(2, '', ''), (0, 'fast\n', '')])
+
+    def test_call_many_prefix(self):
+        '''call_many should tag logged lines with the job name'''
+        with self.assertLogs('child_processes') as logs:
+            nimp.sys.process.call_many([nimp.sys.process.ProcessJob(_python('print("foo")'), name='job')])
+        self.assertEqual([record.nimp_job for record in logs.records], ['job'])
+        self.assertEqual([record.getMessage() for record in logs.records], ['foo'])
+
+    def test_capture_spill(self):
+        '''Spilled captures should only keep the tail in memory and be searchable'''
+        command = _python('for i in range(100000): print("line %d" % i)')
+        with unittest.mock.patch.object(nimp.sys.process.CapturedOutput, 'SPOOL_SIZE', 1024):
+            result, output, error = nimp.sys.process.call(
+                command, capture_output=nimp.sys.process.CAPTURE_SPILL, hide_output=True
+            )
+        self.assertEqual(result, 0)
+        self.assertEqual(len(output.tail), nimp.sys.process.CapturedOutput.TAIL_LINES)
+        self.assertEqual(output.tail[-1], 'line 99999\n')
+        self.assertIn('line 54321\nline 54322', output)
+        self.assertNotIn('line 100000', output)
+        self.assertEqual(sum(1 for _ in output), 100000)
+        self.assertEqual([m.group(1) for m in output.finditer(r'^line (1234\d)$')], ['1234%d' % i for i in range(10)])
+        self.assertEqual(error.read(), '')
+
+    def test_decoding(self):
+        '''Multibyte characters split across reads and invalid UTF-8 should be decoded'''
+        command = _python('import sys; sys.stdout.buffer.write("é".encode() * 100000 + b"\\n")')
+        _, output, _ = nimp.sys.process.call(command, capture_output=True, hide_output=True)
+        self.assertEqual(output, 'é' * 100000 + '\n')
+
+        command = _python('import sys; sys.stdout.buffer.write(b"foo\\ncaf\\xe9\\nbar\\n")')
+        _, output, _ = nimp.sys.process.call(command, capture_output=True, hide_output=True)
+        lines = output.splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual((lines[0], lines[2]), ('foo', 'bar'))
+        self.assertTrue(lines[1].startswith('caf'))
+
+    def test_decoding_fallback(self):
+        '''Only the offending lines should be decoded with fallback encodings'''
+        encodings = [('utf-8', 'strict'), ('cp850', 'strict'), ('cp850', 'replace')]
+        decoder = nimp.sys.process._StreamDecoder(encodings)
+        data = 'é\n'.encode() * 10 + b'caf\x82\n' + 'è\n'.encode() * 10
+        text = ''.join(decoder.decode(data[i : i + 7]) for i in range(0, len(data), 7)) + decoder.decode(b'', True)
+        self.assertEqual(text.splitlines(), ['é'] * 10 + ['café'] + ['è'] * 10)
+
+    def test_metrics_file(self):
+        '''A metrics record should be appended for each process when requested'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            metrics_file_path = os.path.join(tmp_dir, 'metrics.jsonl')
+            with unittest.mock.patch.dict(os.environ, {'NIMP_PROCESS_METRICS_FILE': metrics_file_path}):
+                nimp.sys.process.call(_python('import sys; sys.exit(1)'), hide_output=True)
+                nimp.sys.process.call(_python('pass'), hide_output=True)
+            with open(metrics_file_path, encoding='utf-8') as metrics_file:
+                records = [json.loads(line) for line in metrics_file]
+        self.assertEqual([record['exit_code'] for record in records], [1, 0])
+        self.assertTrue(all(record['wall_time'] > 0 and record['peak_rss'] >= 0 for record in records))
+
+    @unittest.skipIf(nimp.sys.platform.is_windows(), 'POSIX process groups')
+    def test_timeout_kills_tree(self):
+        '''Timeout should kill the child process and all of its descendants'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pid_file_path = os.path.join(tmp_dir, 'pid')
+            script = (
+                'import subprocess, sys, time;'
+                'child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"]);'
+                f'open({pid_file_path!r}, "w").write(str(child.pid));'
+                'time.sleep(30)'
+            )
+            with self.assertRaises(subprocess.TimeoutExpired):
+                nimp.sys.process.call(_python(script), timeout=1, hide_output=True)
+            with open(pid_file_path, encoding='utf-8') as pid_file:
+                grandchild = psutil.Process(int(pid_file.read()))
+            try:
+                grandchild.wait(5)
+            except psutil.TimeoutExpired:
+                self.assertEqual(grandchild.status(), psutil.STATUS_ZOMBIE)
+
+    @unittest.skipIf(nimp.sys.platform.is_windows(), 'POSIX process groups')
+    def test_killed_parent(self):
+        '''Child processes should be killed when nimp is killed'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pid_file_path = os.path.join(tmp_dir, 'pid')
+            child_script = f'import os, time; open({pid_file_path!r}, "w").write(str(os.getpid())); time.sleep(30)'
+            script = f'import sys, nimp.sys.process; nimp.sys.process.call([sys.executable, "-c", {child_script!r}])'
+            package_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            parent = subprocess.Popen(_python(script), env=dict(os.environ, PYTHONPATH=package_dir))
+            try:
+                deadline = time.monotonic() + 30
+                while not os.path.exists(pid_file_path) or not os.path.getsize(pid_file_path):
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.1)
+                with open(pid_file_path, encoding='utf-8') as pid_file:
+                    child = psutil.Process(int(pid_file.read()))
+            finally:
+                parent.kill()
+                parent.wait()
+            try:
+                child.wait(5)
+            except psutil.TimeoutExpired:
+                self.assertEqual(child.status(), psutil.STATUS_ZOMBIE)
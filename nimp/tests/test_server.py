@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014-2025 Dontnod Entertainment
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Nimp server unit tests'''
+
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import nimp.server
+
+_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@unittest.skipIf(not nimp.server.is_supported(), 'Unix sockets and fork')
+class _ServerTests(unittest.TestCase):
+    def test_serve(self):
+        '''Served commands should run with the client working directory, environment and streams'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            workspace_dir = os.path.join(tmp_dir, 'workspace')
+            os.makedirs(os.path.join(workspace_dir, 'sub'))
+            with open(os.path.join(workspace_dir, '.nimp.conf'), 'w', encoding='utf-8') as conf_file:
+                conf_file.write('config = {"test_value": "foo"}\n')
+            env = dict(os.environ, NIMP_CACHE_DIR=os.path.join(tmp_dir, 'cache'), PYTHONPATH=_PACKAGE_DIR)
+            env.pop('NIMP_SERVER', None)
+
+            def _nimp(*args, **kwargs):
+                command = [sys.executable, '-m', 'nimp.nimp_cli', *args]
+                return subprocess.run(command, env=env, capture_output=True, text=True, **kwargs)
+
+            server_log_path = os.path.join(tmp_dir, 'server.log')
+            with open(server_log_path, 'w', encoding='utf-8') as server_log:
+                server = subprocess.Popen(
+                    [sys.executable, '-m', 'nimp.nimp_cli', 'serve', '--idle-timeout', '1'],
+                    cwd=workspace_dir,
+                    env=env,
+                    stdout=server_log,
+                    stderr=subprocess.STDOUT,
+                )
+            try:
+                deadline = time.monotonic() + 30
+                while not glob.glob(os.path.join(tmp_dir, 'cache', 'servers', '*.sock')):
+                    self.assertIsNone(server.poll())
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.1)
+
+                script = 'import os, sys; print(os.getcwd(), os.environ["NIMP_TEST_VALUE"]); sys.exit(3)'
+                env['NIMP_TEST_VALUE'] = 'bar'
+                sub_dir = os.path.realpath(os.path.join(workspace_dir, 'sub'))
+                for _ in range(2):
+                    result = _nimp('run', 'exec_cmd', sys.executable, '--', '-c', script, cwd=sub_dir)
+                    self.assertEqual(result.returncode, 1)
+                    self.assertIn('%s bar' % sub_dir, result.stdout)
+                result = _nimp('run', 'exec_cmd', 'echo', '{test_value}', cwd=workspace_dir)
+                self.assertEqual(result.returncode, 0)
+                self.assertIn('foo', result.stdout)
+
+                # Served commands should see configuration changes
+                with open(os.path.join(workspace_dir, '.nimp.conf'), 'a', encoding='utf-8') as conf_file:
+                    conf_file.write('config["test_value"] = "edited"\n')
+                result = _nimp('run', 'exec_cmd', 'echo', '{test_value}', cwd=workspace_dir)
+                self.assertEqual(result.returncode, 0)
+                self.assertIn('edited', result.stdout)
+
+                self.assertEqual(_nimp('serve', '--stop', cwd=workspace_dir).returncode, 0)
+                self.assertEqual(server.wait(30), 0)
+            finally:
+                if server.poll() is None:
+                    server.kill()
+                    server.wait()
+
+            with open(server_log_path, encoding='utf-8') as server_log:
+                self.assertEqual(server_log.read().count('Running "run exec_cmd'), 4)
+
+    def test_forward_without_server(self):
+        '''Commands should not look for their workspace server when none runs'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with unittest.mock.patch.dict(os.environ, {'NIMP_CACHE_DIR': tmp_dir}):
+                with unittest.mock.patch.object(nimp.server, 'get_socket_path') as get_socket_path:
+                    self.assertIsNone(nimp.server.forward(['nimp', 'run', 'exec_cmd', 'echo']))
+                    os.makedirs(os.path.join(tmp_dir, 'servers'))
+                    self.assertIsNone(nimp.server.forward(['nimp', 'run', 'exec_cmd', 'echo']))
+                get_socket_path.assert_not_called()
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014-2025 Dontnod Entertainment
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+'''Summary handlers unit tests'''
+
+import contextlib
+import io
+import json
+import logging
+import os
+import pickle
+import re
+import sys
+import tempfile
+import threading
+import types
+import unittest
+import unittest.mock
+
+import nimp.environment  # Imported first, nimp.unreal circularly depends on it
+import nimp.summary
+import nimp.unreal
+
+
+def _first_match(patterns, msg):
+    for pattern in patterns:
+        match = pattern.match(msg)
+        if match is not None:
+            return match.groupdict()
+    return None
+
+
+def _summary_lines(handler, lvl):
+    output = io.StringIO()
+    handler._summary[lvl].write(output)
+    return output.getvalue().splitlines(keepends=True)
+
+
+class _SummaryTests(unittest.TestCase):
+    def test_pattern_set(self):
+        '''Pattern sets should behave as matching each pattern in order'''
+        patterns = [
+            re.compile(r'.*Error: (?P<message>.*)'),
+            re.compile(r'(?P<word>\w+) (?P=word) error'),
+            re.compile(r'(\w+) \1 twice'),
+            re.compile(r'(?i)case insensitive error'),
+            re.compile(r'(?P<file>[^(]+)\((?P<line>\d+)\): error (?P<message>.*)'),
+            re.compile(r'plain error'),
+        ]
+        lines = [
+            'LogFoo: Error: something bad',
+            'foo foo error',
+            'foo bar error',
+            'foo foo twice',
+            'CASE INSENSITIVE ERROR',
+            'Source/Foo.cpp(12): error C2065: undeclared',
+            'plain error',
+            'plain warning',
+            '',
+        ]
+        pattern_set = nimp.summary.PatternSet(patterns)
+        for line in lines:
+            self.assertEqual(pattern_set.match(line), _first_match(patterns, line), line)
+
+    def test_pattern_set_prefilter(self):
+        '''Lines without any required literal should be rejected early'''
+        pattern_set = nimp.summary.PatternSet([re.compile(r'[\w/.]+:\d+: error: .*'), re.compile(r'\[Warn\]\t.*')])
+        self.assertEqual(sorted(pattern_set._literals), [': error: ', '[Warn]\t'])
+        self.assertIsNotNone(pattern_set.match('foo/bar.c:12: error: oops'))
+        self.assertIsNone(pattern_set.match('foo/bar.c:12: warning: oops'))
+        self.assertIsNone(nimp.summary.PatternSet([re.compile(r'a|b'), re.compile('abc')])._literals)
+
+        # Escapes spanning several characters must not leave their digits behind
+        pattern_set = nimp.summary.PatternSet([re.compile(r'\x1b\[31mError\0\u00e9: .*'), re.compile(r'(a)\1b12: .*')])
+        self.assertEqual(sorted(pattern_set._literals), ['\x1b[31mError', 'b12: '])
+        self.assertIsNotNone(pattern_set.match('\x1b[31mError\0é: oops'))
+
+    def test_summary_messages(self):
+        '''Errors and warnings should be recorded, using the message group when present'''
+        env = types.SimpleNamespace(
+            summary=None, summary_error_patterns=[r'.*LogCook: Error: (?P<message>.*)'], summary_warning_patterns=None
+        )
+        handler = nimp.summary.DefaultSummaryHandler(env)
+        for line in ['foo.cpp:1:2: error: bad', 'LogCook: Error: missing asset', 'foo.cpp(3,4): warning : meh', 'ok']:
+            handler._match_message(handler._error_pattern_set, line, 'error')
+            handler._match_message(handler._warning_pattern_set, line, 'warning')
+        errors = [it for it in _summary_lines(handler, 'errors') if it.startswith('[')]
+        warnings = [it for it in _summary_lines(handler, 'warnings') if it.startswith('[')]
+        self.assertEqual(errors, ['[ ERROR ] foo.cpp:1:2: error: bad\n', '[ ERROR ] missing asset\n'])
+        self.assertEqual(warnings, ['[ WARNING ] foo.cpp(3,4): warning : meh\n'])
+
+    def test_long_lines(self):
+        '''Built-in patterns should match giant lines quickly, once truncated'''
+        handler = nimp.summary.DefaultSummaryHandler(types.SimpleNamespace(summary=None, summary_max_line_length=1000))
+        msg = 'foo.cpp:1:2: error: ' + '1:' * 10**6
+        record = logging.LogRecord('child_processes', logging.INFO, __file__, 0, msg, None, None)
+        handler.emit(record)
+        errors = [it for it in _summary_lines(handler, 'errors') if it.startswith('[')]
+        self.assertEqual(len(errors), 1)
+        self.assertLessEqual(len(errors[0]), 1000 + len('[ ERROR ] \n'))
+
+    def test_pattern_validation(self):
+        '''Configured patterns prone to catastrophic backtracking should be ignored'''
+        env = types.SimpleNamespace(summary=None, summary_error_patterns=[r'(\w+)*!', r'.*Error: .*'])
+        with self.assertLogs(level=logging.ERROR):
+            handler = nimp.summary.DefaultSummaryHandler(env)
+        patterns = [it.pattern for it in handler._error_patterns]
+        self.assertNotIn(r'(\w+)*!', patterns)
+        self.assertIn(r'.*Error: .*', patterns)
+
+        compiled_patterns = [re.compile(r'(\w+)*!'), re.compile(r'LogCook: Error: .*')]
+        env = types.SimpleNamespace(summary=None, summary_error_patterns=compiled_patterns)
+        with self.assertLogs(level=logging.ERROR):
+            handler = nimp.summary.DefaultSummaryHandler(env)
+        self.assertNotIn(compiled_patterns[0], handler._error_patterns)
+        self.assertIn(compiled_patterns[1], handler._error_patterns)
+
+    def test_worker(self):
+        '''Records should be classified by the worker, and flushed before the summary is written'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            summary_path = os.path.join(tmp_dir, 'summary.txt')
+            env = types.SimpleNamespace(summary=summary_path, verbose=False)
+            logger = logging.getLogger('child_processes')
+            with unittest.mock.patch.object(sys.stdout, 'isatty', return_value=True):
+                with nimp.summary.DefaultSummaryHandler(env) as handler:
+                    for i in range(1000):
+                        logger.info('line %d', i)
+                    logger.info('foo.cpp(12): error C2065: undeclared')
+                    self.assertTrue(handler.has_errors())
+                    self.assertFalse(handler.has_warnings())
+                    logger.info('foo.cpp(13): warning C4101: unused')
+            for log_handler in list(logger.handlers):
+                logger.removeHandler(log_handler)
+            logging.root.removeHandler(handler)
+            with open(summary_path, encoding='utf-8') as summary_file:
+                summary = summary_file.read()
+        self.assertIn('[ ERROR ] foo.cpp(12): error C2065: undeclared\n', summary)
+        self.assertIn('[ WARNING ] foo.cpp(13): warning C4101: unused\n', summary)
+
+    def test_log_file(self):
+        '''The NIMP_LOG_FILE handler should log every record, and be removed and closed on exit'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, 'nimp.log')
+            env = types.SimpleNamespace(summary='stdout', verbose=False)
+            logger = logging.getLogger('child_processes')
+            with unittest.mock.patch.dict(os.environ, {'NIMP_LOG_FILE': log_path}):
+                with unittest.mock.patch.object(sys.stdout, 'isatty', return_value=True):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        with nimp.summary.DefaultSummaryHandler(env) as handler:
+                            logging.info('from nimp')
+                            logger.info('from child')
+            for log_handler in list(logger.handlers):
+                logger.removeHandler(log_handler)
+            logging.root.removeHandler(handler)
+            self.assertNotIn(handler.log_all_handler, logging.root.handlers)
+            with open(log_path, encoding='utf-8') as log_file:
+                log = log_file.read()
+            handler.log_all_handler.close()
+        self.assertIn('from nimp', log)
+        self.assertIn('from child', log)
+
+    def test_worker_errors(self):
+        '''Errors in the worker should neither stop it nor leave callers waiting'''
+        env = types.SimpleNamespace(summary=None, verbose=False)
+        handler = nimp.summary.DefaultSummaryHandler(env)
+        handler._worker = threading.Thread(target=handler._run_worker, daemon=True)
+        handler._worker.start()
+        with unittest.mock.patch.object(logging, 'raiseExceptions', False):
+            with unittest.mock.patch.object(handler, '_merge_chunk_state', side_effect=ValueError):
+                handler.merge_chunk(None)
+        handler.emit(logging.makeLogRecord({'msg': 'foo.cpp(12): error C2065: undeclared'}))
+        self.assertTrue(handler.has_errors())
+        handler._stop_logging()
+
+    def test_deduplication(self):
+        '''Repeated messages should be counted once, keeping the first and last context'''
+        handler = nimp.summary.DefaultSummaryHandler(types.SimpleNamespace(summary=None, summary_max_entries=2))
+        for i in range(10000):
+            for j in range(4):
+                handler._add_notif('context %d.%d' % (i, j))
+            msg = '[2024.01.01-12.00.%02d:000][%3d]LogFoo: Warning: object 0x%x leaked' % (i % 60, i, i)
+            handler._add_msg('warning', msg)
+        handler._add_msg('warning', 'other')
+        handler._add_msg('warning', 'another')
+        self.assertEqual(len(handler._summary['warnings']), 10002)
+        self.assertFalse(handler.has_errors())
+        lines = _summary_lines(handler, 'warnings')
+        self.assertEqual(
+            lines[2:13],
+            [
+                '[  NOTIF  ] context 0.0\n',
+                '[  NOTIF  ] context 0.1\n',
+                '[  NOTIF  ] context 0.2\n',
+                '[  NOTIF  ] context 0.3\n',
+                '[ WARNING ] [2024.01.01-12.00.00:000][  0]LogFoo: Warning: object 0x0 leaked\n',
+                '[ REPEAT ] 9999 more time(s), last one:\n',
+                '[  NOTIF  ] context 9999.0\n',
+                '[  NOTIF  ] context 9999.1\n',
+                '[  NOTIF  ] context 9999.2\n',
+                '[  NOTIF  ] context 9999.3\n',
+                '[ WARNING ] [2024.01.01-12.00.39:000][9999]LogFoo: Warning: object 0x270f leaked\n',
+            ],
+        )
+        warnings = [it for it in lines if it.startswith('[ WARNING ] ')]
+        self.assertEqual(warnings[2:], ['[ WARNING ] other\n', '[ WARNING ] another\n'])
+
+        # Spilled messages should still be counted, and written in the order they were first seen
+        for msg in ['a', 'b', 'c', 'a', 'd', 'e', 'b', 'a']:
+            handler._add_msg('error', msg)
+        lines = [it for it in _summary_lines(handler, 'errors') if it.startswith('[ ')]
+        self.assertEqual(
+            lines,
+            [
+                '[ ERROR ] a\n',
+                '[ REPEAT ] 2 more time(s), last one:\n',
+                '[ ERROR ] a\n',
+                '[ ERROR ] b\n',
+                '[ REPEAT ] 1 more time(s), last one:\n',
+                '[ ERROR ] b\n',
+                '[ ERROR ] c\n',
+                '[ ERROR ] d\n',
+                '[ ERROR ] e\n',
+            ],
+        )
+
+    def test_spill_bounded(self):
+        '''Spilling should keep one record per message, however many times messages cycle'''
+        store = nimp.summary._SummaryStore('error', 10)
+        with unittest.mock.patch.object(nimp.summary._SummaryStore, '_MIN_COMPACTION_SIZE', 0):
+            for i in range(20000):
+                store.add('message %c' % chr(ord('a') + i % 11), ('line %d' % i,))
+            spill_size = store._spill.seek(0, os.SEEK_END)
+            self.assertEqual(len(store._spilled_entries), 11)
+            self.assertLess(spill_size, 2 * 2 * 11 * len(json.dumps(['message a', ['line 19999']])) + 2)
+        output = io.StringIO()
+        store.write(output)
+        lines = output.getvalue().splitlines()
+        messages = ['[ ERROR ] message %c' % chr(ord('a') + i) for i in range(11)]
+        self.assertEqual([it for it in lines if it.startswith('[ ERROR ]')][::2], messages)
+        self.assertEqual(lines.count('[ REPEAT ] 1818 more time(s), last one:'), 2)
+        self.assertEqual(lines.count('[ REPEAT ] 1817 more time(s), last one:'), 9)
+        self.assertIn('[  NOTIF  ] line 19999', lines)
+        self.assertIn('[  NOTIF  ] line 19989', lines)
+
+    def test_streaming_formats(self):
+        '''JSON Lines and SARIF summaries should be written as messages are matched'''
+        lines = [
+            'foo.cpp(12): error C2065: undeclared',
+            'src/bar.c:4:5: warning: unused',
+            'LogCook: Error: no location',
+        ]
+        env = types.SimpleNamespace(summary_error_patterns=[r'LogCook: Error: .*'], verbose=False)
+        logger = logging.getLogger('child_processes')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for handler_type in (nimp.summary.JsonLinesSummaryHandler, nimp.summary.SarifSummaryHandler):
+                env.summary = os.path.join(tmp_dir, handler_type.__name__)
+                with unittest.mock.patch.object(sys.stdout, 'isatty', return_value=True):
+                    with handler_type(env) as handler:
+                        logger.info(lines[0])
+                        self.assertTrue(handler.has_errors())
+                        with open(env.summary, encoding='utf-8') as summary_file:
+                            self.assertIn('C2065', summary_file.read())
+                        for line in lines[1:]:
+                            logger.info(line)
+                for log_handler in list(logger.handlers):
+                    logger.removeHandler(log_handler)
+                logging.root.removeHandler(handler)
+
+            with open(os.path.join(tmp_dir, 'JsonLinesSummaryHandler'), encoding='utf-8') as summary_file:
+                results = [json.loads(line) for line in summary_file]
+            self.assertEqual([it['level'] for it in results], ['error', 'warning', 'error'])
+            self.assertEqual((results[0]['file'], results[0]['line'], results[0]['column']), ('foo.cpp', 12, None))
+            self.assertEqual((results[1]['file'], results[1]['line'], results[1]['column']), ('src/bar.c', 4, 5))
+            self.assertNotIn('file', results[2])
+
+            with open(os.path.join(tmp_dir, 'SarifSummaryHandler'), encoding='utf-8') as summary_file:
+                sarif = json.load(summary_file)
+            results = sarif['runs'][0]['results']
+            self.assertEqual([it['message']['text'] for it in results], lines)
+            location = results[1]['locations'][0]['physicalLocation']
+            self.assertEqual(location['artifactLocation'], {'uri': 'src/bar.c'})
+            self.assertEqual(location['region'], {'startLine': 4, 'startColumn': 5})
+
+    def test_chunks(self):
+        '''Merging chunks analyzed separately should give the same summary as analyzing the whole log'''
+        lines = []
+        for i in range(300):
+            if i % 37 == 0:
+                lines.append('[1/2] Loading /Game/Asset%d...' % i)
+            elif i % 7 == 0:
+                lines.append('foo.cpp(%d): error C2065: undeclared' % (i % 3))
+            elif i % 11 == 0:
+                lines.append('foo.c:%d:1: warning: unused' % (i % 4))
+            else:
+                lines.append('line %d' % i)
+
+        for handler_type in (nimp.summary.DefaultSummaryHandler, nimp.unreal.UnrealSummaryHandler):
+            env = types.SimpleNamespace(summary=None)
+            expected = handler_type(env)
+            expected.analyze_chunk([], lines)
+            merged = handler_type(env)
+            for start in range(0, len(lines), 50):
+                context_start = max(0, start - handler_type.CHUNK_CONTEXT_LINES)
+                worker = handler_type(env)
+                state = worker.analyze_chunk(lines[context_start:start], lines[start : start + 50])
+                state = pickle.loads(pickle.dumps(state))
+                merged.merge_chunk(state)
+            expected_summary, merged_summary = io.StringIO(), io.StringIO()
+            expected._write_summary(expected_summary)
+            merged._write_summary(merged_summary)
+            self.assertTrue(expected_summary.getvalue())
+            expected_lines = expected_summary.getvalue().splitlines()
+            merged_lines = merged_summary.getvalue().splitlines()
+            self.assertEqual(merged_lines, expected_lines)
+
+    def test_unreal_assets(self):
+        '''Unreal messages should be attributed to assets, formatted with hints and bounded'''
+        env = types.SimpleNamespace(
+            summary=None,
+            summary_error_patterns=[r'Error: .*'],
+            summary_warning_patterns=[r'Warning: .*'],
+            unreal_summary_max_asset_messages=2,
+            unreal_summary_hints={
+                'Missing {name}': [r'.*Can\'t find (?P<name>\w+)'],
+                'Broken {name}': [r'.*Broken (?P<name>\w+)', r'.*Corrupted (?P<name>\w+)'],
+            },
+        )
+        handler = nimp.unreal.UnrealSummaryHandler(env)
+        self.assertFalse(handler.has_errors())
+        for line in [
+            'LogInit: Display: Loading nothing...',
+            '[1/2] Loading /Game/Foo...',
+            'Error: Can\'t find Bar',
+            'Error: Corrupted Baz',
+            'Error: Corrupted Baz',
+            'Error: something else',
+            '[2/2] Loading ../Game/Qux...',
+            'Warning: Broken Quux',
+        ]:
+            handler._classify(logging.makeLogRecord({'levelno': logging.INFO}), line)
+        self.assertTrue(handler.has_errors())
+        self.assertTrue(handler.has_warnings())
+        summary = io.StringIO()
+        handler._write_summary(summary)
+        self.assertEqual(
+            summary.getvalue().splitlines(),
+            [
+                'Game/Foo :',
+                ' * ERROR   : Missing Bar',
+                ' * ERROR   : Broken Baz',
+                ' * 1 more error(s) omitted',
+                '',
+                'Game/Qux :',
+                ' * WARNING : Broken Quux',
+                '',
+            ],
+        )
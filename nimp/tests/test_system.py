@@ -24,6 +24,7 @@
 
 import os
 import itertools
+import tempfile
 import unittest
 
 import nimp.tests.utils
@@ -113,6 +114,18 @@ class _FileSetTests(unittest.TestCase):
             ('qux.ext1', 'qux.ext1'),
         )
 
+    def test_glob_many(self):
+        '''Several patterns should be globbed at once'''
+        files, src = _file_mapper()
+        src.glob('**/*.ext2', 'qux.ext1', 'missing.ext1', 'foo/*.EXT1', 'foo/bar/../quux.ext1')
+        self._check_files(
+            files(),
+            ('foo/bar/corge.ext2', 'foo/bar/corge.ext2'),
+            ('foo/quux.ext1', 'foo/quux.ext1'),
+            ('foo/quux.ext1', 'foo/quux.ext1'),
+            ('qux.ext1', 'qux.ext1'),
+        )
+
     def test_glob_src(self):
         '''Glob src should be handled'''
         files, src = _file_mapper()
@@ -158,3 +171,18 @@ class _FileSetTests(unittest.TestCase):
         files, src = _file_mapper()
         src.src('foo').to('dest').glob('quux.ext1')
         self._check_files(files(), ('foo/quux.ext1', 'dest/quux.ext1'))
+
+
+class _WriteFileTests(unittest.TestCase):
+    def test_write_file_atomically(self):
+        '''Written files should replace existing ones without leaving temporary files'''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'sub', 'file.json')
+            nimp.system.write_file_atomically(path, b'foo')
+            signature = nimp.system.get_file_signature(path)
+            nimp.system.write_file_atomically(path, b'barbaz')
+            with open(path, 'rb') as written_file:
+                self.assertEqual(written_file.read(), b'barbaz')
+            self.assertEqual(os.listdir(os.path.dirname(path)), ['file.json'])
+            self.assertNotEqual(nimp.system.get_file_signature(path), signature)
+            self.assertIsNone(nimp.system.get_file_signature(path + '.missing'))
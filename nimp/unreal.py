@@ -112,17 +112,7 @@ def load_config(env):
 
     # If no uproject information is provided, look for one
     if not hasattr(env, 'uproject_dir') or not hasattr(env, 'uproject'):
-        patterns = set()
-        for upd in glob.glob(unreal_dir + '/*.uprojectdirs'):
-            with open(upd, 'r') as upd_file:
-                for pattern in upd_file.readlines():
-                    if pattern.startswith(';'):
-                        continue
-                    patterns.add(pattern.strip())
-        ufiles = set()
-        for pat in patterns:
-            for ufile in glob.glob('%s/%s/*/*.uproject' % (unreal_dir, pat)):
-                ufiles.add(os.path.normpath(ufile.strip()))
+        ufiles = _find_uprojects(env, unreal_dir)
 
         cwd = os.getcwd()
         for ufile in ufiles:
@@ -176,6 +166,67 @@ def load_config(env):
     return True
 
 
+def _find_uprojects(env, unreal_dir):
+    '''Returns uprojects found in directories listed by .uprojectdirs files.
+    Results are kept in .nimp/uproject_index.json and reused as long as
+    .uprojectdirs files and scanned directories are unchanged.'''
+
+    # Paths are saved relative to unreal_dir, which depends on the working directory
+    def _relpath(path):
+        return os.path.relpath(path, unreal_dir)
+
+    def _abspath(path):
+        return os.path.normpath(os.path.join(unreal_dir, path))
+
+    index_path = os.path.join(env.root_dir, '.nimp', 'uproject_index.json')
+    uprojectdirs = glob.glob(unreal_dir + '/*.uprojectdirs')
+    uprojectdirs_signatures = {_relpath(it): _get_file_signature(it) for it in uprojectdirs}
+    try:
+        with open(index_path, encoding='utf-8') as index_file:
+            index = json.load(index_file)
+        if index['unreal_dir'] == os.path.abspath(unreal_dir) and index['uprojectdirs'] == uprojectdirs_signatures:
+            directories = index['directories'].items()
+            if all(_get_file_signature(_abspath(path)) == signature for path, signature in directories):
+                return {_abspath(it) for it in index['uprojects']}
+    except (OSError, ValueError, KeyError):
+        pass
+
+    patterns = set()
+    for upd in uprojectdirs:
+        with open(upd, 'r') as upd_file:
+            for pattern in upd_file.readlines():
+                if pattern.startswith(';'):
+                    continue
+                patterns.add(pattern.strip())
+    ufiles = set()
+    # New uprojects change the modification time of one of these directories
+    directories = {}
+    for pat in patterns:
+        pattern_dirs = ['%s/%s' % (unreal_dir, pat)] + glob.glob('%s/%s' % (unreal_dir, pat))
+        for directory in pattern_dirs + glob.glob('%s/%s/*/' % (unreal_dir, pat)):
+            directories[_relpath(directory)] = _get_file_signature(directory)
+        for ufile in glob.glob('%s/%s/*/*.uproject' % (unreal_dir, pat)):
+            ufiles.add(os.path.normpath(ufile.strip()))
+
+    index = {
+        'unreal_dir': os.path.abspath(unreal_dir),
+        'uprojectdirs': uprojectdirs_signatures,
+        'directories': directories,
+        'uprojects': sorted(_relpath(it) for it in ufiles),
+    }
+    try:
+        nimp.system.write_file_atomically(index_path, json.dumps(index).encode('utf-8'))
+    except OSError as ex:
+        logging.debug('Error while saving uproject index %s: %s', index_path, ex)
+    return ufiles
+
+
+def _get_file_signature(path):
+    # Signatures are compared with ones loaded from JSON, where they are lists
+    signature = nimp.system.get_file_signature(path)
+    return list(signature) if signature is not None else None
+
+
 def load_arguments(env):
     '''Loads Unreal specific environment parameters.'''
 
@@ -417,11 +468,14 @@ _MESSAGE_PATTERNS = [(re.compile(r'.*Can\'t find file.* \'\(?P<asset>[^\']\)\'.*
 
 
 class _AssetSummary:
-    def __init__(self, hints, asset_name):
-        self._hints = hints
+    def __init__(self, format_message, asset_name, max_messages=None):
+        self._format_message = format_message
         self._asset_name = asset_name
-        self._errors = set()
-        self._warnings = set()
+        self._max_messages = max_messages
+        # Dictionaries are used as ordered sets, keeping messages in log order
+        self._errors = {}
+        self._warnings = {}
+        self._omitted = {'error': 0, 'warning': 0}
 
     def get_errors(self):
         return self._errors
@@ -429,13 +483,35 @@ class _AssetSummary:
     def get_warnings(self):
         return self._warnings
 
+    def get_error_count(self):
+        """Returns the number of distinct errors, omitted ones included"""
+        return len(self._errors) + self._omitted['error']
+
+    def get_warning_count(self):
+        """Returns the number of distinct warnings, omitted ones included"""
+        return len(self._warnings) + self._omitted['warning']
+
     def add_error(self, msg):
         """Adds a message to this asset's summary"""
-        self._add_message(msg, self._errors)
+        self._add_message(self._format_message(msg), self._errors, 'error')
 
     def add_warning(self, msg):
         """Adds a message to this asset's summary"""
-        self._add_message(msg, self._warnings)
+        self._add_message(self._format_message(msg), self._warnings, 'warning')
+
+    def get_state(self):
+        """Returns picklable messages of this summary, to merge elsewhere"""
+        return self._asset_name, list(self._errors), list(self._warnings), dict(self._omitted)
+
+    def merge(self, state):
+        """Appends messages of another summary of the same asset"""
+        _, errors, warnings, omitted = state
+        for message in errors:
+            self._add_message(message, self._errors, 'error')
+        for message in warnings:
+            self._add_message(message, self._warnings, 'warning')
+        for notif_lvl, count in omitted.items():
+            self._omitted[notif_lvl] += count
 
     def write(self, destination):
         """Writes summary for this asset into destination"""
@@ -446,23 +522,19 @@ class _AssetSummary:
             destination.write(' * ERROR   : %s\n' % error)
         for warning in self._warnings:
             destination.write(' * WARNING : %s\n' % warning)
+        for notif_lvl, count in self._omitted.items():
+            if count > 0:
+                destination.write(' * %d more %s(s) omitted\n' % (count, notif_lvl))
 
         destination.write('\n')
 
-    def _add_message(self, msg, destination):
-        for message_format, patterns in self._hints.items():
-            for pattern in patterns:
-                match = pattern.match(msg)
-                if match is not None:
-                    try:
-                        group_dict = match.groupdict()
-                        message = message_format.format(**group_dict)
-                        destination.add(message)
-                        return
-                    finally:
-                        pass
-
-        destination.add(msg)
+    def _add_message(self, message, destination, notif_lvl):
+        if message in destination:
+            return
+        if self._max_messages is not None and len(destination) >= self._max_messages:
+            self._omitted[notif_lvl] += 1
+            return
+        destination[message] = None
 
 
 def _set_unreal_exe_name(env):
@@ -484,12 +556,15 @@ class UnrealSummaryHandler(nimp.summary.SummaryHandler):
         super().__init__(env)
         self._asset_summaries = {}
         self._hints = {}
-        self._load_asset_patterns = {}
         self._current_asset = None
-        self._unknown_asset = _AssetSummary(self._hints, 'Unknown location')
-        load_asset_patterns = [r'.*\[\d+\/\d+\] Loading [\.|\/]*(?P<asset>.*)\.\.\.$']
+        self._max_asset_messages = getattr(env, 'unreal_summary_max_asset_messages', 100)
+        self._unknown_asset = self._create_asset_summary('Unknown location')
+        load_asset_patterns = [r'.*?\[\d+\/\d+\] Loading [\.|\/]*(?P<asset>.*)\.\.\.$']
 
         self._load_asset_patterns = [re.compile(it) for it in load_asset_patterns]
+        # Lines not containing the literal part of every load asset pattern
+        # (most of them in a cook log) never reach the regular expressions
+        self._load_asset_pattern_set = nimp.summary.PatternSet(self._load_asset_patterns)
 
         if hasattr(env, 'unreal_summary_hints'):
             for message_format, patterns in env.unreal_summary_hints.items():
@@ -501,6 +576,13 @@ class UnrealSummaryHandler(nimp.summary.SummaryHandler):
                     except Exception as ex:
                         logging.error('Error while compiling pattern %s: %s', pattern, ex)
 
+        self._hint_formats = [fmt for fmt, patterns in self._hints.items() for _ in patterns]
+        self._hint_pattern_set = nimp.summary.PatternSet(it for patterns in self._hints.values() for it in patterns)
+        # Running totals over every asset, so that checking the exit status
+        # does not need to walk the whole asset index
+        self._error_count = 0
+        self._warning_count = 0
+
     def _add_notif(self, msg):
         self._update_current_asset(msg)
 
@@ -508,8 +590,10 @@ class UnrealSummaryHandler(nimp.summary.SummaryHandler):
         current_asset = self._update_current_asset(msg)
         if notif_lvl == 'error':
             current_asset.add_error(msg)
+            self._error_count += 1
         else:
             current_asset.add_warning(msg)
+            self._warning_count += 1
 
     def _write_summary(self, destination):
         '''Writes summary to destination'''
@@ -520,25 +604,70 @@ class UnrealSummaryHandler(nimp.summary.SummaryHandler):
 
     def has_errors(self):
         '''Returns true if errors were emitted during program execution'''
-        return len(self._unknown_asset.get_errors()) > 0
+        self.flush()
+        return self._error_count > 0
 
     def has_warnings(self):
         '''Returns true if warnings were emitted during program execution'''
-        return len(self._unknown_asset.get_warnings()) > 0
+        self.flush()
+        return self._warning_count > 0
+
+    def get_patterns(self):
+        patterns = super().get_patterns()
+        patterns += [('hint', it) for hint_patterns in self._hints.values() for it in hint_patterns]
+        patterns += [('asset', it) for it in self._load_asset_patterns]
+        return patterns
+
+    def get_pattern_sets(self):
+        return super().get_pattern_sets() + [
+            ('hint', self._hint_pattern_set),
+            ('asset', self._load_asset_pattern_set),
+        ]
+
+    def _create_asset_summary(self, asset_name):
+        return _AssetSummary(self._format_message, asset_name, self._max_asset_messages)
+
+    def _format_message(self, msg):
+        result = self._hint_pattern_set.match_index(msg)
+        if result is None:
+            return msg
+        index, group_dict = result
+        return self._hint_formats[index].format(**group_dict)
+
+    def _get_chunk_state(self):
+        current_asset = None if self._current_asset is None else self._current_asset._asset_name
+        counts = (self._error_count, self._warning_count)
+        assets = [it.get_state() for it in self._asset_summaries.values()]
+        return assets, self._unknown_asset.get_state(), current_asset, counts
+
+    def _merge_chunk_state(self, state):
+        assets, unknown_asset, current_asset, (error_count, warning_count) = state
+        # Messages preceding the first asset loaded in the chunk belong to the
+        # asset loaded last by previous chunks
+        previous_asset = self._current_asset if self._current_asset is not None else self._unknown_asset
+        previous_asset.merge(unknown_asset)
+        for asset in assets:
+            asset_name = asset[0]
+            if asset_name not in self._asset_summaries:
+                self._asset_summaries[asset_name] = self._create_asset_summary(asset_name)
+            self._asset_summaries[asset_name].merge(asset)
+        if current_asset is not None:
+            self._current_asset = self._asset_summaries[current_asset]
+        self._error_count += error_count
+        self._warning_count += warning_count
 
     def _update_current_asset(self, msg):
-        for pattern in self._load_asset_patterns:
-            match = pattern.match(msg)
-            if match is not None:
-                group_dict = match.groupdict()
-                assert 'asset' in group_dict
-                asset_name = group_dict['asset']
-                if asset_name not in self._asset_summaries:
-                    asset_summary = _AssetSummary(self._hints, asset_name)
-                    self._asset_summaries[asset_name] = asset_summary
-
-                self._current_asset = self._asset_summaries[asset_name]
-                return self._current_asset
+        group_dict = self._load_asset_pattern_set.match(msg)
+        if group_dict is not None:
+            assert 'asset' in group_dict
+            asset_name = group_dict['asset']
+            current_asset = self._asset_summaries.get(asset_name)
+            if current_asset is None:
+                current_asset = self._create_asset_summary(asset_name)
+                self._asset_summaries[asset_name] = current_asset
+
+            self._current_asset = current_asset
+            return current_asset
 
         if self._current_asset is not None:
             return self._current_asset
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014-2025 Dontnod Entertainment
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Cache for configuration files and resolved environments'''
+
+import collections.abc
+import contextlib
+import hashlib
+import json
+import logging
+import marshal
+import os
+import pickle
+import sys
+
+import nimp.system
+
+# Increase when the format of cached files changes
+_CACHE_VERSION = 2
+
+# Inputs being recorded, None when not recording
+_recorded_inputs = None
+_is_audit_hook_installed = False
+
+# Snapshots kept in memory by long running processes, per snapshot path, or
+# None when snapshots are only kept on disk
+_memory_snapshots = None
+
+
+def load_code(filename):
+    '''Returns the code object compiled from a configuration file the last
+    time it had the same modification time and size, or None. Raises OSError
+    if the configuration file does not exist. The configuration file is not
+    opened when cached, so it is recorded as an input here.'''
+    add_input(filename)
+    stat = os.stat(filename)
+    try:
+        with open(_get_code_cache_path(filename), 'rb') as cache_file:
+            version, cache_tag, mtime, size, code = marshal.load(cache_file)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if (version, cache_tag) != (_CACHE_VERSION, sys.implementation.cache_tag):
+        return None
+    if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+        return None
+    return code
+
+
+def save_code(filename, code):
+    '''Caches the code object compiled from a configuration file'''
+    stat = os.stat(filename)
+    data = marshal.dumps((_CACHE_VERSION, sys.implementation.cache_tag, stat.st_mtime_ns, stat.st_size, code))
+    _write_cache_file(_get_code_cache_path(filename), data)
+
+
+class RecordedInputs:
+    '''Inputs recorded while loading configuration'''
+
+    def __init__(self):
+        # Absolute paths of files read and directories listed
+        self.paths = set()
+        # Environment variables read, with their value at the time, or None if unset
+        self.variables = {}
+        # Environment variables set or deleted, with their final value, or None if deleted
+        self.changed_variables = {}
+
+
+class _RecordingEnviron(collections.abc.MutableMapping):
+    '''Stands for os.environ while recording inputs, recording variables
+    read before being changed'''
+
+    def __init__(self, environ, inputs):
+        self._environ = environ
+        self._inputs = inputs
+
+    def _record(self, key):
+        if key not in self._inputs.changed_variables and key not in self._inputs.variables:
+            self._inputs.variables[key] = self._environ.get(key)
+
+    def __getitem__(self, key):
+        self._record(key)
+        return self._environ[key]
+
+    def __contains__(self, key):
+        self._record(key)
+        return key in self._environ
+
+    def __setitem__(self, key, value):
+        self._environ[key] = value
+        self._inputs.changed_variables[key] = value
+
+    def __delitem__(self, key):
+        del self._environ[key]
+        self._inputs.changed_variables[key] = None
+
+    def __iter__(self):
+        keys = list(self._environ)
+        for key in keys:
+            self._record(key)
+        return iter(keys)
+
+    def __len__(self):
+        return len(self._environ)
+
+    def copy(self):
+        '''Returns a dictionary of all environment variables, like os.environ.copy'''
+        return dict(self)
+
+
+@contextlib.contextmanager
+def record_inputs():
+    '''Records files opened for reading and directories listed by the current
+    process, as well as environment variables it reads or changes, yielding
+    a RecordedInputs instance'''
+    global _recorded_inputs, _is_audit_hook_installed
+    if not _is_audit_hook_installed:
+        # Audit hooks cannot be removed, so it is installed once and only
+        # does something while recording
+        sys.addaudithook(_audit_hook)
+        _is_audit_hook_installed = True
+    inputs = RecordedInputs()
+    environ = os.environ
+    _recorded_inputs = inputs
+    # os.getenv looks os.environ up too
+    os.environ = _RecordingEnviron(environ, inputs)
+    try:
+        yield inputs
+    finally:
+        os.environ = environ
+        _recorded_inputs = None
+
+
+def add_input(path):
+    '''Records a file whose existence only was checked, if recording'''
+    inputs = _recorded_inputs
+    if inputs is not None:
+        inputs.paths.add(os.path.abspath(path))
+
+
+def keep_snapshots():
+    '''Keeps valid snapshots in memory once loaded, for later calls and
+    processes forked by this one'''
+    global _memory_snapshots
+    if _memory_snapshots is None:
+        _memory_snapshots = {}
+
+
+def keeps_snapshots():
+    '''Returns True if snapshots are kept in memory'''
+    return _memory_snapshots is not None
+
+
+def load_snapshot(key):
+    '''Returns the values and changed environment variables saved with
+    save_snapshot for the given key, if none of the inputs recorded with them
+    changed since, or None'''
+    snapshot_path = _get_snapshot_path(key)
+    try:
+        snapshot = _memory_snapshots.get(snapshot_path) if _memory_snapshots is not None else None
+        if snapshot is None:
+            with open(snapshot_path, 'rb') as snapshot_file:
+                snapshot = pickle.load(snapshot_file)
+        if snapshot['version'] != _CACHE_VERSION or snapshot['key'] != key:
+            return None
+        if any(os.environ.get(name) != value for name, value in snapshot['variables'].items()) or any(
+            nimp.system.get_file_signature(path) != signature for path, signature in snapshot['inputs'].items()
+        ):
+            if _memory_snapshots is not None:
+                _memory_snapshots.pop(snapshot_path, None)
+            return None
+        if _memory_snapshots is not None:
+            _memory_snapshots[snapshot_path] = snapshot
+        return snapshot['values'], snapshot['changed_variables']
+    # pylint: disable=broad-except
+    except Exception as ex:
+        logging.debug('Error while loading environment snapshot: %s', ex)
+        return None
+
+
+def save_snapshot(key, values, inputs):
+    '''Saves values resolved from the given RecordedInputs, to be reused by
+    later runs using the same key'''
+    snapshot = {
+        'version': _CACHE_VERSION,
+        'key': key,
+        'inputs': {path: nimp.system.get_file_signature(path) for path in inputs.paths},
+        'variables': inputs.variables,
+        'changed_variables': inputs.changed_variables,
+        'values': values,
+    }
+    try:
+        data = pickle.dumps(snapshot)
+    # pylint: disable=broad-except
+    except Exception as ex:
+        # Configuration files can define anything, functions included
+        logging.debug('Environment cannot be saved to a snapshot: %s', ex)
+        return
+    _write_cache_file(_get_snapshot_path(key), data)
+
+
+def _audit_hook(event, args):
+    inputs = _recorded_inputs
+    if inputs is None:
+        return
+    if event == 'open':
+        path, mode = args[0], args[1]
+        if mode is not None and any(it in mode for it in 'wax+'):
+            return
+    elif event in ('os.listdir', 'os.scandir'):
+        path = args[0]
+    else:
+        return
+    if isinstance(path, (str, bytes, os.PathLike)):
+        inputs.paths.add(os.path.abspath(os.fsdecode(path)))
+
+
+def _get_code_cache_path(filename):
+    path_hash = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+    return os.path.join(nimp.system.get_cache_dir(), 'config', path_hash + '.bin')
+
+
+def _get_snapshot_path(key):
+    key_hash = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(nimp.system.get_cache_dir(), 'environment', key_hash + '.pickle')
+
+
+def _write_cache_file(path, data):
+    try:
+        nimp.system.write_file_atomically(path, data)
+    except OSError as ex:
+        logging.debug('Error while writing cache file %s: %s', path, ex)
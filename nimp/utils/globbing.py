@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014-2025 Dontnod Entertainment
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Globbing of several patterns in a single directory traversal'''
+
+import fnmatch
+import os
+import re
+import stat
+
+import nimp.system
+
+# Component matching any number of directories, including none
+_GLOBSTAR = object()
+
+_MAGIC_PATTERN = re.compile('[*?[]')
+
+
+def glob_many(patterns):
+    '''Globs patterns the way glob2, which nimp used to depend on, did with
+    hidden files included: '**' matches any number of directories and
+    wildcards ignore case. Directories are listed once for all patterns, and
+    only when a pattern has a wildcard at their level. Returns, for each
+    pattern, a list of (path, path components) tuples, paths being
+    normalized.'''
+    results = [[] for _ in patterns]
+    walks = {}
+    for index, pattern in enumerate(patterns):
+        if not _MAGIC_PATTERN.search(pattern):
+            if os.path.lexists(pattern):
+                path = os.path.normpath(pattern)
+                results[index].append((path, tuple(nimp.system.split_path(path))))
+            continue
+        anchor, components, dirs_only = _compile(pattern)
+        walks.setdefault(anchor, []).append((index, components, dirs_only))
+
+    for anchor, anchor_patterns in walks.items():
+        _Walk(anchor, anchor_patterns, results).run()
+    return results
+
+
+def _compile(pattern):
+    '''Returns the anchor of a pattern (a drive and root directory, or an
+    empty string for relative patterns), its components and whether it only
+    matches directories'''
+    separators = '/\\' if os.sep == '\\' else '/'
+    drive, path = os.path.splitdrive(pattern)
+    anchor = drive + os.sep if path[:1] and path[:1] in separators else drive
+    names = [it for it in re.split('[%s]' % re.escape(separators), path) if it]
+    dirs_only = bool(path) and path[-1] in separators
+
+    components = []
+    for name in names:
+        if name == '**':
+            components.append(_GLOBSTAR)
+        elif _MAGIC_PATTERN.search(name):
+            # glob2.glob ended up matching wildcards case insensitively
+            components.append(re.compile(fnmatch.translate(name), re.IGNORECASE).match)
+        else:
+            components.append(name)
+    return anchor, components, dirs_only
+
+
+class _Walk:
+    '''Matches patterns sharing an anchor while walking directories. States
+    are (pattern, component index) tuples.'''
+
+    def __init__(self, anchor, patterns, results):
+        self._anchor = anchor
+        self._patterns = patterns
+        self._results = results
+        # Entries of a directory tree mostly go through the same transitions
+        self._transitions = {}
+
+    def run(self):
+        anchor_parts = (self._anchor,) if self._anchor else ()
+        states = self._closure((it, 0) for it in range(len(self._patterns)))
+        self._visit(self._anchor or '.', self._anchor, anchor_parts, states)
+
+    def _closure(self, states):
+        '''Adds states skipping '**' components, as they match no directory
+        too, unless last: glob2 did not return the directory itself then'''
+        result = set()
+        pending = list(states)
+        while pending:
+            state = pending.pop()
+            if state in result:
+                continue
+            result.add(state)
+            pattern, index = state
+            components = self._patterns[pattern][1]
+            is_globstar = index < len(components) and components[index] is _GLOBSTAR
+            if is_globstar and not self._is_last(pattern, index):
+                pending.append((pattern, index + 1))
+        return result
+
+    def _get_next_states(self, entry_states, is_walked):
+        key = (tuple(entry_states), is_walked)
+        next_states = self._transitions.get(key)
+        if next_states is None:
+            next_states = frozenset(self._closure(self._iter_next_states(entry_states, is_walked)))
+            self._transitions[key] = next_states
+        return next_states
+
+    def _iter_next_states(self, entry_states, is_walked):
+        for pattern, index, is_globstar in entry_states:
+            if not is_globstar:
+                yield pattern, index + 1
+                continue
+            # The entry is the last directory matched by '**', or one of them
+            # if it is walked
+            if is_walked:
+                yield pattern, index
+            if is_walked or not self._is_last(pattern, index):
+                yield pattern, index + 1
+
+    def _add_result(self, result_index, path, parts):
+        if '.' in parts or '..' in parts:
+            path = os.path.normpath(path)
+            parts = tuple(nimp.system.split_path(path))
+        self._results[result_index].append((path, parts))
+
+    def _is_last(self, pattern, index):
+        '''Returns True if a component is the last one, a trailing separator
+        counting as an empty component'''
+        _, components, dirs_only = self._patterns[pattern]
+        return index == len(components) - 1 and not dirs_only
+
+    def _visit(self, directory, prefix, parts, states):
+        literals = {}
+        wildcards = []
+        for pattern, index in states:
+            components = self._patterns[pattern][1]
+            if index == len(components):
+                continue
+            component = components[index]
+            if isinstance(component, str):
+                literals.setdefault(component, []).append((pattern, index))
+            else:
+                wildcards.append((pattern, index, component))
+
+        # name: (is directory, is symbolic link, states)
+        entries = {}
+        if wildcards:
+            try:
+                with os.scandir(directory) as scan:
+                    for entry in scan:
+                        try:
+                            is_link = entry.is_symlink()
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_link = is_dir = False
+                        entries[entry.name] = (is_dir, is_link, [])
+            except OSError:
+                pass
+            for name, (_, _, entry_states) in entries.items():
+                for pattern, index, component in wildcards:
+                    if component is _GLOBSTAR or component(name):
+                        entry_states.append((pattern, index, component is _GLOBSTAR))
+
+        # Literal components are checked like glob2 did, so case insensitive
+        # file systems match them whatever the case
+        for name, literal_states in literals.items():
+            if name not in entries:
+                try:
+                    mode = os.lstat(prefix + name).st_mode
+                except OSError:
+                    continue
+                is_link = stat.S_ISLNK(mode)
+                is_dir = stat.S_ISDIR(mode) or (is_link and os.path.isdir(prefix + name))
+                entries[name] = (is_dir, is_link, [])
+            entries[name][2].extend((pattern, index, False) for pattern, index in literal_states)
+
+        for name, (is_dir, is_link, entry_states) in entries.items():
+            if not entry_states:
+                continue
+            path = prefix + name
+            entry_parts = parts + (name,)
+            # '**' stays on the same component in subdirectories, except in
+            # symbolic links which glob2 did not walk
+            next_states = self._get_next_states(entry_states, True)
+            for pattern, index in next_states:
+                result_index, components, dirs_only = self._patterns[pattern]
+                if index == len(components) and (is_dir or not dirs_only):
+                    self._add_result(result_index, path, entry_parts)
+            if not is_dir:
+                continue
+            if is_link:
+                next_states = self._get_next_states(entry_states, False)
+            if any(index < len(self._patterns[pattern][1]) for pattern, index in next_states):
+                self._visit(path, path + os.sep, entry_parts, next_states)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014-2025 Dontnod Entertainment
+
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+'''Interpolation of format strings with configuration values'''
+
+import _string
+import functools
+import string
+import time
+
+_CONVERSIONS = {'s': str, 'r': repr, 'a': ascii}
+_FORMATTER = string.Formatter()
+
+
+class _Fallback(Exception):
+    pass
+
+
+def _compile_field(field_name, format_spec, conversion):
+    if '{' in format_spec:
+        # Nested replacement fields in the format spec are left to string.Formatter
+        raise _Fallback()
+    key, rest = _string.formatter_field_name_split(field_name)
+    if not isinstance(key, str) or not key:
+        # Positional fields always raise with keyword-only arguments, let
+        # string.Formatter report it
+        raise _Fallback()
+    convert = None
+    if conversion is not None:
+        if conversion not in _CONVERSIONS:
+            raise _Fallback()
+        convert = _CONVERSIONS[conversion]
+    return (key, tuple(rest), format_spec, convert)
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_template(fmt):
+    '''Parses a format string once and returns it as a tuple of literal
+    strings and replacement fields, or None if it uses str.format features
+    only handled by string.Formatter.'''
+    try:
+        segments = []
+        for literal, field_name, format_spec, conversion in _string.formatter_parser(fmt):
+            if literal:
+                segments.append(literal)
+            if field_name is not None:
+                segments.append(_compile_field(field_name, format_spec, conversion))
+        return tuple(segments)
+    except (_Fallback, ValueError):
+        return None
+
+
+class _ChainedValues:
+    '''Read-only view of overrides on top of values, without copying them'''
+
+    def __init__(self, values, overrides):
+        self._values = values
+        self._overrides = overrides
+
+    def __getitem__(self, key):
+        if key in self._overrides:
+            return self._overrides[key]
+        return self._values[key]
+
+
+def _render(template, values, overrides):
+    parts = []
+    for segment in template:
+        if isinstance(segment, str):
+            parts.append(segment)
+            continue
+        key, rest, format_spec, convert = segment
+        if overrides and key in overrides:
+            value = overrides[key]
+        else:
+            value = values[key]
+        for is_attribute, name in rest:
+            value = getattr(value, name) if is_attribute else value[name]
+        if convert is not None:
+            value = convert(value)
+        parts.append(format(value, format_spec))
+    return ''.join(parts)
+
+
+def interpolate(fmt, values, overrides=None):
+    '''Formats given string with given values like str.format(**values) then
+    expands strftime directives, looking up overrides first. Values are
+    never copied and format strings are only parsed once.'''
+    if '{' not in fmt and '}' not in fmt:
+        result = fmt
+    else:
+        template = compile_template(fmt)
+        if template is None:
+            result = _FORMATTER.vformat(fmt, (), _ChainedValues(values, overrides or {}))
+        else:
+            result = _render(template, values, overrides)
+    if '%' in result:
+        result = time.strftime(result)
+    return result
@@ -388,15 +388,25 @@ class P4:
         command += list(args)
         return command
 
-    def _run(self, *args, stdin=None, hide_output=False, encoding='cp437'):
+    def _run(self, *args, stdin=None, hide_output=False, encoding='cp437', lazy_output=False):
         command = self._get_p4_command(*args)
+        # Lazy output is returned as a nimp.sys.process.CapturedOutput, so
+        # huge outputs (i.e. fstat on a whole depot) are not held in memory.
+        # Callers must close it.
+        capture_output = nimp.sys.process.CAPTURE_SPILL if lazy_output else True
 
         for _ in range(5):
             result, output, error = nimp.sys.process.call(
-                command, stdin=stdin, encoding=encoding, capture_output=True, hide_output=hide_output
+                command, stdin=stdin, encoding=encoding, capture_output=capture_output, hide_output=hide_output
             )
+            if lazy_output:
+                # Only the output may be huge, errors are read at once
+                with error as error_capture:
+                    error = error_capture.read()
 
             if 'Operation took too long ' in error:
+                if lazy_output:
+                    output.close()
                 continue
 
             has_fatal_errors = False
@@ -405,24 +415,27 @@ class P4:
 
             if result != 0 or has_fatal_errors:
                 logging.info('p4 command failed: %s', error)
+                if lazy_output:
+                    output.close()
                 return None
 
             return output
 
     def _parse_command_output(self, command, *patterns, stdin=None, hide_output=False, encoding='cp437'):
-        output = self._run(*command, stdin=stdin, hide_output=hide_output, encoding=encoding)
+        output = self._run(*command, stdin=stdin, hide_output=hide_output, encoding=encoding, lazy_output=True)
 
         if output is not None:
             match_list = []
 
-            for pattern in patterns:
-                matches = list(re.finditer(pattern, output, re.MULTILINE))
-                result = []
-                for match in matches:
-                    match_string = match.group(1)
-                    match_string = match_string.strip()
-                    result.append(match_string)
-                match_list.append(result)
+            with output:
+                for pattern in patterns:
+                    matches = list(output.finditer(pattern, re.MULTILINE))
+                    result = []
+                    for match in matches:
+                        match_string = match.group(1)
+                        match_string = match_string.strip()
+                        result.append(match_string)
+                    match_list.append(result)
 
             for elem in zip(*match_list):
                 yield elem
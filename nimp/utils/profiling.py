@@ -22,6 +22,13 @@
 
 '''Nimp profiling utilities'''
 
+import collections
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
 from contextlib import contextmanager
 
 try:
@@ -31,6 +38,11 @@ try:
 except ImportError:
     IS_PROFILING_API_AVAILABLE = False
 
+# Time spent in each phase of the nimp run, in seconds. Child processes run
+# concurrently are all added up.
+_PHASE_TIMES = collections.defaultdict(float)
+_PHASE_TIMES_LOCK = threading.Lock()
+
 
 @contextmanager
 def nimp_profile(env):
@@ -44,3 +56,116 @@ def nimp_profile(env):
             yield
     finally:
         pass
+
+
+@contextmanager
+def phase(name):
+    '''Adds time spent in the block to the given phase'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase_time(name, time.perf_counter() - start)
+
+
+def add_phase_time(name, seconds):
+    '''Adds time to the given phase'''
+    with _PHASE_TIMES_LOCK:
+        _PHASE_TIMES[name] += seconds
+
+
+def get_phase_times():
+    '''Returns time spent in each phase so far, in seconds'''
+    with _PHASE_TIMES_LOCK:
+        return dict(_PHASE_TIMES)
+
+
+def reset_phase_times():
+    '''Forgets time spent in every phase'''
+    with _PHASE_TIMES_LOCK:
+        _PHASE_TIMES.clear()
+
+
+@contextmanager
+def profile_run(env, argv):
+    '''Profiles a whole nimp run when --nimp-profiling is given. Unless the
+    profiling plugin is installed, cProfile statistics of the main thread and
+    sampled stacks of every thread are written to files prefixed by
+    --nimp-profiling-output. Phase timers are logged in both cases.'''
+    # Arguments are parsed long after configuration loading starts
+    if '--nimp-profiling' not in argv[1:]:
+        yield
+        return
+
+    profiler, sampler = None, None
+    if not IS_PROFILING_API_AVAILABLE:
+        profiler, sampler = cProfile.Profile(), _StackSampler()
+        sampler.start()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        total_time = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            sampler.stop()
+            _write_profile(profiler, sampler, getattr(env, 'nimp_profiling_output', None) or 'nimp_profile')
+        logging.info('Phase timers:')
+        for name, seconds in get_phase_times().items():
+            logging.info('  %-20s %10.3fs', name, seconds)
+        logging.info('  %-20s %10.3fs', 'total', total_time)
+
+
+def _write_profile(profiler, sampler, prefix):
+    try:
+        profiler.dump_stats(prefix + '.pstats')
+        sampler.write(prefix + '.collapsed')
+    except OSError as ex:
+        logging.error('Unable to write profiling output: %s', ex)
+        return
+    logging.info('Profile written to %s.pstats (cProfile) and %s.collapsed (sampled stacks)', prefix, prefix)
+
+
+class _StackSampler:
+    '''Samples stacks of every thread at a fixed interval, counting them in
+    the collapsed format read by flame graph tools'''
+
+    INTERVAL = 0.005
+
+    def __init__(self):
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        '''Starts sampling from a background thread'''
+        self._thread = threading.Thread(target=self._run, name='nimp_profiling', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stops sampling'''
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        '''Writes one line per distinct stack, root first, followed by the
+        number of samples'''
+        with open(path, 'w', encoding='utf-8') as collapsed_file:
+            for stack, count in self.stacks.most_common():
+                collapsed_file.write('%s %d\n' % (stack, count))
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+        while not self._stop.wait(self.INTERVAL):
+            thread_names = {it.ident: it.name for it in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack)).replace('\n', ' ')] += 1